@@ -1,12 +1,20 @@
-from typing import Type, Callable, Dict
+from typing import Any, Awaitable, Type, Callable, Dict, List
 
 from app.models.base import BasicModel
-from app.models.paginate import Pagination
+from app.models.enums import CountStrategy, ExportFormat, PaginateMode
+from app.models.export import QuerySetExporter
+from app.models.paginate import CursorPagination, Pagination
+from app.schemas.bulk import BulkDeleteReq, BulkResultSchema
 from app.schemas.paginate import BasePageSchema
+from app.schemas.resp import ResponseSchema
 from common import resp
+from common.cache import ModelVersion, cache_response
+from common.exceptions import BulkOperateException, PaginationException
+from config.setting import settings
 from core.security import check_token
-from fastapi import APIRouter, status, Depends, Response, Request
-from pydantic import BaseModel as ModelBase
+from fastapi import APIRouter, status, Depends, Query, Response, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel as ModelBase, Field, create_model
 from tortoise.contrib.pydantic import pydantic_model_creator
 from tortoise.models import MODEL
 from tortoise.queryset import QuerySet
@@ -27,6 +35,8 @@ class BaseRouter(APIRouter):
         ] = None,
         model_path: str | None = None,
         tag_name: str | None = None,
+        count_strategy: CountStrategy = CountStrategy.EXACT,
+        detail_handler: Callable[[str], Awaitable[Any]] = None,
     ):
         super().__init__(dependencies=[Depends(check_token)])
         self._request_schema = request_schema
@@ -37,6 +47,58 @@ class BaseRouter(APIRouter):
         self._page_query_handler = page_query_handler
         self._model_path = model_path
         self._tag_name = tag_name
+        self._count_strategy = count_strategy
+        self._detail_handler = detail_handler
+
+    async def filter_queryset(self, query: Dict) -> QuerySet[MODEL]:
+        """
+        根据查询参数过滤列表数据，分页相关参数需要先从query中移除
+        :param query: 查询参数
+        :return:
+        """
+        search_value = query.pop("search", None)
+        queryset = self._model.fuzzy_search(search_value=search_value)  # type: ignore
+        if query:
+            if self._page_query_handler:
+                queryset = await self._page_query_handler(queryset, query)  # type: ignore
+            else:
+                queryset = queryset.filter(**query)
+        return queryset
+
+    @staticmethod
+    def parse_fields(fields: str, allowed_fields: List[str]) -> List[str]:
+        """
+        解析fields参数，多个列以逗号分隔，始终包含id
+        :param fields: fields参数
+        :param allowed_fields: 允许查询的列
+        :return:
+        """
+        select_fields = ["id"]
+        for field in fields.split(","):
+            field = field.strip()
+            if not field or field in select_fields:
+                continue
+            if field not in allowed_fields:
+                raise PaginationException(f"invalid field: {field}")
+            select_fields.append(field)
+        return select_fields
+
+    @staticmethod
+    def check_bulk_size(items: List) -> None:
+        if not items:
+            raise BulkOperateException("bulk items can not be empty")
+        if len(items) > settings.BULK_MAX_SIZE:
+            raise BulkOperateException(f"bulk items can not exceed {settings.BULK_MAX_SIZE}")
+
+    async def bulk_result(self, total: int, success_count: int, errors: List[Dict]) -> Response:
+        if success_count:
+            await ModelVersion.bump(self._model)
+        data = BulkResultSchema(
+            total=total,
+            success_count=success_count,
+            errors=sorted(errors, key=lambda error: error["index"]),
+        )
+        return resp.ok(data=data)
 
     def load_crud_routes(
         self,
@@ -49,8 +111,16 @@ class BaseRouter(APIRouter):
         model = self._model
         model_path = self._model_path
         model_name = self._model_name
-        page_query_handler = self._page_query_handler
+        count_strategy = self._count_strategy
         pydantic_model = pydantic_model_creator(model)
+        # 查询接口缓存依赖的模型，包括序列化结果中的关联模型
+        cache_models = ModelVersion.related_models(model)
+        # 分页列表只查询需要的列，跳过大字段
+        defer_fields = model.defer_fields()
+        page_fields = [field for field in model._meta.fields_db_projection if field not in defer_fields]
+        # fields参数可选的列，不包括大字段和序列化时排除的字段
+        exclude_fields = getattr(getattr(model, "PydanticMeta", None), "exclude", [])
+        sparse_fields = [field for field in page_fields if field not in exclude_fields]
         if not exclude_paginate:
 
             @self.get(
@@ -58,26 +128,60 @@ class BaseRouter(APIRouter):
                 response_model=response_schema,
                 summary=f"列出所有{model_name}",
             )
+            @cache_response(*cache_models)
             async def fetch_all(item: query_schema = Depends()) -> Response:  # type: ignore
                 query = item.dict(exclude_unset=True, exclude_none=True)  # type: ignore
                 page = query.pop("page")
                 page_size = query.pop("page_size")
-                search_value = query.pop("search", None)
-
-                queryset = model.fuzzy_search(search_value=search_value)  # type: ignore
-                if query:
-                    if page_query_handler:
-                        queryset = await page_query_handler(queryset, query)  # type: ignore
-                    else:
-                        queryset = queryset.filter(**query)
-
-                p = Pagination(page, page_size)  # type: ignore
-                ret = await p.paginate_queryset(queryset)
-                result = await pydantic_model.from_queryset(ret)
+                paginate_mode = query.pop("paginate_mode", PaginateMode.OFFSET)
+                after = query.pop("after", None)
+                before = query.pop("before", None)
+                fields = query.pop("fields", None)
+
+                filters = dict(query)
+                queryset = await self.filter_queryset(query)
+                if fields:
+                    # 只查询指定的列，直接返回字典，不经过pydantic模型序列化
+                    select_fields = self.parse_fields(fields, sparse_fields)
+
+                    async def fetch_items(qs: QuerySet[MODEL]) -> List[Dict]:
+                        return await qs.values(*select_fields)
+
+                else:
+                    if defer_fields:
+                        queryset = queryset.only(*page_fields)
+                    fetch_items = pydantic_model.from_queryset
+
+                if paginate_mode == PaginateMode.CURSOR or after or before:
+                    cp = CursorPagination(page_size, after=after, before=before)  # type: ignore
+                    result = await cp.paginate(queryset, fetch_items)
+                    return resp.ok(data=cp.get_paginated_result(result))
+
+                p = Pagination(page, page_size, count_strategy=count_strategy, filters=filters)  # type: ignore
+                result = await p.paginate(queryset, fetch_items)
                 data = p.get_paginated_result(result)
 
                 return resp.ok(data=data)
 
+            @self.get("/" + model_path + "/export", summary=f"导出所有{model_name}")  # type: ignore
+            async def export(
+                item: query_schema = Depends(),  # type: ignore
+                export_format: ExportFormat = Query(default=ExportFormat.NDJSON, alias="format"),
+            ) -> Response:
+                query = item.dict(exclude_unset=True, exclude_none=True)  # type: ignore
+                for key in ("page", "page_size", "paginate_mode", "after", "before"):
+                    query.pop(key, None)
+                fields = query.pop("fields", None)
+                select_fields = self.parse_fields(fields, sparse_fields) if fields else sparse_fields
+
+                queryset = await self.filter_queryset(query)
+                exporter = QuerySetExporter(queryset, select_fields, export_format)
+                return StreamingResponse(
+                    exporter.stream(),
+                    media_type=exporter.media_type,
+                    headers={"Content-Disposition": f"attachment; filename={exporter.filename}"},
+                )
+
         if not only_paginate:
 
             @self.get(
@@ -85,8 +189,12 @@ class BaseRouter(APIRouter):
                 response_model=response_schema,
                 summary=f"根据id获取{model_name}详情",
             )
+            @cache_response(*cache_models)
             async def fetch_one(item_id: str) -> Response:
-                data = await pydantic_model.from_queryset_single(model.get(id=item_id))
+                if self._detail_handler:
+                    data = await self._detail_handler(item_id)
+                else:
+                    data = await pydantic_model.from_queryset_single(model.get(id=item_id))
                 return resp.ok(data=data)
 
             @self.post(
@@ -97,12 +205,38 @@ class BaseRouter(APIRouter):
             )
             async def create(item: request_schema, request: Request) -> Response:  # type: ignore
                 new_item = await model.create_one(item, request)  # type: ignore
+                await ModelVersion.bump(model)
                 data = await pydantic_model.from_tortoise_orm(new_item)
                 return resp.ok(
                     data=data,
                     status_code=status.HTTP_201_CREATED,
                 )
 
+            # 批量接口需要在 /{item_id} 路由之前注册
+            bulk_update_schema = create_model(
+                f"{request_schema.__name__}BulkUpdate",
+                __base__=request_schema,
+                id=(int, Field(description="主键ID")),
+            )
+
+            @self.post("/" + model_path + "/bulk", response_model=ResponseSchema, summary=f"批量创建{model_name}")
+            async def bulk_create(items: List[request_schema], request: Request) -> Response:  # type: ignore
+                self.check_bulk_size(items)
+                success_count, errors = await model.create_many(items, request)
+                return await self.bulk_result(len(items), success_count, errors)
+
+            @self.put("/" + model_path + "/bulk", response_model=ResponseSchema, summary=f"批量更新{model_name}信息")
+            async def bulk_update(items: List[bulk_update_schema], request: Request) -> Response:  # type: ignore
+                self.check_bulk_size(items)
+                success_count, errors = await model.update_many(items, request)
+                return await self.bulk_result(len(items), success_count, errors)
+
+            @self.delete("/" + model_path + "/bulk", response_model=ResponseSchema, summary=f"批量删除{model_name}")
+            async def bulk_delete(item: BulkDeleteReq, request: Request) -> Response:
+                self.check_bulk_size(item.ids)
+                success_count, errors = await model.delete_many(item.ids, request)
+                return await self.bulk_result(len(item.ids), success_count, errors)
+
             @self.put(
                 "/" + model_path + "/{item_id}",  # type: ignore
                 response_model=response_schema,
@@ -110,12 +244,14 @@ class BaseRouter(APIRouter):
             )
             async def update(item_id: str, item: request_schema, request: Request) -> Response:  # type: ignore
                 updated_item = await model.update_one(item_id, item, request)  # type: ignore
+                await ModelVersion.bump(model)
                 data = await pydantic_model.from_queryset_single(updated_item)
                 return resp.ok(data=data)
 
             @self.delete("/" + model_path + "/{item_id}", summary=f"删除{model_name}")  # type: ignore
             async def delete(item_id: str, request: Request) -> Response:
                 await model.delete_one(item_id, request)  # type: ignore
+                await ModelVersion.bump(model)
                 return resp.ok(data=None)
 
     def __str__(self) -> str:
@@ -1,12 +1,29 @@
 from app.api.base import BaseRouter
-from app.models.audit import OperatorAuditRecord, SSHAuditRecord
+from app.models.audit import OperatorAuditRecord, SSHAuditRecord, SSHCommandRecord, SSHWatchRecord
+from app.models.enums import CountStrategy
 from app.schemas.audit import (
     OperatorAuditRecordRespSchema,
+    OperatorAuditRecordDetailRespSchema,
     OperatorAuditRecordQuerySchema,
     SSHAuditRecordRespSchema,
     SSHAuditRecordQuerySchema,
+    SSHRecordPlaybackQuerySchema,
+    SSHCommandRecordRespSchema,
+    SSHCommandRecordQuerySchema,
+    SSHWatchRecordRespSchema,
+    SSHWatchRecordQuerySchema,
 )
-from app.schemas.model_creator import OperatorAuditRecordReq, SSHAuditRecordReq
+from app.schemas.model_creator import (
+    OperatorAuditRecordReq,
+    SSHAuditRecordReq,
+    SSHCommandRecordReq,
+    SSHWatchRecordReq,
+)
+from app.schemas.resp import ResponseSchema
+from app.services.audit import AuditService
+from common import resp
+from common.audit import audit_writer
+from fastapi import Depends, Response
 
 operator_audit_router = BaseRouter(
     model=OperatorAuditRecord,
@@ -16,6 +33,8 @@ operator_audit_router = BaseRouter(
     response_schema=OperatorAuditRecordRespSchema,
     query_schema=OperatorAuditRecordQuerySchema,
     model_path="audit/operator-history",
+    count_strategy=CountStrategy.ESTIMATED,
+    page_query_handler=AuditService.get_page_queryset,  # type: ignore
 )
 
 ssh_audit_router = BaseRouter(
@@ -26,9 +45,39 @@ ssh_audit_router = BaseRouter(
     response_schema=SSHAuditRecordRespSchema,
     query_schema=SSHAuditRecordQuerySchema,
     model_path="audit/ssh-history",
+    count_strategy=CountStrategy.ESTIMATED,
+    page_query_handler=AuditService.get_page_queryset,  # type: ignore
+)
+
+ssh_command_router = BaseRouter(
+    model=SSHCommandRecord,
+    tag_name="审计",
+    model_name="SSH命令审计",
+    request_schema=SSHCommandRecordReq,
+    response_schema=SSHCommandRecordRespSchema,
+    query_schema=SSHCommandRecordQuerySchema,
+    model_path="audit/ssh-command",
+    count_strategy=CountStrategy.ESTIMATED,
+    page_query_handler=AuditService.get_command_page_queryset,  # type: ignore
+)
+
+ssh_watch_router = BaseRouter(
+    model=SSHWatchRecord,
+    tag_name="审计",
+    model_name="SSH会话观看审计",
+    request_schema=SSHWatchRecordReq,
+    response_schema=SSHWatchRecordRespSchema,
+    query_schema=SSHWatchRecordQuerySchema,
+    model_path="audit/ssh-watch",
+    page_query_handler=AuditService.get_page_queryset,  # type: ignore
 )
 
 
+@operator_audit_router.get("/audit/writer-stats", response_model=ResponseSchema, summary="获取审计记录写入队列统计")
+async def get_writer_stats() -> Response:
+    return resp.ok(data=audit_writer.stats())
+
+
 operator_audit_router.load_crud_routes(
     only_paginate=True,
 )
@@ -36,3 +85,26 @@ operator_audit_router.load_crud_routes(
 ssh_audit_router.load_crud_routes(
     only_paginate=True,
 )
+
+ssh_command_router.load_crud_routes(
+    only_paginate=True,
+)
+
+ssh_watch_router.load_crud_routes(
+    only_paginate=True,
+)
+
+
+# 详情路由需要在通用路由之后注册，避免覆盖 /audit/operator-history/export
+@operator_audit_router.get(
+    "/audit/operator-history/{item_id}", response_model=OperatorAuditRecordDetailRespSchema, summary="获取请求操作审计详情"
+)
+async def get_operator_record(item_id: int) -> Response:
+    data = await AuditService.get_operator_record(item_id)
+    return resp.ok(data=data)
+
+
+@ssh_audit_router.get("/audit/ssh-history/{item_id}/record", response_model=ResponseSchema, summary="回放SSH会话录像")
+async def get_ssh_record(item_id: int, item: SSHRecordPlaybackQuerySchema = Depends()) -> Response:
+    data = await AuditService.get_ssh_record(item_id, item)
+    return resp.ok(data=data)
@@ -37,6 +37,7 @@ from app.schemas.model_creator import (
 from app.schemas.resp import ResponseSchema
 from app.services.basis import HostGroupService, HostService, DbService
 from common import resp
+from common.cache import cache_response
 from fastapi import Response
 
 host_router = BaseRouter(
@@ -122,6 +123,7 @@ deploy_config_router = BaseRouter(
 @host_group_router.get(
     "/cmdb/host-group/children", response_model=HostGroupChildrenRespSchema, summary="获取主机组与子主机组关系列表"
 )
+@cache_response(HostGroup)
 async def get_children_data() -> Response:
     data = await HostGroupService.get_children_data()
     return resp.ok(data=data)
@@ -130,6 +132,7 @@ async def get_children_data() -> Response:
 @host_group_router.get(
     "/cmdb/host-group/children-host", response_model=HostGroupChildrenRespSchema, summary="获取主机组与子主机组关系列表,并关联主机"
 )
+@cache_response(HostGroup, Host)
 async def get_children_data_with_host() -> Response:
     data = await HostGroupService.get_children_data_with_host()
     return resp.ok(data=data)
@@ -1,4 +1,5 @@
 from app.api.base import BaseRouter
+from app.models.enums import CountStrategy
 from app.models.job import AdhocHistory, Script
 from app.schemas.job import (
     AdhocHistoryQuerySchema,
@@ -12,10 +13,13 @@ from app.schemas.job import (
 )
 from app.schemas.model_creator import AdhocHistoryReq, ScriptReq
 from app.schemas.resp import ResponseSchema
-from app.services.job import JobService
+from app.services.job import AnsibleJob, JobService
 from common import resp
-from core.security import get_current_username
-from fastapi import Response, Depends
+from common.cache import cache_response
+from common.log import Log
+from core.security import check_token_from_query, get_current_username
+from fastapi import APIRouter, Response, Depends, WebSocket, status
+from starlette.websockets import WebSocketDisconnect
 
 job_router = BaseRouter(
     model=AdhocHistory,
@@ -25,6 +29,7 @@ job_router = BaseRouter(
     response_schema=AdhocHistoryRespSchema,
     query_schema=AdhocHistoryQuerySchema,
     model_path="job/adhoc-history",
+    count_strategy=CountStrategy.ESTIMATED,
 )
 
 script_router = BaseRouter(
@@ -37,6 +42,8 @@ script_router = BaseRouter(
     model_path="job/script",
 )
 
+job_ws_router = APIRouter(tags=["作业平台"])
+
 
 @job_router.post("/job/module", response_model=ResponseSchema, summary="执行远程模块")
 async def exec_module(item: ExecModuleReq, username: str = Depends(get_current_username)) -> Response:
@@ -50,7 +57,54 @@ async def exec_task(item: ExecTaskReq) -> Response:
     return resp.ok(data=data)
 
 
+@job_router.post("/job/module/stream", response_model=ResponseSchema, summary="后台执行远程模块")
+async def stream_module(item: ExecModuleReq, username: str = Depends(get_current_username)) -> Response:
+    data = await JobService.stream_module(item, username)
+    return resp.ok(data=data)
+
+
+@job_router.post("/job/task/stream", response_model=ResponseSchema, summary="后台执行远程任务")
+async def stream_task(item: ExecTaskReq, username: str = Depends(get_current_username)) -> Response:
+    data = await JobService.stream_task(item, username)
+    return resp.ok(data=data)
+
+
+@job_router.get("/job/stream/{job_id}", response_model=ResponseSchema, summary="获取后台作业状态与最近事件")
+async def get_job_events(job_id: str, offset: int = 0, username: str = Depends(get_current_username)) -> Response:
+    data = await JobService.get_job_events(job_id, username, offset)
+    return resp.ok(data=data)
+
+
+@job_ws_router.websocket("/ws/job/{job_id}")
+async def handle_job_events(
+    websocket: WebSocket, job_id: str, offset: int = 0, username: str = Depends(check_token_from_query)
+) -> None:
+    """
+    推送后台作业的执行事件，作业结束后关闭连接
+    :param username: 当前请求的用户名
+    :param job_id: 作业ID
+    :param offset: 已收到的最后一个事件序号，重新连接时从该序号之后推送
+    :param websocket: websocket对象
+    :return:
+    """
+    if not username:
+        return
+    if not (job := AnsibleJob.get_job(job_id, username)):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    try:
+        async for item in job.events(offset):
+            await websocket.send_json(item)
+        await websocket.close()
+    except WebSocketDisconnect:
+        Log.info(f"job websocket disconnect-{job_id}")
+    except Exception as e:
+        Log.error(f"job websocket error-{job_id}: {e}")
+
+
 @script_router.get("/job/script/children", response_model=ScriptChildRenRespSchema, summary="获取脚本组与子脚本关系列表")
+@cache_response(Script)
 async def get_children_data() -> Response:
     data = await JobService.get_children_data()
     return resp.ok(data=data)
@@ -16,6 +16,7 @@ from app.schemas.rbac import (
 from app.schemas.resp import ResponseSchema
 from app.services.rbac import DepartmentService, UserService
 from common import resp
+from common.cache import cache_response
 from fastapi import Response, Depends
 
 role_router = BaseRouter(
@@ -51,6 +52,7 @@ department_router = BaseRouter(
 
 
 @department_router.get("/rbac/department/children", response_model=DepartmentChildrenRespSchema, summary="获取部门与子部门关系列表")
+@cache_response(Department)
 async def get_children_data(item: DepartmentChildrenQuerySchema = Depends()) -> Response:
     data = await DepartmentService.get_children_data(item)
     return resp.ok(data=data)
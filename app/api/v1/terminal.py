@@ -1,31 +1,106 @@
-from app.services.terminal import TerminalService
+from app.services.terminal import BroadcastService, TerminalService
+from common.log import Log
 from core.security import check_token_from_query
-from fastapi import APIRouter, WebSocket, Depends
-from starlette.websockets import WebSocketDisconnect
+from fastapi import APIRouter, WebSocket, Depends, status
+from starlette.websockets import WebSocketDisconnect, WebSocketState
 
 router = APIRouter(tags=["web终端"])
 
 
 @router.websocket("/ws")
 async def handle_web_terminal(
-    websocket: WebSocket, host_id: int, username: str = Depends(check_token_from_query)
+    websocket: WebSocket,
+    host_id: int,
+    binary: bool = False,
+    resume_token: str | None = None,
+    offset: int | None = None,
+    username: str = Depends(check_token_from_query),
 ) -> None:
     """
     web terminal connect
     :param username: 当前请求的用户名
     :param host_id: 需要连接的主机ID
+    :param binary: 终端输出是否以二进制帧发送
+    :param resume_token: 恢复令牌，会话仍在保留期内时重新连接到该会话
+    :param offset: 重新连接时前端已收到的输出偏移量
     :param websocket: websocket对象
     :return:
     """
-    manager = TerminalService(websocket, username)
+    manager = TerminalService.get_session(resume_token, username) if resume_token else None
     try:
-        await manager.connect(host_id)
+        if manager:
+            await manager.attach(websocket, offset, binary)
+        else:
+            manager = TerminalService(websocket, username, binary=binary)
+            await manager.connect(host_id)
         while True:
             message = await websocket.receive()
             websocket._raise_on_disconnect(message)
             await manager.receive(message.get("text", ""), message.get("bytes", b""))
     except WebSocketDisconnect:
-        print(f"websocket disconnect-{host_id}")
-        await manager.disconnect()
+        Log.info(f"websocket disconnect-{host_id}")
+    except Exception as e:
+        Log.error(f"web terminal error-{host_id}: {e}")
+        if websocket.client_state == WebSocketState.CONNECTED:
+            await websocket.close()
+    finally:
+        if manager:
+            # SSH会话保留一段时间，等待重新连接，保留期后关闭会话
+            manager.detach(websocket)
+
+
+@router.websocket("/ws/watch")
+async def handle_watch_terminal(
+    websocket: WebSocket, watch_token: str, binary: bool = False, username: str = Depends(check_token_from_query)
+) -> None:
+    """
+    只读观看终端，多个观看者共用同一个SSH通道，只有会话所属用户或拥有观看角色的用户可以观看
+    :param username: 当前请求的用户名
+    :param watch_token: 被观看会话的观看令牌
+    :param binary: 终端输出是否以二进制帧发送
+    :param websocket: websocket对象
+    :return:
+    """
+    if not username:
+        return
+    session = TerminalService.get_watch_session(watch_token)
+    if not session or not await session.can_watch(username):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await session.add_watcher(websocket, username, binary)
+    try:
+        while True:
+            message = await websocket.receive()
+            websocket._raise_on_disconnect(message)
+            # 观看者只读，忽略输入
+    except WebSocketDisconnect:
+        Log.info(f"watcher {username} disconnect-{watch_token}")
+    finally:
+        session.remove_watcher(websocket)
+
+
+@router.websocket("/ws/broadcast")
+async def handle_broadcast_terminal(
+    websocket: WebSocket, host_ids: str, binary: bool = False, username: str = Depends(check_token_from_query)
+) -> None:
+    """
+    广播终端，输入同时发送到多台主机
+    :param username: 当前请求的用户名
+    :param host_ids: 主机ID列表，以逗号分隔
+    :param binary: 终端输出是否以二进制帧发送
+    :param websocket: websocket对象
+    :return:
+    """
+    manager = BroadcastService(websocket, username, binary=binary)
+    try:
+        await manager.connect([int(host_id) for host_id in host_ids.split(",") if host_id.strip()])
+        while True:
+            message = await websocket.receive()
+            websocket._raise_on_disconnect(message)
+            await manager.receive(message.get("text", ""), message.get("bytes", b""))
+    except WebSocketDisconnect:
+        Log.info(f"broadcast websocket disconnect-{host_ids}")
     except Exception as e:
-        print(e)
+        Log.error(f"broadcast websocket error-{host_ids}: {e}")
+    finally:
+        await manager.disconnect()
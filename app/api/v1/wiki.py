@@ -11,9 +11,11 @@ from app.schemas.wiki import (
     WikiPageRespSchema,
     WikiPageQuerySchema,
     WikiCategoryPageQuerySchema,
+    WikiCategoryNodeQuerySchema,
 )
 from app.services.wiki import WikiCategoryService, WikiPageService
 from common import resp
+from common.cache import cache_response
 from fastapi import Response, Depends, UploadFile
 
 zone_router = BaseRouter(
@@ -44,17 +46,28 @@ page_router = BaseRouter(
     response_schema=WikiPageRespSchema,
     query_schema=WikiPageQuerySchema,
     model_path="wiki/page",
+    detail_handler=WikiPageService.get_page_detail,
 )
 
 
 @category_router.get(
     "/wiki/children-page", response_model=WikiCategoryChildrenRespSchema, summary="获取wiki目录与子目录关系列表,并关联wiki页面"
 )
+@cache_response(WikiCategory, WikiPage)
 async def get_children_data_with_page(item: WikiCategoryPageQuerySchema = Depends()) -> Response:
     data = await WikiCategoryService.get_children_data_with_page(item)
     return resp.ok(data=data)
 
 
+@category_router.get(
+    "/wiki/children-node", response_model=WikiCategoryChildrenRespSchema, summary="获取wiki目录下一层的子目录与页面,用于目录树逐级展开"
+)
+@cache_response(WikiCategory, WikiPage)
+async def get_node_children(item: WikiCategoryNodeQuerySchema = Depends()) -> Response:
+    data = await WikiCategoryService.get_node_children(item)
+    return resp.ok(data=data)
+
+
 @page_router.post("/wiki/page/file", response_model=ResponseSchema, summary="wiki页面上传文件")
 async def handle_upload_file(file: UploadFile) -> Response:
     url = await WikiPageService.upload_file(file)
@@ -1,8 +1,10 @@
-from typing import List
+import zlib
+from typing import Any, List, Tuple
 
 from app.models import consts
 from app.models.base import BasicModel, DefaultManager
-from app.models.enums import HttpMethod, SSHStatus
+from app.models.enums import HttpMethod, SSHStatus, SSHWatchAction, BodyEncoding
+from config.setting import settings
 from tortoise import fields
 
 
@@ -10,12 +12,13 @@ class OperatorAuditRecord(BasicModel):
     username = fields.CharField(description="用户名", max_length=50)
     request_url = fields.CharField(description="请求URL", max_length=400)
     request_method: HttpMethod = fields.CharEnumField(HttpMethod, description="请求方法", default=HttpMethod.POST)
-    request_body = fields.TextField(description="请求参数", default="")
+    request_body = fields.BinaryField(description="请求参数", null=True)
     response_code = fields.SmallIntField(description="响应码", default=consts.RESPONSE_CODE)
-    response_content = fields.TextField(
-        description="响应内容",
-        default="",
+    response_content = fields.BinaryField(description="响应内容", null=True)
+    body_encoding: BodyEncoding = fields.CharEnumField(
+        BodyEncoding, description="报文存储编码，plain：原文，zlib：zlib压缩", default=BodyEncoding.PLAIN
     )
+    body_truncated = fields.BooleanField(description="报文是否被截断", default=False)
     request_time = fields.DatetimeField(description="请求时间", auto_now_add=True)
     process_time = fields.FloatField(description="耗时时间")
 
@@ -26,18 +29,85 @@ class OperatorAuditRecord(BasicModel):
         ordering = ["-id"]
 
     class PydanticMeta:
-        exclude = ["delete_time"]
+        # 报文字段为压缩后的二进制，需通过 get_request_body/get_response_content 解码后返回
+        exclude = ["delete_time", "request_body", "response_content"]
 
     @classmethod
     def search_fields(cls) -> List[str]:
-        return [
-            "username",
-            "request_url",
-            "request_method",
-            "request_body",
-            "response_code",
-            "response_content",
-        ]
+        fields_ = ["username", "request_url", "request_method", "response_code"]
+        if not settings.AUDIT_BODY_COMPRESS:
+            # 压缩后的报文无法模糊搜索
+            fields_.extend(["request_body", "response_content"])
+        return fields_
+
+    @classmethod
+    def defer_fields(cls) -> List[str]:
+        return ["request_body", "response_content"]
+
+    @staticmethod
+    def encode_body(body: str, encoding: BodyEncoding) -> Tuple[bytes, bool]:
+        """
+        报文按 AUDIT_BODY_MAX_SIZE 截断后按指定编码存储
+        :param body: 报文原文
+        :param encoding: 存储编码
+        :return: 存储内容，是否被截断
+        """
+        data = body.encode("utf-8")
+        truncated = len(data) > settings.AUDIT_BODY_MAX_SIZE
+        if truncated:
+            data = data[: settings.AUDIT_BODY_MAX_SIZE]
+        if encoding == BodyEncoding.ZLIB:
+            data = zlib.compress(data, settings.AUDIT_BODY_COMPRESS_LEVEL)
+        return data, truncated
+
+    @staticmethod
+    def decode_body(data: bytes | str | None, encoding: BodyEncoding | str) -> str:
+        """
+        将存储的报文还原为原文
+        :param data: 存储内容
+        :param encoding: 存储编码
+        :return:
+        """
+        if not data:
+            return ""
+        if isinstance(data, str):
+            return data
+        if encoding == BodyEncoding.ZLIB:
+            data = zlib.decompress(data)
+        return data.decode("utf-8", "ignore")
+
+    @classmethod
+    def build(
+        cls, *, request_body: str, response_content: str, truncated: bool = False, **kwargs: Any
+    ) -> "OperatorAuditRecord":
+        """
+        生成未保存的审计记录，报文按配置截断、压缩
+        :param request_body: 请求报文
+        :param response_content: 响应报文
+        :param truncated: 报文在截取时是否已被截断
+        :param kwargs: 其他字段
+        :return:
+        """
+        encoding = BodyEncoding.PLAIN
+        if settings.AUDIT_BODY_COMPRESS and len(request_body) + len(response_content) >= (
+            settings.AUDIT_BODY_COMPRESS_MIN_SIZE
+        ):
+            encoding = BodyEncoding.ZLIB
+        request_data, request_truncated = cls.encode_body(request_body, encoding)
+        response_data, response_truncated = cls.encode_body(response_content, encoding)
+        return cls(
+            request_body=request_data,
+            response_content=response_data,
+            body_encoding=encoding,
+            body_truncated=truncated or request_truncated or response_truncated,
+            **kwargs,
+        )
+
+    def get_request_body(self) -> str:
+        return self.decode_body(self.request_body, self.body_encoding)
+
+    def get_response_content(self) -> str:
+        return self.decode_body(self.response_content, self.body_encoding)
 
     def __str__(self) -> str:
         return (
@@ -52,6 +122,7 @@ class SSHAuditRecord(BasicModel):
     proxy_host = fields.CharField(description="SSH使用的代理主机", max_length=20, default="")
     status: SSHStatus = fields.IntEnumField(SSHStatus, description="在线状态", default=SSHStatus.OFFLINE)
     ssh_command = fields.TextField(description="历史操作命令", default="")
+    record_file = fields.CharField(description="会话录像文件", max_length=200, default="")
 
     class Meta:
         manager = DefaultManager()
@@ -72,3 +143,61 @@ class SSHAuditRecord(BasicModel):
 
     def __str__(self) -> str:
         return f"{self.username} command {self.ssh_command}"
+
+
+class SSHCommandRecord(BasicModel):
+    ssh_audit_id = fields.IntField(description="SSH审计记录ID", index=True)
+    username = fields.CharField(description="用户名", max_length=50)
+    ssh_host = fields.CharField(description="SSH主机", max_length=20)
+    ssh_user = fields.CharField(description="SSH用户名", max_length=20)
+    command = fields.CharField(description="执行的命令", max_length=500)
+    in_editor = fields.BooleanField(description="是否为vi等编辑器中的输入", default=False)
+
+    class Meta:
+        manager = DefaultManager()
+        table = "t_ssh_command"
+        table_description = "SSH命令审计表"
+        # 按主机、用户查询某段时间内的命令，以及按命令前缀查询
+        indexes = (("ssh_host", "create_time"), ("username", "create_time"), ("command",))
+
+    class PydanticMeta:
+        exclude = ["delete_time"]
+
+    @classmethod
+    def search_fields(cls) -> List[str]:
+        return [
+            "username",
+            "ssh_host",
+            "ssh_user",
+            "command",
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.username} run {self.command} on {self.ssh_host}"
+
+
+class SSHWatchRecord(BasicModel):
+    ssh_audit_id = fields.IntField(description="SSH审计记录ID", index=True)
+    username = fields.CharField(description="观看者用户名", max_length=50)
+    owner = fields.CharField(description="会话所属用户名", max_length=50)
+    ssh_host = fields.CharField(description="SSH主机", max_length=20)
+    action: SSHWatchAction = fields.IntEnumField(SSHWatchAction, description="操作，0：开始观看，1：结束观看")
+
+    class Meta:
+        manager = DefaultManager()
+        table = "t_ssh_watch"
+        table_description = "SSH会话观看审计表"
+
+    class PydanticMeta:
+        exclude = ["delete_time"]
+
+    @classmethod
+    def search_fields(cls) -> List[str]:
+        return [
+            "username",
+            "owner",
+            "ssh_host",
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.username} watch {self.owner} on {self.ssh_host}"
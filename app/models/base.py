@@ -1,14 +1,19 @@
+from collections import defaultdict, deque
 from datetime import datetime
-from typing import Dict, List
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, List, Tuple, Type
 
 from app.models.enums import Status
+from common.exceptions import APIException
 from fastapi import Request
 from pydantic import BaseModel
 from tortoise import models, fields
-from tortoise.expressions import Q
+from tortoise.exceptions import IntegrityError
+from tortoise.expressions import Q, Subquery
 from tortoise.manager import Manager
 from tortoise.models import MODEL, Model
 from tortoise.queryset import QuerySet, QuerySetSingle
+from tortoise.transactions import in_transaction
 
 
 class DefaultManager(Manager):
@@ -49,6 +54,14 @@ class BasicModel(models.Model):
     def search_fields(cls) -> List[str]:
         return []
 
+    @classmethod
+    def defer_fields(cls) -> List[str]:
+        """
+        分页列表查询时不加载的字段，一般为大文本字段
+        :return:
+        """
+        return []
+
     @classmethod
     async def create_one(cls, item: BaseModel, request: Request) -> Model:
         return await cls.create(**item.dict())
@@ -71,6 +84,140 @@ class BasicModel(models.Model):
         deleted_count = await cls.filter(id=_id).update(delete_time=datetime.now())
         return deleted_count
 
+    @classmethod
+    def _is_override(cls, method_name: str) -> bool:
+        """
+        子类是否重写了单条操作方法(如密码加密、关联数据处理)，重写时批量操作需要逐条调用以保证业务逻辑一致
+        :param method_name: 方法名
+        :return:
+        """
+        return getattr(cls, method_name).__func__ is not getattr(BasicModel, method_name).__func__
+
+    @classmethod
+    async def _check_ids(cls, ids: List[int]) -> Tuple[Dict[int, int], List[Dict]]:
+        """
+        检查id是否存在
+        :param ids: id列表
+        :return: 存在的id与其在请求列表中的下标，不存在的id错误信息
+        """
+        existing_ids = set(await cls.filter(id__in=ids).values_list("id", flat=True))
+        valid_ids: Dict[int, int] = {}
+        errors = []
+        for index, _id in enumerate(ids):
+            if _id in existing_ids:
+                valid_ids[_id] = index
+            else:
+                errors.append({"index": index, "id": _id, "error": "data not exist"})
+        return valid_ids, errors
+
+    @staticmethod
+    async def _run_each(
+        handlers: List[Tuple[int, int | None, Callable[[], Awaitable[Any]]]], errors: List[Dict]
+    ) -> int:
+        """
+        在同一个事务中逐条执行，任意一条失败时记录出错的数据并回滚整个事务
+        :param handlers: (下标, id, 执行函数)列表
+        :param errors: 错误信息列表
+        :return: 执行成功的条数
+        """
+        error_count = len(errors)
+        try:
+            async with in_transaction():
+                for index, _id, handler in handlers:
+                    try:
+                        await handler()
+                    except Exception as e:
+                        errors.append({"index": index, "id": _id, "error": str(e)})
+                        raise
+        except Exception:
+            # 不是某条数据执行出错(如提交事务失败)时直接抛出
+            if len(errors) == error_count:
+                raise
+            return 0
+        return len(handlers)
+
+    @classmethod
+    async def create_many(cls, items: List[BaseModel], request: Request) -> Tuple[int, List[Dict]]:
+        """
+        批量创建，同一个事务中使用bulk_create一次写入
+        :param items: 数据列表
+        :param request:
+        :return: 成功条数，错误信息列表
+        """
+        errors: List[Dict] = []
+        if cls._is_override("create_one"):
+            handlers = [(index, None, partial(cls.create_one, item, request)) for index, item in enumerate(items)]
+            return await cls._run_each(handlers, errors), errors  # type: ignore
+        try:
+            async with in_transaction():
+                await cls.bulk_create([cls(**item.dict()) for item in items])
+        except IntegrityError:
+            # 批量写入违反约束(如唯一键重复)时无法得知是哪条数据，逐条写入以定位出错的数据
+            handlers = [(index, None, partial(cls(**item.dict()).save)) for index, item in enumerate(items)]
+            return await cls._run_each(handlers, errors), errors  # type: ignore
+        return len(items), errors
+
+    @classmethod
+    async def update_many(cls, items: List[BaseModel], request: Request) -> Tuple[int, List[Dict]]:
+        """
+        批量更新，同一个事务中使用bulk_update一次写入
+        :param items: 数据列表，每条数据需包含id
+        :param request:
+        :return: 成功条数，错误信息列表
+        """
+        valid_ids, errors = await cls._check_ids([item.id for item in items])  # type: ignore
+        valid_items = [item for item in items if item.id in valid_ids]  # type: ignore
+        if not valid_items:
+            return 0, errors
+        if cls._is_override("update_one"):
+            handlers = [
+                (valid_ids[item.id], item.id, partial(cls.update_one, str(item.id), item, request))  # type: ignore
+                for item in valid_items
+            ]
+            return await cls._run_each(handlers, errors), errors  # type: ignore
+
+        objs = {obj.id: obj for obj in await cls.filter(id__in=list(valid_ids))}
+        update_fields = {"update_time"}
+        # auto_now 只在 save() 时生效，bulk_update 需要手动更新
+        now = datetime.now()
+        for item in valid_items:
+            data = item.dict(exclude_unset=True, exclude={"id"})
+            obj = objs[item.id]  # type: ignore
+            obj.update_from_dict(data)
+            obj.update_time = now
+            update_fields.update(data)
+        try:
+            async with in_transaction():
+                await cls.bulk_update(list(objs.values()), fields=list(update_fields))
+        except IntegrityError:
+            # 批量更新违反约束时逐条更新，以定位出错的数据
+            fields_list = list(update_fields)
+            handlers = [
+                (valid_ids[item.id], item.id, partial(objs[item.id].save, update_fields=fields_list))  # type: ignore
+                for item in valid_items
+            ]
+            return await cls._run_each(handlers, errors), errors  # type: ignore
+        return len(valid_items), errors
+
+    @classmethod
+    async def delete_many(cls, ids: List[int], request: Request) -> Tuple[int, List[Dict]]:
+        """
+        批量逻辑删除，一条update语句完成
+        :param ids: id列表
+        :param request:
+        :return: 成功条数，错误信息列表
+        """
+        valid_ids, errors = await cls._check_ids(ids)
+        if not valid_ids:
+            return 0, errors
+        if cls._is_override("delete_one"):
+            handlers = [
+                (index, _id, partial(cls.delete_one, str(_id), request)) for _id, index in valid_ids.items()
+            ]
+            return await cls._run_each(handlers, errors), errors  # type: ignore
+        await cls.filter(id__in=list(valid_ids)).update(delete_time=datetime.now())
+        return len(valid_ids), errors
+
     class Meta:
         abstract = True
 
@@ -80,3 +227,153 @@ class ModelWithStatus(BasicModel):
 
     class Meta:
         abstract = True
+
+
+class ClosureModel(models.Model):
+    """
+    树形结构闭包表，保存每个节点与其所有祖先节点(包括自身)的关系
+    """
+
+    id = fields.IntField(description="主键ID", pk=True)
+    ancestor_id = fields.IntField(description="祖先节点ID")
+    descendant_id = fields.IntField(description="后代节点ID", index=True)
+    depth = fields.IntField(description="层级距离，0表示节点自身")
+
+    class Meta:
+        abstract = True
+
+
+class TreeMixin(object):
+    """
+    树形模型(存在parent自关联)的闭包表维护，新增、更新父节点、删除节点时同步更新闭包表
+    使用的模型需要定义 closure_model 属性
+    """
+
+    closure_model: Type[ClosureModel]
+
+    @classmethod
+    def descendants_of(cls, _id: int | str) -> Subquery:
+        """
+        节点及其所有后代节点id的子查询，用法：Host.filter(host_group_id__in=HostGroup.descendants_of(_id))
+        :param _id: 节点id
+        :return:
+        """
+        return Subquery(cls.closure_model.filter(ancestor_id=_id).values("descendant_id"))
+
+    @classmethod
+    async def _get_parent_id(cls, _id: int | str) -> int | None:
+        rows = await cls.filter(id=_id).values("parent_id")  # type: ignore
+        return rows[0]["parent_id"] if rows else None
+
+    @classmethod
+    async def _attach_subtree(cls, _id: int, parent_id: int | None) -> None:
+        """
+        将节点及其子树挂到父节点下：父节点的每个祖先与子树中的每个节点建立关系
+        :param _id: 节点id
+        :param parent_id: 父节点id
+        :return:
+        """
+        closure = cls.closure_model
+        subtree = await closure.filter(ancestor_id=_id).values("descendant_id", "depth")
+        if not subtree:
+            # 新节点只有自身一条记录
+            await closure.create(ancestor_id=_id, descendant_id=_id, depth=0)
+            subtree = [{"descendant_id": _id, "depth": 0}]
+        if parent_id is None:
+            return
+        ancestors = await closure.filter(descendant_id=parent_id).values("ancestor_id", "depth")
+        await closure.bulk_create(
+            [
+                closure(
+                    ancestor_id=ancestor["ancestor_id"],
+                    descendant_id=node["descendant_id"],
+                    depth=ancestor["depth"] + node["depth"] + 1,
+                )
+                for ancestor in ancestors
+                for node in subtree
+            ]
+        )
+
+    @classmethod
+    async def _detach_subtree(cls, _id: int | str) -> List[int]:
+        """
+        断开节点及其子树与外部祖先节点的关系，子树内部的关系保持不变
+        :param _id: 节点id
+        :return: 子树中所有节点id
+        """
+        closure = cls.closure_model
+        subtree_ids = await closure.filter(ancestor_id=_id).values_list("descendant_id", flat=True)
+        ancestor_ids = await closure.filter(descendant_id=_id, depth__gt=0).values_list("ancestor_id", flat=True)
+        if ancestor_ids:
+            await closure.filter(descendant_id__in=subtree_ids, ancestor_id__in=ancestor_ids).delete()
+        return subtree_ids  # type: ignore
+
+    @classmethod
+    async def create_one(cls, item: BaseModel, request: Request) -> Model:
+        async with in_transaction():
+            obj = await super().create_one(item, request)  # type: ignore
+            await cls._attach_subtree(obj.id, obj.parent_id)
+        return obj
+
+    @classmethod
+    async def update_one(cls, _id: str, item: BaseModel, request: Request) -> QuerySetSingle[Model]:
+        old_parent_id = await cls._get_parent_id(_id)
+        new_parent_id = item.dict(exclude_unset=True).get("parent_id", old_parent_id)
+        if new_parent_id == old_parent_id:
+            return await super().update_one(_id, item, request)  # type: ignore
+
+        # 不能把节点移动到自身或自身的后代节点下，否则会形成环
+        if new_parent_id is not None:
+            if await cls.closure_model.filter(ancestor_id=_id, descendant_id=new_parent_id).exists():
+                raise APIException("parent can not be itself or its descendant")
+        async with in_transaction():
+            await cls._detach_subtree(_id)
+            result = await super().update_one(_id, item, request)  # type: ignore
+            await cls._attach_subtree(int(_id), new_parent_id)
+        return result
+
+    @classmethod
+    async def delete_one(cls, _id: str, request: Request) -> int:
+        async with in_transaction():
+            deleted_count = await super().delete_one(_id, request)  # type: ignore
+            # 删除的节点及其子树从树中移除，子树内部的关系保留
+            await cls._detach_subtree(_id)
+            await cls.closure_model.filter(ancestor_id=_id).delete()
+        return deleted_count
+
+    @classmethod
+    async def rebuild_closure(cls, force: bool = False) -> None:
+        """
+        根据parent关系重建闭包表，闭包表为空(首次上线)或 force 为True时执行
+        :param force: 是否强制重建
+        :return:
+        """
+        closure = cls.closure_model
+        if not force and await closure.all().exists():
+            return
+        nodes = await cls.all().values("id", "parent_id")  # type: ignore
+        node_ids = {node["id"] for node in nodes}
+        children_map: Dict[int | None, List[int]] = defaultdict(list)
+        root_ids = []
+        for node in nodes:
+            children_map[node["parent_id"]].append(node["id"])
+            # 父节点已被逻辑删除的节点与 delete_one 的处理一致，作为根节点
+            if node["parent_id"] is None or node["parent_id"] not in node_ids:
+                root_ids.append(node["id"])
+
+        records = []
+        # 从根节点开始广度遍历，path为根节点到当前节点的路径
+        queue = deque([(root_id, [root_id]) for root_id in root_ids])
+        visited = set()
+        while queue:
+            node_id, path = queue.popleft()
+            if node_id in visited:
+                continue
+            visited.add(node_id)
+            for depth, ancestor_id in enumerate(reversed(path)):
+                records.append(closure(ancestor_id=ancestor_id, descendant_id=node_id, depth=depth))
+            queue.extend((child_id, path + [child_id]) for child_id in children_map[node_id])
+
+        async with in_transaction():
+            await closure.all().delete()
+            await closure.bulk_create(records, batch_size=1000)
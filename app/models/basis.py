@@ -1,7 +1,7 @@
 from typing import List
 
 from app.models import consts
-from app.models.base import BasicModel, DefaultManager
+from app.models.base import BasicModel, ClosureModel, DefaultManager, TreeMixin
 from app.models.enums import (
     HostType,
     BelongsTo,
@@ -12,6 +12,7 @@ from app.models.enums import (
     ApplicationLanguage,
     DeployConfigType,
 )
+from common.cache import ModelVersion
 from core.security import get_current_username
 from fastapi import Request
 from pydantic import BaseModel
@@ -100,7 +101,14 @@ class Disk(BasicModel):
         return self.name
 
 
-class HostGroup(BasicModel):
+class HostGroupClosure(ClosureModel):
+    class Meta:
+        table = "t_host_group_closure"
+        table_description = "主机组层级关系闭包表"
+        unique_together = ("ancestor_id", "descendant_id")
+
+
+class HostGroup(TreeMixin, BasicModel):
     name = fields.CharField(description="名称", max_length=50, unique=True)
     parent: fields.ForeignKeyNullableRelation["HostGroup"] = fields.ForeignKeyField(
         "models.HostGroup",
@@ -113,6 +121,8 @@ class HostGroup(BasicModel):
     children: fields.ReverseRelation["HostGroup"]
     hosts: fields.ReverseRelation["Host"]
 
+    closure_model = HostGroupClosure
+
     def key(self) -> int:
         return self.id
 
@@ -266,6 +276,8 @@ class Application(BasicModel):
                 )
                 host_instances = [await Host.get(pk=j.get("id")) for j in i.get("hosts")]
                 await env_group_obj.hosts.add(*host_instances)
+        if application_groups:
+            await ModelVersion.bump(EnvironmentGroup)
 
     @classmethod
     async def create_one(cls, item: BaseModel, request: Request) -> Model:
@@ -78,6 +78,11 @@ class SSHStatus(IntEnum):
     OFFLINE = 1
 
 
+class SSHWatchAction(IntEnum):
+    ATTACH = 0
+    DETACH = 1
+
+
 class DeployConfigType(str, Enum):
     DOCKER_REGISTRY = "docker_registry"
     K8S = "k8s"
@@ -95,3 +100,30 @@ class ApplicationLanguage(str, Enum):
     TYPESCRIPT = "ts"
     CSHARP = "c#"
     PHP = "php"
+
+
+class AuditDropPolicy(str, Enum):
+    BLOCK = "block"
+    DROP_NEW = "drop_new"
+    DROP_OLDEST = "drop_oldest"
+
+
+class BodyEncoding(str, Enum):
+    PLAIN = "plain"
+    ZLIB = "zlib"
+
+
+class PaginateMode(str, Enum):
+    OFFSET = "offset"
+    CURSOR = "cursor"
+
+
+class CountStrategy(str, Enum):
+    EXACT = "exact"
+    CACHED = "cached"
+    ESTIMATED = "estimated"
+
+
+class ExportFormat(str, Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
@@ -0,0 +1,111 @@
+import csv
+import io
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List
+
+import orjson
+from aiomysql import SSDictCursor
+from app.models.enums import ExportFormat
+from common.resp import format_datetime
+from config.setting import settings
+from tortoise import connections
+from tortoise.queryset import QuerySet
+
+
+class QuerySetExporter(object):
+    """
+    将queryset查询结果按批次流式导出为NDJSON或CSV，内存占用与数据总量无关
+    MySQL使用服务端游标只执行一次查询，其他数据库按主键分批查询
+    """
+
+    media_types: Dict[ExportFormat, str] = {
+        ExportFormat.NDJSON: "application/x-ndjson",
+        ExportFormat.CSV: "text/csv",
+    }
+
+    def __init__(self, queryset: QuerySet, fields: List[str], export_format: ExportFormat) -> None:
+        self._queryset = queryset
+        self._fields = fields
+        self._format = export_format
+        self._chunk_size = settings.EXPORT_CHUNK_SIZE
+
+    @property
+    def media_type(self) -> str:
+        return self.media_types[self._format]
+
+    @property
+    def filename(self) -> str:
+        return f"{self._queryset.model._meta.db_table}.{self._format.value}"
+
+    @staticmethod
+    def _default(obj: Any) -> Any:
+        if isinstance(obj, datetime):
+            return format_datetime(obj)
+        if isinstance(obj, bytes):
+            return obj.decode("utf-8", "ignore")
+        return str(obj)
+
+    async def _fetch_by_cursor(self) -> AsyncIterator[List[Dict]]:
+        """
+        MySQL服务端游标，数据边读边返回，不会一次性加载到内存
+        :return:
+        """
+        sql = self._queryset.values(*self._fields).sql()
+        async with connections.get("default").acquire_connection() as conn:
+            async with conn.cursor(SSDictCursor) as cursor:
+                await cursor.execute(sql)
+                while rows := await cursor.fetchmany(self._chunk_size):
+                    yield rows
+
+    async def _fetch_by_keyset(self) -> AsyncIterator[List[Dict]]:
+        """
+        按主键倒序分批查询，每批以上一批最后一条数据的id作为起点
+        :return:
+        """
+        queryset = self._queryset.order_by("-id")
+        last_id: int | None = None
+        while True:
+            chunk_queryset = queryset.filter(id__lt=last_id) if last_id is not None else queryset
+            rows = await chunk_queryset.limit(self._chunk_size).values(*self._fields)
+            if not rows:
+                break
+            yield rows
+            if len(rows) < self._chunk_size:
+                break
+            last_id = rows[-1]["id"]
+
+    def _fetch_chunks(self) -> AsyncIterator[List[Dict]]:
+        if connections.get("default").capabilities.dialect == "mysql":
+            return self._fetch_by_cursor()
+        return self._fetch_by_keyset()
+
+    @classmethod
+    def _csv_value(cls, value: Any) -> Any:
+        if value is None:
+            return ""
+        if isinstance(value, (datetime, bytes)):
+            return cls._default(value)
+        return value
+
+    def _dump_csv(self, rows: List[List[Any]]) -> bytes:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode()
+
+    def _dump_ndjson(self, rows: List[Dict]) -> bytes:
+        option = orjson.OPT_PASSTHROUGH_DATETIME
+        return b"".join(orjson.dumps(row, default=self._default, option=option) + b"\n" for row in rows)
+
+    async def stream(self) -> AsyncIterator[bytes]:
+        """
+        逐批生成导出内容
+        :return:
+        """
+        if self._format == ExportFormat.CSV:
+            # 带BOM头，Excel打开时中文不乱码
+            yield "\ufeff".encode() + self._dump_csv([self._fields])
+        async for rows in self._fetch_chunks():
+            if self._format == ExportFormat.CSV:
+                yield self._dump_csv([[self._csv_value(row[field]) for field in self._fields] for row in rows])
+            else:
+                yield self._dump_ndjson(rows)
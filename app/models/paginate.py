@@ -1,24 +1,130 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+import json
 from math import ceil
+from typing import Any, Awaitable, Callable, Dict, List, Set
 
-from app.schemas.paginate import PaginationSchema
+from app.models.enums import CountStrategy
+from app.schemas.paginate import CursorPaginationSchema, PaginationSchema
+from common.cache import ModelVersion
+from common.exceptions import PaginationException
+from common.log import Log
+from common.redis import redis_client
+from config.setting import settings
+from tortoise import connections
 from tortoise.contrib.pydantic import PydanticModel
 from tortoise.queryset import QuerySet
 
+# 被舍弃的查询任务，保留引用直到执行完成
+_discarded_tasks: Set[asyncio.Task] = set()
+
+
+def _discard_task(task: asyncio.Task) -> None:
+    """
+    舍弃不再需要结果的查询任务
+    查询进行中时取消任务，连接可能在读取一半结果时被归还连接池，导致之后使用该连接的查询报错，因此等待其执行完成后丢弃结果
+    :param task: 查询任务
+    :return:
+    """
+    if task.done() or task in _discarded_tasks:
+        return
+    _discarded_tasks.add(task)
+
+    def _on_done(t: asyncio.Task) -> None:
+        _discarded_tasks.discard(t)
+        if not t.cancelled() and (e := t.exception()):
+            Log.warning(f"discarded pagination query error: {e}")
+
+    task.add_done_callback(_on_done)
+
 
 class Pagination(object):
     max_page_size: int = 500
 
-    def __init__(self, page: int = 1, page_size: int = 10) -> None:
+    def __init__(
+        self,
+        page: int = 1,
+        page_size: int = 10,
+        *,
+        count_strategy: CountStrategy = CountStrategy.EXACT,
+        filters: Dict | None = None,
+    ) -> None:
         self._page: int = page
         self._page_size: int = page_size
         self._total_count: int = 0
         self._total_pages: int = 0
+        self._count_strategy: CountStrategy = count_strategy
+        # 查询条件(包含搜索值)，用于生成总数缓存键以及判断是否可以使用估算总数
+        self._filters: Dict = filters or {}
+        self._exact_count: bool = True
         if self._page_size > self.max_page_size:
             self._page_size = self.max_page_size
 
+    async def _get_cache_key(self, queryset: QuerySet) -> str:
+        model = queryset.model
+        version = await ModelVersion.get(model)
+        filters = json.dumps(self._filters, sort_keys=True, default=str)
+        digest = hashlib.md5(filters.encode()).hexdigest()
+        return f"paginate_count:{model._meta.db_table}:{version}:{digest}"
+
+    async def _get_cached_count(self, queryset: QuerySet) -> int:
+        """
+        优先从redis获取总数缓存，模型有写操作后版本号变化，缓存自动失效
+        :param queryset: 过滤后的queryset
+        :return:
+        """
+        try:
+            key = await self._get_cache_key(queryset)
+            count = await redis_client.get(key)
+        except Exception as e:
+            Log.warning(f"get pagination count cache error: {e}")
+            return await queryset.count()
+        if count is not None:
+            return int(count)
+        total_count = await queryset.count()
+        try:
+            await redis_client.setex(key, settings.PAGINATION_COUNT_CACHE_TTL, total_count)
+        except Exception as e:
+            Log.warning(f"set pagination count cache error: {e}")
+        return total_count
+
     @staticmethod
-    async def _get_total_count(queryset: QuerySet) -> int:
-        return await queryset.count()
+    async def _get_estimated_count(queryset: QuerySet) -> int | None:
+        """
+        从MySQL表统计信息中获取估算的总行数，不扫描表
+        :param queryset: 未过滤的queryset
+        :return: 估算总数，非MySQL数据库时返回None
+        """
+        conn = connections.get("default")
+        if conn.capabilities.dialect != "mysql":
+            return None
+        sql = (
+            "SELECT TABLE_ROWS AS table_rows FROM information_schema.TABLES "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s"
+        )
+        rows = await conn.execute_query_dict(sql, [queryset.model._meta.db_table])
+        if not rows or rows[0]["table_rows"] is None:
+            return None
+        return int(rows[0]["table_rows"])
+
+    async def _get_total_count(self, queryset: QuerySet) -> int:
+        match self._count_strategy:
+            case CountStrategy.ESTIMATED:
+                # 只有不带查询条件时才能使用表统计信息，否则退化为缓存总数
+                if not self._filters:
+                    total_count = await self._get_estimated_count(queryset)
+                    if total_count is not None:
+                        self._exact_count = False
+                        return total_count
+                self._exact_count = False
+                return await self._get_cached_count(queryset)
+            case CountStrategy.CACHED:
+                self._exact_count = False
+                return await self._get_cached_count(queryset)
+            case _:
+                return await queryset.count()
 
     async def _get_total_pages(self) -> int:
         return ceil(self._total_count / self._page_size)
@@ -38,6 +144,40 @@ class Pagination(object):
         offset = (self._page - 1) * self._page_size
         return queryset.limit(self._page_size).offset(offset)
 
+    async def paginate(self, queryset: QuerySet, fetch_items: Callable[[QuerySet], Awaitable[List]]) -> List:
+        """
+        总数查询与分页数据查询并发执行，分别占用连接池中的连接
+        总数先返回且偏移量已超出总数时舍弃分页查询，分页查询先返回且不满一页时可直接得出总数，舍弃总数查询
+        :param queryset: 过滤后的queryset
+        :param fetch_items: 获取分页数据的协程函数，参数为加上limit/offset后的queryset
+        :return: 当前页数据
+        """
+        offset = (self._page - 1) * self._page_size
+        count_task = asyncio.create_task(self._get_total_count(queryset))
+        fetch_task = asyncio.create_task(fetch_items(queryset.limit(self._page_size).offset(offset)))
+        try:
+            done, _ = await asyncio.wait({count_task, fetch_task}, return_when=asyncio.FIRST_COMPLETED)
+            # 表统计信息中的行数可能偏小，估算总数时不据此跳过分页查询
+            count_first = count_task in done and fetch_task not in done
+            if count_first and self._count_strategy != CountStrategy.ESTIMATED and count_task.result() <= offset:
+                _discard_task(fetch_task)
+                self._total_count = count_task.result()
+                items: List = []
+            else:
+                items = await fetch_task
+                if not count_task.done() and (0 < len(items) < self._page_size or (not items and offset == 0)):
+                    _discard_task(count_task)
+                    self._total_count = offset + len(items)
+                    self._exact_count = True
+                else:
+                    self._total_count = await count_task
+        finally:
+            for task in (count_task, fetch_task):
+                if not task.done():
+                    _discard_task(task)
+        self._total_pages = await self._get_total_pages()
+        return items
+
     def get_paginated_result(
         self, data: list[PydanticModel] | None
     ) -> PaginationSchema | None:
@@ -47,6 +187,77 @@ class Pagination(object):
                 page_size=self._page_size,
                 total_count=self._total_count,
                 total_pages=self._total_pages,
+                exact_count=self._exact_count,
                 items=data,
             )
         return None
+
+
+class CursorPagination(object):
+    """
+    游标分页，按主键id倒序(与DefaultManager的默认排序一致)
+    通过 id < 游标 / id > 游标 定位，深分页不需要扫描并丢弃前面的数据
+    """
+
+    max_page_size: int = 500
+
+    def __init__(self, page_size: int = 10, after: str | None = None, before: str | None = None) -> None:
+        self._page_size: int = min(page_size, self.max_page_size)
+        self._after: int | None = self.decode_cursor(after) if after else None
+        self._before: int | None = self.decode_cursor(before) if before else None
+        self._next_cursor: str | None = None
+        self._prev_cursor: str | None = None
+
+    @staticmethod
+    def encode_cursor(item_id: int) -> str:
+        return base64.urlsafe_b64encode(str(item_id).encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> int:
+        try:
+            return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise PaginationException(f"invalid cursor: {cursor}")
+
+    @staticmethod
+    def _get_item_id(item: Any) -> int:
+        return item["id"] if isinstance(item, dict) else item.id
+
+    async def paginate(self, queryset: QuerySet, fetch_items: Callable[[QuerySet], Awaitable[List]]) -> List:
+        """
+        多取一条数据用于判断是否还有下一页(上一页)
+        :param queryset: 过滤后的queryset
+        :param fetch_items: 获取分页数据的协程函数，参数为加上游标条件、排序和limit后的queryset，返回的数据需包含id
+        :return: 当前页的数据
+        """
+        limit = self._page_size + 1
+        if self._before is not None:
+            # 向前翻页时按id正序取数据，再反转为倒序
+            rows = await fetch_items(queryset.filter(id__gt=self._before).order_by("id").limit(limit))
+            has_more = len(rows) > self._page_size
+            rows = rows[: self._page_size][::-1]
+            if rows:
+                self._next_cursor = self.encode_cursor(self._get_item_id(rows[-1]))
+                if has_more:
+                    self._prev_cursor = self.encode_cursor(self._get_item_id(rows[0]))
+            return rows
+
+        if self._after is not None:
+            queryset = queryset.filter(id__lt=self._after)
+        rows = await fetch_items(queryset.order_by("-id").limit(limit))
+        has_more = len(rows) > self._page_size
+        rows = rows[: self._page_size]
+        if rows:
+            if has_more:
+                self._next_cursor = self.encode_cursor(self._get_item_id(rows[-1]))
+            if self._after is not None:
+                self._prev_cursor = self.encode_cursor(self._get_item_id(rows[0]))
+        return rows
+
+    def get_paginated_result(self, data: list[PydanticModel] | None) -> CursorPaginationSchema:
+        return CursorPaginationSchema(
+            page_size=self._page_size,
+            next_cursor=self._next_cursor,
+            prev_cursor=self._prev_cursor,
+            items=data or [],
+        )
@@ -1,6 +1,6 @@
 from typing import List
 
-from app.models.base import ModelWithStatus, DefaultManager
+from app.models.base import ClosureModel, DefaultManager, ModelWithStatus, TreeMixin
 from common.exceptions import APIException
 from fastapi import Request
 from passlib.context import CryptContext
@@ -90,7 +90,14 @@ class User(ModelWithStatus):
         return self.username
 
 
-class Department(ModelWithStatus):
+class DepartmentClosure(ClosureModel):
+    class Meta:
+        table = "t_department_closure"
+        table_description = "部门层级关系闭包表"
+        unique_together = ("ancestor_id", "descendant_id")
+
+
+class Department(TreeMixin, ModelWithStatus):
     name = fields.CharField(description="部门名称", max_length=40)
     code = fields.CharField(description="部门标识", max_length=80)
     parent: fields.ForeignKeyNullableRelation["Department"] = fields.ForeignKeyField(
@@ -103,6 +110,8 @@ class Department(ModelWithStatus):
     remark = fields.CharField(description="备注", max_length=300, default="")
     children: fields.ReverseRelation["Department"]
 
+    closure_model = DepartmentClosure
+
     class Meta:
         manager = DefaultManager()
         table = "t_department"
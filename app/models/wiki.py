@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from app.models.base import BasicModel, DefaultManager
 from core.security import get_current_username
 from fastapi import Request
@@ -34,7 +36,10 @@ class WikiPage(BasicModel):
     @classmethod
     async def update_one(cls, _id: str, item: BaseModel, request: Request) -> QuerySetSingle[MODEL]:
         username = await get_current_username(request)
-        await cls.filter(id=_id).update(**item.dict(exclude_unset=True), update_user=username)
+        # queryset更新不会自动刷新update_time，页面内容缓存以update_time判断是否过期
+        await cls.filter(id=_id).update(
+            **item.dict(exclude_unset=True), update_user=username, update_time=datetime.now()
+        )
         return cls.get(id=_id)  # type: ignore
 
     def __str__(self) -> str:
@@ -1,15 +1,28 @@
+from datetime import datetime
+
 from app.schemas.paginate import BasePageSchema
 from app.schemas.resp import ResponseSchema
-from pydantic import Field
-from .model_creator import OperatorAuditRecordModel, SSHAuditRecordModel
+from pydantic import BaseModel, Field
+from .model_creator import OperatorAuditRecordModel, SSHAuditRecordModel, SSHCommandRecordModel, SSHWatchRecordModel
 
 
 class OperatorAuditRecordRespSchema(ResponseSchema):
     result: OperatorAuditRecordModel | None  # type: ignore
 
 
+class OperatorAuditRecordDetail(OperatorAuditRecordModel):  # type: ignore
+    request_body: str = Field(default="", description="请求参数")
+    response_content: str = Field(default="", description="响应内容")
+
+
+class OperatorAuditRecordDetailRespSchema(ResponseSchema):
+    result: OperatorAuditRecordDetail | None  # type: ignore
+
+
 class OperatorAuditRecordQuerySchema(BasePageSchema):
     username: str | None = Field(default=None, description="用户名")
+    start_time: datetime | None = Field(default=None, description="开始时间")
+    end_time: datetime | None = Field(default=None, description="结束时间")
 
 
 class SSHAuditRecordRespSchema(ResponseSchema):
@@ -18,3 +31,37 @@ class SSHAuditRecordRespSchema(ResponseSchema):
 
 class SSHAuditRecordQuerySchema(BasePageSchema):
     username: str | None = Field(default=None, description="用户名")
+    start_time: datetime | None = Field(default=None, description="开始时间")
+    end_time: datetime | None = Field(default=None, description="结束时间")
+
+
+class SSHCommandRecordRespSchema(ResponseSchema):
+    result: SSHCommandRecordModel | None  # type: ignore
+
+
+class SSHCommandRecordQuerySchema(BasePageSchema):
+    ssh_audit_id: int | None = Field(default=None, description="SSH审计记录ID")
+    username: str | None = Field(default=None, description="用户名")
+    ssh_host: str | None = Field(default=None, description="SSH主机")
+    ssh_user: str | None = Field(default=None, description="SSH用户名")
+    command: str | None = Field(default=None, description="命令前缀")
+    in_editor: bool | None = Field(default=None, description="是否为编辑器中的输入")
+    start_time: datetime | None = Field(default=None, description="开始时间")
+    end_time: datetime | None = Field(default=None, description="结束时间")
+
+
+class SSHWatchRecordRespSchema(ResponseSchema):
+    result: SSHWatchRecordModel | None  # type: ignore
+
+
+class SSHWatchRecordQuerySchema(BasePageSchema):
+    ssh_audit_id: int | None = Field(default=None, description="SSH审计记录ID")
+    username: str | None = Field(default=None, description="观看者用户名")
+    owner: str | None = Field(default=None, description="会话所属用户名")
+    start_time: datetime | None = Field(default=None, description="开始时间")
+    end_time: datetime | None = Field(default=None, description="结束时间")
+
+
+class SSHRecordPlaybackQuerySchema(BaseModel):
+    start: float = Field(default=0, ge=0, description="开始时间(秒)")
+    end: float | None = Field(default=None, ge=0, description="结束时间(秒)，为空时读取到录像末尾")
@@ -0,0 +1,19 @@
+from typing import List
+
+from pydantic import BaseModel, Field
+
+
+class BulkDeleteReq(BaseModel):
+    ids: List[int] = Field(description="需要删除的id列表")
+
+
+class BulkErrorSchema(BaseModel):
+    index: int = Field(description="出错数据在请求列表中的下标")
+    id: int | None = Field(default=None, description="出错数据的id")
+    error: str = Field(description="错误信息")
+
+
+class BulkResultSchema(BaseModel):
+    total: int
+    success_count: int
+    errors: List[BulkErrorSchema]
@@ -1,4 +1,4 @@
-from app.models.audit import OperatorAuditRecord, SSHAuditRecord
+from app.models.audit import OperatorAuditRecord, SSHAuditRecord, SSHCommandRecord, SSHWatchRecord
 from app.models.basis import HostGroup, Host, Db, ConfigCenter, Application, Environment, EnvironmentGroup, DeployConfig
 from app.models.cicd import Artifact, CICDPlugin, PipelinePlugin
 from app.models.job import AdhocHistory, Script
@@ -91,6 +91,26 @@ SSHAuditRecordReq = pydantic_model_creator(
         "update_time",
     ),
 )
+SSHCommandRecordModel = pydantic_model_creator(SSHCommandRecord, name="SSHCommandRecordModel")
+SSHCommandRecordReq = pydantic_model_creator(
+    SSHCommandRecord,
+    name="SSHCommandRecordReq",
+    exclude=(
+        "id",
+        "create_time",
+        "update_time",
+    ),
+)
+SSHWatchRecordModel = pydantic_model_creator(SSHWatchRecord, name="SSHWatchRecordModel")
+SSHWatchRecordReq = pydantic_model_creator(
+    SSHWatchRecord,
+    name="SSHWatchRecordReq",
+    exclude=(
+        "id",
+        "create_time",
+        "update_time",
+    ),
+)
 
 # Job
 AdhocHistoryModel = pydantic_model_creator(AdhocHistory, name="AdhocHistoryModel")
@@ -1,12 +1,17 @@
 from typing import Dict, List
 
-from pydantic import BaseModel
+from app.models.enums import PaginateMode
+from pydantic import BaseModel, Field
 
 
 class BasePageSchema(BaseModel):
     page: int | None = 1
     page_size: int | None = 10
     search: str | int | None = None
+    paginate_mode: PaginateMode = Field(default=PaginateMode.OFFSET, description="分页模式，offset：页码分页，cursor：游标分页")
+    after: str | None = Field(default=None, description="游标分页，获取该游标之后的数据")
+    before: str | None = Field(default=None, description="游标分页，获取该游标之前的数据")
+    fields: str | None = Field(default=None, description="只返回指定的列，多个列以逗号分隔，如 id,name")
 
 
 class PaginationSchema(BaseModel):
@@ -14,4 +19,12 @@ class PaginationSchema(BaseModel):
     page_size: int
     total_pages: int
     total_count: int
+    exact_count: bool = True
+    items: Dict | List | None
+
+
+class CursorPaginationSchema(BaseModel):
+    page_size: int
+    next_cursor: str | None
+    prev_cursor: str | None
     items: Dict | List | None
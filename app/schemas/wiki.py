@@ -2,7 +2,7 @@ from typing import List
 
 from app.schemas.paginate import BasePageSchema
 from app.schemas.resp import ResponseSchema
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from .model_creator import WikiZoneModel, WikiCategoryModel, WikiPageModel
 
 
@@ -36,6 +36,12 @@ class WikiCategoryChildrenRespSchema(ResponseSchema):
 
 class WikiCategoryPageQuerySchema(BaseModel):
     zone_id: str | int
+    lazy: bool = Field(default=False, description="懒加载模式，页面只返回元数据，内容通过页面详情接口获取")
+
+
+class WikiCategoryNodeQuerySchema(BaseModel):
+    zone_id: str | int
+    parent_id: str | int | None = Field(default=None, description="父目录id，为空时获取顶层目录")
 
 
 class WikiSharePageQuerySchema(BaseModel):
@@ -0,0 +1,249 @@
+import gzip
+import os
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Type
+
+import orjson
+from app.models.audit import OperatorAuditRecord, SSHAuditRecord, SSHCommandRecord
+from app.models.base import BasicModel
+from app.schemas.audit import SSHRecordPlaybackQuerySchema
+from app.schemas.model_creator import OperatorAuditRecordModel
+from common.exceptions import APIException
+from common.log import Log
+from common.make import run_async
+from common.redis import redis_client
+from config.setting import settings
+from tortoise import connections
+from tortoise.models import MODEL
+from tortoise.queryset import QuerySet
+from utils.recorder import SessionRecorder
+
+
+class AuditService(object):
+    @staticmethod
+    async def get_operator_record(item_id: int) -> Dict:
+        record_obj = await OperatorAuditRecord.get(pk=item_id)
+        data = await OperatorAuditRecordModel.from_tortoise_orm(record_obj)
+        result = data.dict()
+        # 报文只在查看详情时解压
+        result["request_body"] = record_obj.get_request_body()
+        result["response_content"] = record_obj.get_response_content()
+        return result
+
+    @staticmethod
+    async def get_ssh_record(item_id: int, param: SSHRecordPlaybackQuerySchema) -> Dict:
+        """
+        读取SSH会话录像中指定时间范围内的事件
+        :param item_id: SSH审计记录id
+        :param param: 回放时间范围
+        :return:
+        """
+        record_obj = await SSHAuditRecord.get(pk=item_id)
+        if not record_obj.record_file:
+            raise APIException("This session has no record.")
+        file_path = Path(settings.SSH_RECORD_DIR) / record_obj.record_file
+        if not await run_async(file_path.exists):
+            raise APIException("Session record file does not exist.")
+        return await run_async(
+            SessionRecorder.read_events,
+            str(file_path),
+            param.start,
+            param.end,
+            settings.SSH_RECORD_PLAYBACK_MAX_EVENTS,
+        )
+
+    @staticmethod
+    async def get_page_queryset(queryset: QuerySet[MODEL], item: Dict) -> QuerySet[MODEL]:
+        # 按创建时间范围过滤，审计表分区后只会扫描范围内的分区
+        # 前端传入的是展示时间，与 resp.ok 中的时间转换保持一致，需减去8小时
+        start_time = item.pop("start_time", None)
+        end_time = item.pop("end_time", None)
+        if start_time:
+            queryset = queryset.filter(create_time__gte=start_time - timedelta(hours=8))
+        if end_time:
+            queryset = queryset.filter(create_time__lt=end_time - timedelta(hours=8))
+        return queryset.filter(**item)
+
+    @staticmethod
+    async def get_command_page_queryset(queryset: QuerySet[MODEL], item: Dict) -> QuerySet[MODEL]:
+        # 命令按前缀匹配，可以使用命令列上的索引
+        if command := item.pop("command", None):
+            queryset = queryset.filter(command__startswith=command)
+        return await AuditService.get_page_queryset(queryset, item)
+
+
+class AuditPartitionService(object):
+    """
+    审计表按月分区管理(仅支持MySQL)
+    分区 pYYYYMM 存放该月的数据，pmax 兜底存放未创建分区月份的数据
+    """
+
+    models: List[Type[BasicModel]] = [OperatorAuditRecord, SSHAuditRecord, SSHCommandRecord]
+    max_partition: str = "pmax"
+    lock_key: str = "audit_partition_lock"
+
+    @staticmethod
+    def _add_months(month: date, months: int) -> date:
+        index = month.year * 12 + month.month - 1 + months
+        return date(index // 12, index % 12 + 1, 1)
+
+    @staticmethod
+    def _partition_name(month: date) -> str:
+        return f"p{month:%Y%m}"
+
+    @classmethod
+    def _partition_sql(cls, months: List[date]) -> str:
+        items = [
+            f"PARTITION {cls._partition_name(month)} VALUES LESS THAN (TO_DAYS('{cls._add_months(month, 1)}'))"
+            for month in months
+        ]
+        items.append(f"PARTITION {cls.max_partition} VALUES LESS THAN MAXVALUE")
+        return ", ".join(items)
+
+    @classmethod
+    def _get_months(cls, start: date, end: date) -> List[date]:
+        months = []
+        while start <= end:
+            months.append(start)
+            start = cls._add_months(start, 1)
+        return months
+
+    @staticmethod
+    async def _get_partitions(table: str) -> List[str]:
+        sql = (
+            "SELECT PARTITION_NAME AS name FROM information_schema.PARTITIONS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL "
+            "ORDER BY PARTITION_ORDINAL_POSITION"
+        )
+        rows = await connections.get("default").execute_query_dict(sql, [table])
+        return [row["name"] for row in rows]
+
+    @classmethod
+    def _parse_month(cls, partition: str) -> date | None:
+        try:
+            return datetime.strptime(partition, "p%Y%m").date()
+        except ValueError:
+            return None
+
+    @classmethod
+    async def _partition_table(cls, table: str, current: date) -> None:
+        """
+        将未分区的表改为按月分区，分区键需要包含在主键中
+        :param table: 表名
+        :param current: 当前月份
+        :return:
+        """
+        conn = connections.get("default")
+        rows = await conn.execute_query_dict(f"SELECT MIN(create_time) AS min_time FROM `{table}`")
+        min_time = rows[0]["min_time"] if rows else None
+        start = date(min_time.year, min_time.month, 1) if min_time else current
+        months = cls._get_months(start, cls._add_months(current, settings.AUDIT_PARTITION_PRECREATE_MONTHS))
+        await conn.execute_script(
+            f"ALTER TABLE `{table}` DROP PRIMARY KEY, ADD PRIMARY KEY (`id`, `create_time`) "
+            f"PARTITION BY RANGE (TO_DAYS(`create_time`)) ({cls._partition_sql(months)})"
+        )
+        Log.info(f"partition table {table} by month, {len(months)} partitions created")
+
+    @classmethod
+    async def _create_partitions(cls, table: str, partitions: List[str], current: date) -> None:
+        """
+        从 pmax 中拆分出未来月份的分区
+        :param table: 表名
+        :param partitions: 已存在的分区
+        :param current: 当前月份
+        :return:
+        """
+        existing = [month for month in map(cls._parse_month, partitions) if month]
+        start = cls._add_months(max(existing), 1) if existing else current
+        months = cls._get_months(start, cls._add_months(current, settings.AUDIT_PARTITION_PRECREATE_MONTHS))
+        if months:
+            await connections.get("default").execute_script(
+                f"ALTER TABLE `{table}` REORGANIZE PARTITION {cls.max_partition} INTO ({cls._partition_sql(months)})"
+            )
+            Log.info(f"create {len(months)} partitions for table {table}")
+
+    @staticmethod
+    def _archive_row(model: Type[BasicModel], row: Dict) -> Dict:
+        if model is OperatorAuditRecord:
+            # 归档文件中保存报文原文，便于离线检索
+            encoding = row.get("body_encoding", "")
+            row["request_body"] = OperatorAuditRecord.decode_body(row.get("request_body"), encoding)
+            row["response_content"] = OperatorAuditRecord.decode_body(row.get("response_content"), encoding)
+        return row
+
+    @classmethod
+    async def export_partition(cls, model: Type[BasicModel], partition: str) -> str:
+        """
+        将分区数据按主键顺序分批导出为gzip压缩的NDJSON文件
+        :param model: 审计模型
+        :param partition: 分区名
+        :return: 归档文件路径
+        """
+        table = model._meta.db_table
+        archive_dir = Path(settings.AUDIT_ARCHIVE_DIR) / table
+        archive_dir.mkdir(parents=True, exist_ok=True)
+        file_path = archive_dir / f"{table}_{partition}.ndjson.gz"
+        # 先写临时文件，导出完整后再重命名，避免半成品被当作归档文件
+        tmp_path = archive_dir / f"{file_path.name}.part"
+        conn = connections.get("default")
+        sql = f"SELECT * FROM `{table}` PARTITION ({partition}) WHERE id > %s ORDER BY id LIMIT %s"
+        last_id = 0
+        with gzip.open(tmp_path, "wb") as f:
+            while True:
+                rows = await conn.execute_query_dict(sql, [last_id, settings.AUDIT_ARCHIVE_CHUNK_SIZE])
+                if not rows:
+                    break
+                lines = [orjson.dumps(cls._archive_row(model, row)) + b"\n" for row in rows]
+                await run_async(f.write, b"".join(lines))
+                last_id = rows[-1]["id"]
+        await run_async(os.replace, tmp_path, file_path)
+        return str(file_path)
+
+    @classmethod
+    async def _archive_partitions(cls, model: Type[BasicModel], partitions: List[str], current: date) -> None:
+        """
+        导出并删除超出保留期的分区
+        :param model: 审计模型
+        :param partitions: 已存在的分区
+        :param current: 当前月份
+        :return:
+        """
+        table = model._meta.db_table
+        cutoff = cls._add_months(current, -settings.AUDIT_PARTITION_RETAIN_MONTHS)
+        for partition in partitions:
+            month = cls._parse_month(partition)
+            if month is None or month >= cutoff:
+                continue
+            file_path = await cls.export_partition(model, partition)
+            await connections.get("default").execute_script(f"ALTER TABLE `{table}` DROP PARTITION {partition}")
+            Log.info(f"archive partition {table}.{partition} to {file_path}")
+
+    @classmethod
+    async def rollover(cls) -> None:
+        """
+        审计表分区滚动，由定时任务调用：未分区的表先分区，补齐未来月份分区，导出并删除过期分区
+        :return:
+        """
+        if connections.get("default").capabilities.dialect != "mysql":
+            Log.warning("audit partition only support mysql, skip rollover")
+            return
+        # 多个worker共用同一个调度存储，加锁避免重复执行
+        if not await redis_client.set(cls.lock_key, 1, nx=True, ex=60 * 60):
+            return
+        try:
+            current = date.today().replace(day=1)
+            for model in cls.models:
+                table = model._meta.db_table
+                try:
+                    partitions = await cls._get_partitions(table)
+                    if partitions:
+                        await cls._create_partitions(table, partitions, current)
+                    else:
+                        await cls._partition_table(table, current)
+                    partitions = await cls._get_partitions(table)
+                    await cls._archive_partitions(model, partitions, current)
+                except Exception as e:
+                    Log.exception(f"rollover table {table} partition error: {e}")
+        finally:
+            await redis_client.delete(cls.lock_key)
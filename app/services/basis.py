@@ -1,10 +1,11 @@
-from typing import List, Dict, Type
+from collections import defaultdict
+from typing import List, Dict
 
 from app.models.basis import HostGroup, Host
 from app.schemas.basis import AssociateHostGroupReq, GetDbSchemaReq, DbExecuteSqlReq, GetDbColumnReq, GetDbTableReq
 from app.schemas.model_creator import HostGroupModel
 from app.services.children import ChildService
-from tortoise.contrib.pydantic import PydanticModel
+from common.cache import ModelVersion, TreeCache
 from tortoise.models import MODEL, Model
 from tortoise.queryset import QuerySet
 from utils.abstract import DbOperator
@@ -15,62 +16,65 @@ class HostService(object):
     @staticmethod
     async def get_page_queryset(queryset: QuerySet[MODEL], item: Dict) -> QuerySet[MODEL]:
         if "host_group_id" in item:
-            hosts = await queryset.filter(host_group_id=item["host_group_id"])
-            if not hosts:
-                host_group_id = item.pop("host_group_id")
-                host_group_obj = await HostGroup.get(pk=host_group_id)
-                children = await host_group_obj.children.all()
-                children_ids = [child.id for child in children]
-                queryset = queryset.filter(host_group_id__in=children_ids).filter(**item)
-                return queryset
-            else:
-                return queryset.filter(**item)
-        else:
-            return queryset.filter(**item)
+            # 主机组及其所有层级的子主机组下的主机
+            host_group_id = item.pop("host_group_id")
+            queryset = queryset.filter(host_group_id__in=HostGroup.descendants_of(host_group_id))
+        return queryset.filter(**item)
 
     @staticmethod
     async def associate_host_group(param: AssociateHostGroupReq) -> None:
         await Host.filter(pk__in=param.host_ids).update(host_group_id=param.host_group_id)
+        await ModelVersion.bump(Host)
 
 
 class HostGroupService(object):
     @staticmethod
     async def get_children_data() -> List:
+        return await host_group_tree_cache.get()
+
+    @staticmethod
+    async def get_children_data_with_host() -> List:
+        return await host_group_host_tree_cache.get()
+
+    @staticmethod
+    async def build_children_data() -> List:
         host_group_obj_qs = await HostGroup.all()
         data = await ChildService.get_children_data(host_group_obj_qs, HostGroupModel)  # type: ignore
         return data
 
     @staticmethod
-    async def get_children_data_with_host() -> List:
-        async def _get_children_data(obj: Model, model_pydantic: Type[PydanticModel]) -> dict:
-            childrens = await obj.children.all()  # type: ignore
-            ret = await model_pydantic.from_tortoise_orm(obj)
-            result = ret.dict()
-            children_list = []
-            for children in childrens:
-                ret = await _get_children_data(children, model_pydantic)  # type: ignore
-                children_list.append(ret)
-            host_obj_qs = await obj.hosts.all()  # type: ignore
-            hosts_data = []
-            for host_obj in host_obj_qs:
-                item = {
-                    "key": f"host-{host_obj.external_ip}-{host_obj.id}",
+    async def build_children_data_with_host() -> List:
+        host_group_obj_qs = await HostGroup.all()
+        # 一次查询出所有主机组下的主机
+        hosts_map: Dict[int, List[Dict]] = defaultdict(list)
+        host_qs = Host.filter(host_group_id__in=[obj.id for obj in host_group_obj_qs])
+        for host in await host_qs.values("id", "external_ip", "remark", "host_group_id"):
+            hosts_map[host["host_group_id"]].append(
+                {
+                    "key": f"host-{host['external_ip']}-{host['id']}",
                     # Ant-Design-Vue3 Tree组件会校验KEY，KEY如果重复会导致展示异常，故key加前缀来避免
-                    "title": f"{host_obj.external_ip}({host_obj.remark})",
+                    "title": f"{host['external_ip']}({host['remark']})",
                 }
-                hosts_data.append(item)
-            if hosts_data and children_list == []:
-                children_list = hosts_data  # type: ignore
-            result["children"] = children_list
-            return result
+            )
+
+        async def _handle_hosts(obj: Model, result: Dict) -> None:
+            # 没有子主机组时展示主机组下的主机
+            hosts_data = hosts_map.get(obj.id)  # type: ignore
+            if hosts_data and result["children"] == []:
+                result["children"] = hosts_data
 
-        host_group_obj_qs = await HostGroup.all()
         data = await ChildService.get_children_data(
-            host_group_obj_qs, HostGroupModel, children_handler=_get_children_data  # type: ignore
+            host_group_obj_qs, HostGroupModel, children_handler=_handle_hosts  # type: ignore
         )
         return data
 
 
+host_group_tree_cache = TreeCache("host_group", HostGroupService.build_children_data, [HostGroup], warm_up=True)
+host_group_host_tree_cache = TreeCache(
+    "host_group_host", HostGroupService.build_children_data_with_host, [HostGroup, Host], warm_up=True
+)
+
+
 class DbService(object):
     @classmethod
     def _get_db_operator(cls, param: GetDbSchemaReq) -> DbOperator:
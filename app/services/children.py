@@ -1,32 +1,68 @@
-from typing import List, Dict, Type, Callable
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Set, Type
 
 from tortoise import Model
 from tortoise.contrib.pydantic import PydanticModel
 
 
 class ChildService(object):
-    @classmethod
-    async def _get_children_data(cls, obj: Model, model_pydantic: Type[PydanticModel]) -> Dict:
-        childrens = await obj.children.all()  # type: ignore
-        ret = await model_pydantic.from_tortoise_orm(obj)
-        result = ret.dict()
-        children_list = []
-        for children in childrens:
-            ret = await cls._get_children_data(children, model_pydantic)  # type: ignore
-            children_list.append(ret)
-        result["children"] = children_list
+    @staticmethod
+    def _serialize(obj: Model, model_pydantic: Type[PydanticModel]) -> Dict:
+        """
+        按pydantic模型的字段序列化单个节点，不加载任何关联数据
+        :param obj: 节点对象
+        :param model_pydantic: pydantic模型
+        :return:
+        """
+        fetch_fields = obj._meta.fetch_fields
+        result: Dict[str, Any] = {}
+        for field_name in model_pydantic.__fields__:
+            if field_name in fetch_fields:
+                # 关联字段(如children)由树结构填充
+                result[field_name] = []
+                continue
+            value = getattr(obj, field_name)
+            # computed 字段(如key、title)为模型方法
+            result[field_name] = value() if callable(value) else value
         return result
 
     @classmethod
     async def get_children_data(
-        cls, queryset: List[Model], model_pydantic: Type[PydanticModel], children_handler: Callable = None
+        cls,
+        queryset: List[Model],
+        model_pydantic: Type[PydanticModel],
+        children_handler: Callable[[Model, Dict], Awaitable[None]] = None,
+        nodes: List[Model] | None = None,
     ) -> List:
+        """
+        根据一次查询出的所有节点在内存中组装树结构
+        :param queryset: 所有节点，其中的顶层节点作为树的根节点
+        :param model_pydantic: pydantic模型
+        :param children_handler: 节点的子节点组装完成后调用，参数为节点对象和节点数据，用于补充节点数据
+        :param nodes: 用于查找子节点的全部节点，queryset经过过滤时传入，匹配的顶层节点返回完整的子树，为空时使用queryset
+        :return:
+        """
+        children_map: Dict[int, List[Model]] = defaultdict(list)
+        for obj in queryset if nodes is None else nodes:
+            parent_id = obj.parent_id  # type: ignore
+            if parent_id is not None:
+                children_map[parent_id].append(obj)
+
+        # 记录已组装的节点，避免数据中存在环时无限递归
+        visited: Set[int] = set()
+
+        async def _build(obj: Model) -> Dict:
+            visited.add(obj.pk)
+            result = cls._serialize(obj, model_pydantic)
+            result["children"] = [
+                await _build(children) for children in children_map[obj.pk] if children.pk not in visited
+            ]
+            if children_handler:
+                await children_handler(obj, result)
+            return result
+
         data = []
         for obj in queryset:
-            if not obj.parent:  # type: ignore
-                if children_handler:
-                    item = await children_handler(obj, model_pydantic)
-                else:
-                    item = await cls._get_children_data(obj, model_pydantic)
-                data.append(item)
+            if obj.parent_id is None and obj.pk not in visited:  # type: ignore
+                data.append(await _build(obj))
         return data
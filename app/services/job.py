@@ -1,6 +1,8 @@
+import asyncio
 import json
-from collections import defaultdict
-from typing import List, Dict
+from collections import defaultdict, deque
+from typing import Any, AsyncIterator, Awaitable, Deque, List, Dict, Set, Tuple
+from uuid import uuid4
 
 import aiofiles  # type: ignore
 from aiofiles import os as async_os
@@ -10,20 +12,171 @@ from app.models.job import AdhocHistory, Script, ScriptHistory
 from app.schemas.job import ExecModuleReq, ExecTaskReq
 from app.schemas.model_creator import ScriptModel
 from app.services.children import ChildService
+from common.cache import ModelVersion
+from common.exceptions import APIException
+from common.log import Log
+from config.setting import settings
 from tortoise.contrib.pydantic import pydantic_model_creator
 from utils.crypt import AESCipher, md5_encode_with_salt
 from utils.executor import AnsibleExecutor
 
 
+class AnsibleJob(object):
+    """
+    流式执行的ansible作业
+    ansible-runner 在执行线程中回调事件，通过 call_soon_threadsafe 转到事件循环中处理，
+    按主机整理后追加到有界的最近事件队列，并推送给所有订阅者
+    """
+
+    # 当前worker中的作业，键为作业ID
+    jobs: Dict[str, "AnsibleJob"] = {}
+    # ansible-runner 主机事件与推送的事件类型
+    host_events: Dict[str, str] = {
+        "runner_on_start": "start",
+        "runner_on_ok": "ok",
+        "runner_on_failed": "failed",
+        "runner_on_unreachable": "unreachable",
+        "runner_on_skipped": "skipped",
+    }
+
+    def __init__(self, username: str) -> None:
+        self.job_id: str = uuid4().hex
+        self.username: str = username
+        self.status: str = "running"
+        # 最近的事件，每个事件带递增的序号，订阅时从序号之后开始推送
+        self.tail: Deque[Dict[str, Any]] = deque(maxlen=settings.ANSIBLE_JOB_TAIL_SIZE)
+        self.seq: int = 0
+        self._subscribers: Set[asyncio.Queue[Dict[str, Any] | None]] = set()
+        self._loop = asyncio.get_running_loop()
+        self._task: asyncio.Task | None = None
+        self.jobs[self.job_id] = self
+
+    @classmethod
+    def get_job(cls, job_id: str, username: str) -> "AnsibleJob | None":
+        """
+        获取作业，只能查看自己执行的作业
+        :param job_id: 作业ID
+        :param username: 当前用户名
+        :return:
+        """
+        job = cls.jobs.get(job_id)
+        if job and job.username == username:
+            return job
+        return None
+
+    def start(self, executor: Awaitable[Dict[str, Any]], files: List[str]) -> None:
+        """
+        在后台执行作业
+        :param executor: 执行作业的协程
+        :param files: 执行完成后需要删除的文件
+        :return:
+        """
+        self._task = asyncio.create_task(self._run(executor, files))
+
+    async def _run(self, executor: Awaitable[Dict[str, Any]], files: List[str]) -> None:
+        try:
+            result = await executor
+        except Exception as e:
+            Log.exception(e)
+            result = {"status": "error", "rc": None, "stats": None, "error": str(e)}
+        finally:
+            for filepath in files:
+                try:
+                    await JobService._remove_file(filepath)
+                except OSError as e:
+                    Log.warning(f"remove job file {filepath} error: {e}")
+        self._finish(result)
+
+    def event_handler(self, event: Dict[str, Any]) -> bool:
+        """
+        ansible-runner 事件回调，在执行线程中调用
+        :param event: ansible-runner 事件
+        :return: 返回True时 ansible-runner 保留该事件的文件
+        """
+        self._loop.call_soon_threadsafe(self._on_event, event)
+        return True
+
+    def _on_event(self, event: Dict[str, Any]) -> None:
+        event_type = self.host_events.get(event.get("event", ""))
+        stdout = event.get("stdout", "")
+        if event_type is None and not stdout:
+            return
+        event_data = event.get("event_data", {})
+        self._publish(
+            {
+                "event": event_type or "verbose",
+                "host": event_data.get("host", ""),
+                "task": event_data.get("task", ""),
+                "stdout": stdout,
+            }
+        )
+
+    def _publish(self, item: Dict[str, Any]) -> None:
+        self.seq += 1
+        item["seq"] = self.seq
+        self.tail.append(item)
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(item)
+            except asyncio.QueueFull:
+                # 订阅者消费过慢，关闭其队列，由订阅者从最近事件重新订阅
+                self._close_queue(queue)
+
+    def _close_queue(self, queue: asyncio.Queue[Dict[str, Any] | None]) -> None:
+        self._subscribers.discard(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    def _finish(self, result: Dict[str, Any]) -> None:
+        self.status = result["status"]
+        self._publish({"event": "end", "host": "", "task": "", "stdout": "", **result})
+        for queue in list(self._subscribers):
+            self._close_queue(queue)
+        # 保留一段时间后移除，期间仍可以查看事件
+        self._loop.call_later(settings.ANSIBLE_JOB_RETENTION, self.jobs.pop, self.job_id, None)
+
+    def get_events(self, offset: int) -> List[Dict[str, Any]]:
+        """
+        获取序号之后的最近事件，早于最近事件的部分已被丢弃
+        :param offset: 已收到的最后一个事件序号
+        :return:
+        """
+        return [item for item in self.tail if item["seq"] > offset]
+
+    async def events(self, offset: int) -> AsyncIterator[Dict[str, Any]]:
+        """
+        先推送序号之后的最近事件，再推送新产生的事件，作业结束后退出
+        :param offset: 已收到的最后一个事件序号
+        :return:
+        """
+        while True:
+            # 获取最近事件与注册订阅之间没有await，不会遗漏事件
+            items = self.get_events(offset)
+            queue: asyncio.Queue[Dict[str, Any] | None] | None = None
+            if self.status == "running":
+                queue = asyncio.Queue(maxsize=settings.ANSIBLE_JOB_SUBSCRIBER_QUEUE_SIZE)
+                self._subscribers.add(queue)
+            try:
+                for item in items:
+                    offset = item["seq"]
+                    yield item
+                if queue is None:
+                    return
+                while (item := await queue.get()) is not None:  # type: ignore
+                    offset = item["seq"]
+                    yield item
+            finally:
+                if queue is not None:
+                    self._subscribers.discard(queue)
+
+
 class JobService(object):
     @classmethod
     async def _get_inventory(cls, host_group_id: int) -> str:
-        host_group_obj = await HostGroup.get(pk=host_group_id)
-        host_obj_qs = await host_group_obj.hosts.all()
-        if not host_obj_qs:
-            children = await host_group_obj.children.all()
-            children_ids = [child.id for child in children]
-            host_obj_qs = await Host.filter(host_group_id__in=children_ids)
+        await HostGroup.get(pk=host_group_id)
+        # 主机组及其所有层级的子主机组下的主机
+        host_obj_qs = await Host.filter(host_group_id__in=HostGroup.descendants_of(host_group_id))
         inventory = {"all": {"hosts": {}}}  # type: ignore
         for host_obj in host_obj_qs:
             inventory["all"]["hosts"][host_obj.intranet_ip] = {
@@ -50,12 +203,18 @@ class JobService(object):
         result = await AnsibleExecutor.exec_module(inventory=inventory, **body)
         # 记录入库
         await AdhocHistory.create(username=username, host_group_id=host_group_id, **body)
+        await ModelVersion.bump(AdhocHistory)
         # 删除inventory文件，避免冗余
         await cls._remove_file(inventory)
         return result
 
     @classmethod
-    async def exec_task(cls, param: ExecTaskReq) -> str:
+    async def _prepare_task(cls, param: ExecTaskReq) -> Tuple[bool, Dict[str, Any], List[str]]:
+        """
+        生成inventory并写入脚本文件
+        :param param: 执行参数
+        :return: 是否为playbook，执行器参数，执行完成后需要删除的文件
+        """
         inventory = await cls._get_inventory(param.host_group_id)
         executable = "bash"
         file_name = ""
@@ -79,25 +238,78 @@ class JobService(object):
         # 写入本地文件
         async with aiofiles.open(f"/tmp/{file_name}", "w") as f:
             await f.write(param.content)
+        # 执行完成后删除inventory文件与脚本文件，避免冗余
+        files = [inventory, f"/tmp/{file_name}"]
         # 远程脚本使用script模块执行，playbook使用ansible执行
         if executable != "ansible":
-            result = await AnsibleExecutor.exec_module(
-                inventory=inventory,
-                host_pattern=param.host_pattern,
-                module="script",
-                module_args=f"/tmp/{file_name} executable={executable}",
+            return (
+                False,
+                {
+                    "inventory": inventory,
+                    "host_pattern": param.host_pattern,
+                    "module": "script",
+                    "module_args": f"/tmp/{file_name} executable={executable}",
+                },
+                files,
             )
+        return True, {"inventory": inventory, "playbook": f"/tmp/{file_name}"}, files
+
+    @classmethod
+    async def exec_task(cls, param: ExecTaskReq) -> str:
+        is_playbook, kwargs, files = await cls._prepare_task(param)
+        if is_playbook:
+            result = await AnsibleExecutor.exec_task(**kwargs)
         else:
-            result = await AnsibleExecutor.exec_task(
-                inventory=inventory,
-                playbook=f"/tmp/{file_name}",
-            )
-        # 删除inventory文件，避免冗余
-        await cls._remove_file(inventory)
-        # 删除playbook文件，避免冗余
-        await cls._remove_file(f"/tmp/{file_name}")
+            result = await AnsibleExecutor.exec_module(**kwargs)
+        for filepath in files:
+            await cls._remove_file(filepath)
         return result
 
+    @classmethod
+    async def stream_module(cls, param: ExecModuleReq, username: str) -> Dict[str, str]:
+        """
+        后台执行远程模块，执行过程中的事件通过websocket推送
+        :param param: 执行参数
+        :param username: 当前用户名
+        :return: 作业ID
+        """
+        body = param.dict(exclude_unset=True)
+        host_group_id = body.pop("host_group_id")
+        inventory = await cls._get_inventory(host_group_id)
+        # 记录入库
+        await AdhocHistory.create(username=username, host_group_id=host_group_id, **body)
+        await ModelVersion.bump(AdhocHistory)
+        job = AnsibleJob(username)
+        job.start(AnsibleExecutor.stream_module(job.event_handler, inventory=inventory, **body), [inventory])
+        return {"job_id": job.job_id}
+
+    @classmethod
+    async def stream_task(cls, param: ExecTaskReq, username: str) -> Dict[str, str]:
+        """
+        后台执行远程任务，执行过程中的事件通过websocket推送
+        :param param: 执行参数
+        :param username: 当前用户名
+        :return: 作业ID
+        """
+        is_playbook, kwargs, files = await cls._prepare_task(param)
+        job = AnsibleJob(username)
+        executor = AnsibleExecutor.stream_task if is_playbook else AnsibleExecutor.stream_module
+        job.start(executor(job.event_handler, **kwargs), files)
+        return {"job_id": job.job_id}
+
+    @staticmethod
+    async def get_job_events(job_id: str, username: str, offset: int) -> Dict[str, Any]:
+        """
+        获取作业状态与序号之后的最近事件
+        :param job_id: 作业ID
+        :param username: 当前用户名
+        :param offset: 已收到的最后一个事件序号
+        :return:
+        """
+        if not (job := AnsibleJob.get_job(job_id, username)):
+            raise APIException("This job does not exist or has expired.")
+        return {"job_id": job.job_id, "status": job.status, "events": job.get_events(offset)}
+
     @staticmethod
     async def get_children_data() -> List:
         script_obj_qs = await Script.all()
@@ -1,10 +1,11 @@
-from typing import Tuple, List, Dict
+from typing import Any, Tuple, List, Dict
 
 from app.models.rbac import User, Department
 from app.schemas.auth import LoginReq
 from app.schemas.model_creator import UserModel, DepartmentModel
 from app.schemas.rbac import DepartmentChildrenQuerySchema, UserModifyPasswordReq
 from app.services.children import ChildService
+from common.cache import ModelVersion, TreeCache
 from common.exceptions import APIException
 from tortoise.contrib.pydantic import PydanticModel
 from tortoise.models import MODEL
@@ -32,35 +33,36 @@ class UserService(object):
         if user.verify_hash(param.password_old, user.password):
             user.password = user.generate_hash(param.password_new)
             await user.save()
+            await ModelVersion.bump(User)
         else:
             raise APIException("This user password is incorrect.")
 
     @staticmethod
     async def get_page_queryset(queryset: QuerySet[MODEL], item: Dict) -> QuerySet[MODEL]:
         if "department_id" in item:
-            users = await queryset.filter(department_id=item["department_id"])
-            if not users:
-                department_id = item.pop("department_id")
-                department_obj = await Department.get(pk=department_id)
-                children = await department_obj.children.all()
-                children_ids = [child.id for child in children]
-                queryset = queryset.filter(department_id__in=children_ids).filter(**item)
-                return queryset
-            else:
-                return queryset.filter(**item)
-        else:
-            return queryset.filter(**item)
+            # 部门及其所有层级的子部门下的用户
+            department_id = item.pop("department_id")
+            queryset = queryset.filter(department_id__in=Department.descendants_of(department_id))
+        return queryset.filter(**item)
 
 
 class DepartmentService(object):
     @staticmethod
     async def get_children_data(param: DepartmentChildrenQuerySchema) -> List:
-        query = param.dict(exclude_unset=True, exclude_none=True)
+        return await department_tree_cache.get(**param.dict(exclude_unset=True, exclude_none=True))
+
+    @staticmethod
+    async def build_children_data(**query: Any) -> List:
         search_value = query.pop("search", None)
         if query:
             department_obj_qs = await Department.fuzzy_search(search_value=search_value).filter(**query)
         else:
             department_obj_qs = await Department.fuzzy_search(search_value=search_value)
-        data = await ChildService.get_children_data(department_obj_qs, DepartmentModel)
+        # 匹配过滤条件的顶层部门返回其完整的子部门树，子部门不再按过滤条件过滤
+        nodes = await Department.all() if query or search_value else None
+        data = await ChildService.get_children_data(department_obj_qs, DepartmentModel, nodes=nodes)
 
         return data
+
+
+department_tree_cache = TreeCache("department", DepartmentService.build_children_data, [Department], warm_up=True)
@@ -1,68 +1,291 @@
 import asyncio
+import codecs
 import re
-import threading
-from typing import List
+from datetime import datetime
+from collections import deque
+from typing import Any, Deque, Dict, List, Tuple
+from uuid import uuid4
 
 import orjson
 
-import aiofiles  # type: ignore
 import paramiko  # type: ignore
-from aiofiles import os as async_os
-from app.models.audit import SSHAuditRecord
+from app.models.audit import SSHAuditRecord, SSHCommandRecord, SSHWatchRecord
 from app.models.basis import Host
-from app.models.enums import SSHStatus
+from app.models.enums import SSHStatus, SSHWatchAction, Status
+from app.models.rbac import Role
+from common.audit import audit_writer
+from common.cache import ModelVersion
 from common.exceptions import SSHOperatorException
 from common.log import Log
 from common.make import run_async
 from config.setting import settings
 from fastapi import WebSocket
 from orjson import JSONDecodeError
-from paramiko import SSHClient, Channel, SSHException, SFTPClient
+from paramiko import SSHClient, Channel, SSHException, SFTPClient, SFTPFile, Transport
 from starlette.websockets import WebSocketState
-from utils.crypt import AESCipher, md5_encode_with_salt
+from utils.buffer import RingBuffer
+from utils.crypt import AESCipher
+from utils.recorder import SessionRecorder
+from utils.ssh import jump_host_pool
+
+# 打开vi/vim编辑器，或使用fg将后台的编辑器切回前台
+EDITOR_CMD_RE = re.compile(r"^\s*(?:sudo\s+)?(?:vi|vim|fg)\b")
+# 终端控制字符
+ANSI_ESCAPE_RE = re.compile(r"(?:\x1B[@-_]|[\x80-\x9F])[0-?]*[ -/]*[@-~]|\x08")
+# shell提示符，如 [root@host ~]# 、user@host:~$
+SHELL_PROMPT_RE = re.compile(r"[\w.-]+@[\w.-]+[^\r\n]*[$#] ?$")
+
+
+class _Watcher(object):
+    """
+    只读观看者，输出放入各自的队列，由单独的发送任务发送
+    """
+
+    def __init__(self, websocket: WebSocket, username: str, binary: bool) -> None:
+        self.websocket = websocket
+        self.username = username
+        self.binary = binary
+        self.queue: asyncio.Queue[Tuple[bytes, str] | None] = asyncio.Queue(
+            maxsize=settings.TERMINAL_WATCHER_QUEUE_SIZE
+        )
+        self.task: asyncio.Task | None = None
+        self.stopped: bool = False
+
+    def stop(self) -> None:
+        """
+        清空待发送的输出并放入结束标记，发送任务取到结束标记后退出
+        :return:
+        """
+        if self.stopped:
+            return
+        self.stopped = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
 
 
 class TerminalService(object):
-    def __init__(self, websocket: WebSocket, username: str) -> None:
-        self.websocket: WebSocket = websocket
+    # 当前worker中的终端会话，键为恢复令牌，websocket断开后会话在保留期内可以重新连接
+    sessions: Dict[str, "TerminalService"] = {}
+
+    def __init__(self, websocket: WebSocket, username: str, binary: bool = False) -> None:
+        self.websocket: WebSocket | None = websocket
         self.username: str = username
+        # 二进制模式下终端输出以二进制帧发送原始字节，控制消息仍为JSON文本帧
+        self.binary: bool = binary
         self.ssh_client: SSHClient | None = None
         self.channel: Channel | None = None
         self.sftp_client: SFTPClient | None = None
+        # 使用的跳板机连接，会话结束时归还连接池
+        self.proxy_transport: Transport | None = None
         self.ssh_audit_record_obj: SSHAuditRecord | None = None
         self.upload_file_name: str = "tmp_name"
-        self.cmd: List[str] = []  # 所有命令
+        # 分块上传状态，远程文件句柄、已写入的字节数、文件总字节数
+        self._upload_file_obj: SFTPFile | None = None
+        self._upload_offset: int = 0
+        self._upload_size: int | None = None
+        self._upload_progress_time: float = 0.0
+        self._download_task: asyncio.Task | None = None
+        # 最近的命令，断开连接时写入SSH审计记录作为摘要，完整命令逐条写入SSH命令审计表
+        self.cmd: Deque[str] = deque(maxlen=settings.SSH_COMMAND_SUMMARY_SIZE)
         self.cmd_tmp: str = ""  # 一行命令
+        self._in_editor: bool = False  # 是否正在使用vi编辑文档
         self.tab_mode: bool = False  # 使用tab命令补全时需要读取返回数据然后添加到当前输入命令后
         self.history_mode: bool = False
         self.index: int = 0
+        # 通道输出队列，由事件循环的可读回调写入，转发任务读取后发送到前端
+        # 队列满时暂停读取通道，由SSH流控限制远端发送，浏览器接收慢时服务端内存不会无限增长
+        self._output_queue: asyncio.Queue[bytes | None] = asyncio.Queue(maxsize=settings.TERMINAL_OUTPUT_QUEUE_SIZE)
+        self._reader_fd: int | None = None
+        self._reading: bool = False
+        self._pump_task: asyncio.Task | None = None
+        # 队列满时等待放入结束标记的任务
+        self._eof_task: asyncio.Task | None = None
+        # 多字节字符可能被拆分在两次读取中，使用增量解码避免乱码
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        # 保证控制消息与紧随其后的二进制帧(如下载文件)之间不会插入终端输出
+        self._send_lock: asyncio.Lock = asyncio.Lock()
+        # 恢复令牌，重新连接时用于找回会话
+        self.token: str = uuid4().hex
+        # 最近的终端输出，重新连接时补发断开期间未收到的部分
+        self.scrollback: RingBuffer = RingBuffer(settings.TERMINAL_SCROLLBACK_SIZE)
+        # 已成功发送到前端的输出的绝对偏移量
+        self.sent_offset: int = 0
+        self._close_handle: asyncio.TimerHandle | None = None
+        self._close_task: asyncio.Task | None = None
+        # 观看令牌，只读观看者通过该令牌共享当前SSH通道的输出
+        self.watch_token: str = uuid4().hex
+        # 只读观看者
+        self.watchers: List[_Watcher] = []
+        # 广播模式下所属的广播会话，输出由广播会话标记主机后转发
+        self.hub: "BroadcastService | None" = None
+        self.host_id: int | None = None
+        self.host: str = ""
+        # 会话录像
+        self.recorder: SessionRecorder | None = None
+
+    async def _send_message(self, message: Any, *, message_type: str = "content") -> None:
+        async with self._send_lock:
+            await self._send_json(message, message_type=message_type)
 
-    async def _send_message(self, message: str, *, message_type: str = "content") -> None:
+    async def _send_json(self, message: Any, *, message_type: str = "content") -> None:
         if self.websocket and self.websocket.client_state == WebSocketState.CONNECTED:
             msg = {"type": message_type, "data": message}
             await self.websocket.send_json(msg)
 
-    def _get_ssh_client(self, host_obj: Host, proxy_host_obj: Host) -> str | None:
+    async def _send_output(self, recv: bytes) -> str:
+        """
+        记录并发送终端输出，二进制模式发送原始字节，否则发送解码后的JSON消息
+        websocket已断开时只记录输出，不影响SSH会话
+        :param recv: 通道输出
+        :return: 解码后的文本
+        """
+        self.scrollback.write(recv)
+        data = self._decoder.decode(recv)
+        if self.recorder:
+            self.recorder.record("o", data)
+        if self.hub:
+            await self.hub.forward_output(self, recv, data)
+            return data
+        if self.watchers:
+            self._send_to_watchers(recv, data)
+        async with self._send_lock:
+            if self.websocket is None or self.websocket.client_state != WebSocketState.CONNECTED:
+                return data
+            try:
+                await self._write_output(self.websocket, self.binary, recv, data)
+                self.sent_offset = self.scrollback.end
+            except Exception as e:
+                Log.warning(f"send terminal output error: {e}")
+        return data
+
+    @staticmethod
+    async def _write_output(websocket: WebSocket, binary: bool, recv: bytes, data: str) -> None:
+        if websocket.client_state != WebSocketState.CONNECTED:
+            return
+        if binary:
+            await websocket.send_bytes(recv)
+        elif data:
+            await websocket.send_json({"type": "content", "data": data})
+
+    def _send_to_watchers(self, recv: bytes, data: str) -> None:
+        """
+        将输出放入各观看者的队列，由各自的发送任务发送，观看者发送慢不会拖慢会话，队列满的观看者被移除
+        :param recv: 通道输出
+        :param data: 解码后的文本
+        :return:
+        """
+        for watcher in list(self.watchers):
+            try:
+                watcher.queue.put_nowait((recv, data))
+            except asyncio.QueueFull:
+                Log.warning(f"terminal watcher {watcher.username} is too slow, remove it")
+                # 由发送任务退出时关闭观看者的websocket
+                self.watchers.remove(watcher)
+                watcher.stop()
+
+    async def _watcher_sender(self, watcher: _Watcher) -> None:
+        try:
+            while (item := await watcher.queue.get()) is not None:
+                recv, data = item
+                await asyncio.wait_for(
+                    self._write_output(watcher.websocket, watcher.binary, recv, data),
+                    settings.TERMINAL_WATCHER_SEND_TIMEOUT,
+                )
+        except Exception as e:
+            Log.warning(f"send terminal output to watcher error: {e}")
+        self.remove_watcher(watcher.websocket)
+        if watcher.websocket.client_state == WebSocketState.CONNECTED:
+            try:
+                await watcher.websocket.close()
+            except Exception as e:
+                Log.warning(f"close terminal watcher error: {e}")
+        await self._record_watch(watcher.username, SSHWatchAction.DETACH)
+
+    @classmethod
+    def get_watch_session(cls, watch_token: str) -> "TerminalService | None":
+        for session in cls.sessions.values():
+            if session.watch_token == watch_token and session._close_task is None:
+                return session
+        return None
+
+    async def can_watch(self, username: str) -> bool:
+        """
+        只有会话所属用户或拥有观看角色的用户可以观看会话
+        :param username: 当前用户名
+        :return:
+        """
+        if username == self.username:
+            return True
+        return await Role.filter(
+            code=settings.TERMINAL_WATCH_ROLE, status=Status.ENABLE, users__username=username
+        ).exists()
+
+    async def _record_watch(self, username: str, action: SSHWatchAction) -> None:
+        if not self.ssh_audit_record_obj:
+            return
+        await audit_writer.put(
+            SSHWatchRecord(
+                ssh_audit_id=self.ssh_audit_record_obj.id,
+                username=username,
+                owner=self.username,
+                ssh_host=self.host,
+                action=action,
+                create_time=datetime.now(),
+            )
+        )
+
+    async def add_watcher(self, websocket: WebSocket, username: str, binary: bool) -> None:
+        """
+        添加只读观看者，先补发缓冲区中的最近输出
+        :param websocket: 观看者的websocket对象
+        :param username: 观看者用户名
+        :param binary: 终端输出是否以二进制帧发送
+        :return:
+        """
+        await websocket.accept()
+        await websocket.send_json({"type": "watch", "data": {"host": self.host, "username": self.username}})
+        watcher = _Watcher(websocket, username, binary)
+        # 读取最近输出与加入观看者之间没有await，不会遗漏或重复输出
+        recent = self.scrollback.read_from(self.scrollback.start)
+        if recent:
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+            watcher.queue.put_nowait((recent, decoder.decode(recent, final=True)))
+        watcher.task = asyncio.create_task(self._watcher_sender(watcher))
+        self.watchers.append(watcher)
+        await self._record_watch(username, SSHWatchAction.ATTACH)
+
+    def remove_watcher(self, websocket: WebSocket) -> None:
+        """
+        移除观看者并停止其发送任务，发送任务退出时关闭websocket并记录结束观看
+        :param websocket: 观看者的websocket对象
+        :return:
+        """
+        watcher = next((watcher for watcher in self.watchers if watcher.websocket is websocket), None)
+        if watcher is None:
+            return
+        self.watchers.remove(watcher)
+        watcher.stop()
+
+    def _get_ssh_client(self, host_obj: Host, proxy_host_obj: Host) -> bytes | None:
         try:
             # 初始化ssh_client
             self.ssh_client = paramiko.SSHClient()
             # 当远程服务器没有本地主机的密钥时自动添加到本地，这样不用在建立连接的时候输入yes或no进行确认
             self.ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
             if proxy_host_obj:
-                # 通过代理主机连接远程主机，一般该代理主机为运维过程中的跳板机
-                proxy = paramiko.SSHClient()
-                proxy.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                proxy.connect(
-                    hostname=proxy_host_obj.external_ip,
-                    username=proxy_host_obj.login_user,
-                    port=proxy_host_obj.port,
-                    password=AESCipher.decrypt(proxy_host_obj.password),
-                    timeout=settings.SSH_CONNECT_TIMEOUT,
+                # 通过代理主机连接远程主机，一般该代理主机为运维过程中的跳板机，同一跳板机的连接由连接池复用
+                self.proxy_transport = jump_host_pool.acquire(
+                    proxy_host_obj.external_ip,
+                    proxy_host_obj.port,
+                    proxy_host_obj.login_user,
+                    AESCipher.decrypt(proxy_host_obj.password),
                 )
-                sock = proxy.get_transport().open_channel(
+                sock = self.proxy_transport.open_channel(
                     "direct-tcpip",
                     (host_obj.external_ip, host_obj.port),
                     (proxy_host_obj.external_ip, proxy_host_obj.port),
+                    timeout=settings.SSH_CONNECT_TIMEOUT,
                 )
                 # 代理连接SSH服务器
                 self.ssh_client.connect(
@@ -85,7 +308,7 @@ class TerminalService(object):
             # 打开ssh通道，建立长连接
             transport = self.ssh_client.get_transport()
             # 至关重要的代码，保持ssh连接不会主动断开（即websocket未断开时，ssh应该保持连接）
-            transport.set_keepalive(30)
+            transport.set_keepalive(settings.SSH_KEEPALIVE)
             # 打开sftp
             self.sftp_client = transport.open_sftp_client()
             # 获取ssh通道
@@ -95,18 +318,131 @@ class TerminalService(object):
             # 激活终端
             self.channel.invoke_shell()
             # 获取首次连接返回数据
-            recv = self.channel.recv(1024 * 10).decode("utf-8", "ignore")
+            recv = self.channel.recv(1024 * 10)
             return recv
         except Exception as e:
             Log.exception(e)
+            self._close_ssh_client()
             return None
 
+    def _close_ssh_client(self) -> None:
+        """
+        关闭目标主机连接，并归还跳板机连接
+        :return:
+        """
+        if self.sftp_client:
+            self.sftp_client.close()
+        if self.ssh_client:
+            self.ssh_client.close()
+        if self.proxy_transport:
+            jump_host_pool.release(self.proxy_transport)
+            self.proxy_transport = None
+
+    def _on_channel_readable(self) -> None:
+        """
+        通道可读时由事件循环回调，数据已在paramiko的缓冲区中，recv不会阻塞
+        :return:
+        """
+        try:
+            if self._output_queue.full():
+                # 转发跟不上时暂停读取，数据留在paramiko缓冲区中，缓冲区满后远端停止发送
+                self._pause_channel_reader()
+            elif self.channel.recv_ready():  # type: ignore
+                self._output_queue.put_nowait(self.channel.recv(32 * 1024))  # type: ignore
+            elif self.channel.closed or self.channel.eof_received or self.channel.exit_status_ready():  # type: ignore
+                # 通道关闭或收到EOF后不再监听，否则通道一直可读会导致回调空转
+                self._close_output_queue()
+        except Exception as e:
+            Log.exception(e)
+            self._close_output_queue()
+
+    def _close_output_queue(self) -> None:
+        """
+        停止监听通道并通知转发任务退出，队列满时等待转发任务消费后再放入结束标记，已读取的输出不丢弃
+        :return:
+        """
+        self._remove_channel_reader()
+        try:
+            self._output_queue.put_nowait(None)
+        except asyncio.QueueFull:
+            if self._eof_task is None:
+                self._eof_task = asyncio.create_task(self._output_queue.put(None))
+
+    def _pause_channel_reader(self) -> None:
+        if self._reader_fd is not None and self._reading:
+            asyncio.get_running_loop().remove_reader(self._reader_fd)
+            self._reading = False
+
+    def _resume_channel_reader(self) -> None:
+        if self._reader_fd is not None and not self._reading:
+            asyncio.get_running_loop().add_reader(self._reader_fd, self._on_channel_readable)
+            self._reading = True
+
+    def _remove_channel_reader(self) -> None:
+        self._pause_channel_reader()
+        self._reader_fd = None
+
+    def _start_channel_pump(self) -> None:
+        """
+        在当前事件循环中监听通道的可读事件，由转发任务将数据发送到前端，不需要为每个终端单独起线程
+        :return:
+        """
+        self._reader_fd = self.channel.fileno()  # type: ignore
+        self._resume_channel_reader()
+        self._pump_task = asyncio.create_task(self._channel_to_socket())
+
+    async def _stop_channel_pump(self) -> None:
+        self._remove_channel_reader()
+        if self._eof_task:
+            self._eof_task.cancel()
+            self._eof_task = None
+        if self._pump_task and self._pump_task is not asyncio.current_task():
+            self._pump_task.cancel()
+            try:
+                await self._pump_task
+            except asyncio.CancelledError:
+                pass
+        self._pump_task = None
+
+    async def _coalesce_output(self, recv: bytes) -> Tuple[bytes, bool]:
+        """
+        在时间窗口内合并通道输出，减少大量输出(如cat大文件、top)时发送的消息数
+        :param recv: 第一段输出
+        :return: 合并后的输出，通道是否已关闭
+        """
+        chunks = [recv]
+        size = len(recv)
+        closed = False
+        deadline = asyncio.get_running_loop().time() + settings.TERMINAL_COALESCE_WINDOW
+        while size < settings.TERMINAL_COALESCE_SIZE:
+            if self._output_queue.empty():
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    chunk = await asyncio.wait_for(self._output_queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                chunk = self._output_queue.get_nowait()
+            if chunk is None:
+                closed = True
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+        # 队列消费过半后恢复读取通道
+        if self._output_queue.qsize() <= self._output_queue.maxsize // 2:
+            self._resume_channel_reader()
+        return b"".join(chunks), closed
+
     async def _channel_to_socket(self) -> None:
         # 获取伪tty发送回的数据并发送到前端
-        while not self.channel.exit_status_ready():  # type: ignore
+        closed = False
+        while not closed and (recv := await self._output_queue.get()) is not None:
             try:
-                data = self.channel.recv(2048).decode("utf-8", "ignore")  # type: ignore
-                await self._send_message(data)
+                recv, closed = await self._coalesce_output(recv)
+                data = await self._send_output(recv)
+                self.check_prompt(data)
                 if self.tab_mode:
                     tmp = data.split(" ")
                     if len(tmp) == 2 and tmp[1] == "" and tmp[0] != "":
@@ -117,59 +453,185 @@ class TerminalService(object):
                 if self.history_mode:
                     self.index = 0
                     if data.strip() != "":
-                        self.cmd_tmp = re.sub(r"(?:\x1B[@-_]|[\x80-\x9F])[0-?]*[ -/]*[@-~]|\x08", "", data)
+                        self.cmd_tmp = ANSI_ESCAPE_RE.sub("", data)
                     self.history_mode = False
             except Exception as e:
                 Log.exception(e)
-                if self.ssh_client:
-                    self.ssh_client.close()
-                if self.sftp_client:
-                    self.sftp_client.close()
+                self._remove_channel_reader()
+                self._close_ssh_client()
                 if self.websocket:
                     await self.websocket.close()
                 break
+        if self.websocket is None:
+            # 断开期间SSH会话已结束，不再等待重新连接
+            await self.disconnect()
 
-    def _get_file(self, remote_path: str, local_path: str) -> None:
-        if self.sftp_client:
-            self.sftp_client.get(remote_path, local_path)
+    async def _send_progress(self, message_type: str, offset: int, size: int | None, last_time: float) -> float:
+        """
+        发送传输进度，按间隔限流，传输完成时一定发送
+        :param message_type: 进度消息类型
+        :param offset: 已传输的字节数
+        :param size: 文件总字节数
+        :param last_time: 上次发送进度的时间
+        :return: 本次发送进度的时间
+        """
+        now = asyncio.get_running_loop().time()
+        if offset == size or now - last_time >= settings.SFTP_PROGRESS_INTERVAL:
+            await self._send_message({"offset": offset, "size": size}, message_type=message_type)
+            return now
+        return last_time
 
-    def _put_file(self, local_path: str, remote_path: str) -> None:
-        if self.sftp_client:
-            self.sftp_client.put(local_path, remote_path)
+    async def _download_file(self, param: Dict) -> None:
+        """
+        按块流式下载文件，每块先发送 file_chunk 消息(偏移量、长度)再发送二进制帧，支持从指定偏移量续传
+        :param param: path: 远程文件路径，offset: 续传的起始偏移量
+        :return:
+        """
+        remote_path = param["path"]
+        offset = int(param.get("offset") or 0)
+        file_name = remote_path.split("/")[-1]
+        try:
+            size = (await run_async(self.sftp_client.stat, remote_path)).st_size  # type: ignore
+            remote_file = await run_async(self.sftp_client.open, remote_path, "rb")  # type: ignore
+            try:
+                remote_file.seek(offset)
+                await self._send_message(
+                    {"name": file_name, "size": size, "offset": offset}, message_type="download_start"
+                )
+                last_time = 0.0
+                while offset < size:
+                    chunk = await run_async(remote_file.read, settings.SFTP_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    # 块消息与二进制帧之间不能插入其他消息
+                    async with self._send_lock:
+                        await self._send_json({"offset": offset, "size": len(chunk)}, message_type="file_chunk")
+                        await self.websocket.send_bytes(chunk)
+                    offset += len(chunk)
+                    last_time = await self._send_progress("download_progress", offset, size, last_time)
+            finally:
+                await run_async(remote_file.close)
+            await self._send_message({"name": file_name, "size": offset}, message_type="download_end")
+        except Exception as e:
+            await self._send_message(f"下载文件失败，{str(e)}", message_type="error")
+
+    async def _download_whole_file(self, remote_path: str) -> None:
+        """
+        兼容只传文件路径的下载方式，先发送 file 消息(文件名)，再以一个二进制帧发送完整文件
+        :param remote_path: 远程文件路径
+        :return:
+        """
+        file_name = remote_path.split("/")[-1]
+        try:
+            remote_file = await run_async(self.sftp_client.open, remote_path, "rb")  # type: ignore
+            try:
+                # 预读取后续数据块，减少等待往返的时间
+                remote_file.prefetch()
+                data = await run_async(remote_file.read)
+            finally:
+                await run_async(remote_file.close)
+            async with self._send_lock:
+                await self._send_json(file_name, message_type="file")
+                await self.websocket.send_bytes(data)
+        except Exception as e:
+            await self._send_message(f"下载文件失败，{str(e)}", message_type="error")
 
-    async def _delete_file(self, local_path: str) -> None:
-        # 删除上传下载时临时生成在本地的文件
-        await async_os.remove(local_path)
+    async def _start_download(self, data: str | Dict) -> None:
+        if self._download_task and not self._download_task.done():
+            await self._send_message("下载文件失败，已有文件正在下载", message_type="error")
+            return
+        # 下载在后台进行，期间终端仍可正常输入输出
+        if isinstance(data, dict):
+            self._download_task = asyncio.create_task(self._download_file(data))
+        else:
+            self._download_task = asyncio.create_task(self._download_whole_file(data))
 
-    async def _upload_file(self, remote_path: str, file_bytes: bytes) -> None:
+    async def _start_upload(self, data: str | Dict) -> None:
+        """
+        开始上传文件，之后的二进制帧按顺序写入远程文件
+        兼容只传文件名的方式，此时下一个二进制帧即为完整文件
+        :param data: name: 文件名，size: 文件总字节数，resume: 是否从远程文件已有的长度续传
+        :return:
+        """
+        param = data if isinstance(data, dict) else {"name": data}
+        await self._close_upload()
+        self.upload_file_name = param["name"]
+        remote_path = f"{settings.SFTP_UPLOAD_DIR}/{self.upload_file_name}"
+        offset = 0
+        if param.get("resume"):
+            try:
+                offset = (await run_async(self.sftp_client.stat, remote_path)).st_size  # type: ignore
+            except IOError:
+                offset = 0
         try:
-            file_name_md5 = md5_encode_with_salt(remote_path)
-            local_path = f"/tmp/{file_name_md5}"
-            async with aiofiles.open(local_path, "wb") as f:
-                await f.write(file_bytes)
-            await run_async(self._put_file, local_path, remote_path)
-            await self._send_message(f"上传文件成功，文件保存在：{remote_path}", message_type="success")
-            # 删除上传时临时生成在本地的文件
-            await self._delete_file(local_path)
+            remote_file = await run_async(self.sftp_client.open, remote_path, "r+b" if offset else "wb")  # type: ignore
         except Exception as e:
+            # 打开远程文件失败(目录不存在、无权限等)只提示错误，终端会话不受影响
             await self._send_message(f"上传文件失败，{str(e)}", message_type="error")
+            return
+        remote_file.seek(offset)
+        # 不等待每次写入的响应，提高上传速度，写入错误在关闭文件时抛出
+        remote_file.set_pipelined(True)
+        self._upload_file_obj = remote_file
+        self._upload_offset = offset
+        self._upload_size = param.get("size")
+        await self._send_message({"name": self.upload_file_name, "offset": offset}, message_type="upload_ready")
 
-    async def _download_file(self, remote_path: str) -> None:
+    async def _upload_chunk(self, chunk: bytes) -> None:
+        remote_path = f"{settings.SFTP_UPLOAD_DIR}/{self.upload_file_name}"
         try:
-            file_name = remote_path.split("/")[-1]
-            file_suffix = file_name.split(".")[-1]
-            file_name_md5 = md5_encode_with_salt(remote_path)
-            file_path = f"{file_name_md5}.{file_suffix}" if file_suffix else file_name_md5
-            local_path = f"/tmp/{file_path}"
-            await run_async(self._get_file, remote_path, local_path)
-            await self._send_message(file_name, message_type="file")
-            async with aiofiles.open(local_path, "rb") as f:
-                data = await f.read()
-                await self.websocket.send_bytes(data)
-            # 删除下载时临时生成在本地的文件
-            await self._delete_file(local_path)
+            if self._upload_file_obj is None:
+                await self._start_upload(self.upload_file_name)
+                if self._upload_file_obj is None:
+                    # 远程文件打开失败，错误已提示，丢弃该数据块
+                    return
+            await run_async(self._upload_file_obj.write, chunk)  # type: ignore
+            self._upload_offset += len(chunk)
+            self._upload_progress_time = await self._send_progress(
+                "upload_progress", self._upload_offset, self._upload_size, self._upload_progress_time
+            )
+            if self._upload_size is None or self._upload_offset >= self._upload_size:
+                await self._close_upload()
+                await self._send_message(f"上传文件成功，文件保存在：{remote_path}", message_type="success")
+                await self._send_message(
+                    {"name": self.upload_file_name, "size": self._upload_offset}, message_type="upload_end"
+                )
         except Exception as e:
-            await self._send_message(f"下载文件失败，{str(e)}", message_type="error")
+            await self._close_upload()
+            await self._send_message(f"上传文件失败，{str(e)}", message_type="error")
+
+    async def _close_upload(self) -> None:
+        remote_file, self._upload_file_obj = self._upload_file_obj, None
+        self._upload_progress_time = 0.0
+        if remote_file:
+            await run_async(remote_file.close)
+
+    async def _start_recorder(self, host_obj: Host) -> str:
+        """
+        开始会话录像
+        :param host_obj: 主机对象
+        :return: 录像文件相对于录像目录的路径，未开启录像或启动失败时为空
+        """
+        if not settings.SSH_RECORD_ENABLED:
+            return ""
+        # 文件名不能使用恢复令牌，录像路径会保存在审计记录中，泄露令牌可以接管会话
+        record_file = f"{datetime.now():%Y%m%d}/{uuid4().hex}.cast.gz"
+        recorder = SessionRecorder(
+            f"{settings.SSH_RECORD_DIR}/{record_file}",
+            width=188,
+            height=49,
+            title=f"{self.username}@{host_obj.login_user}@{host_obj.external_ip}",
+            batch_size=settings.SSH_RECORD_BATCH_SIZE,
+            flush_interval=settings.SSH_RECORD_FLUSH_INTERVAL,
+            index_interval=settings.SSH_RECORD_INDEX_INTERVAL,
+        )
+        try:
+            await recorder.start()
+        except Exception as e:
+            Log.exception(e)
+            return ""
+        self.recorder = recorder
+        return record_file
 
     async def connect(self, host_id: int) -> None:
         # 根据前端传入的host_id，获取服务器用户名密码
@@ -183,10 +645,18 @@ class TerminalService(object):
             proxy_host_obj = await Host.filter(external_ip=proxy_ip).first()
         elif settings.SSH_UNIT_PROXY and settings.SSH_UNIT_PROXY_IP:
             proxy_host_obj = await Host.filter(external_ip=settings.SSH_UNIT_PROXY_IP).first()
+        self.host_id = host_obj.id
+        self.host = host_obj.external_ip
         recv = await run_async(self._get_ssh_client, host_obj, proxy_host_obj)
         if recv:
-            await self.websocket.accept()
-            await self._send_message(recv)
+            if self.websocket:
+                await self.websocket.accept()
+                self.sessions[self.token] = self
+                await self._send_message(
+                    {"token": self.token, "watch_token": self.watch_token, "offset": 0}, message_type="session"
+                )
+            record_file = await self._start_recorder(host_obj)
+            await self._send_output(recv)
             self.ssh_audit_record_obj = await SSHAuditRecord.create(
                 username=self.username,
                 ssh_host=host_obj.external_ip,
@@ -194,20 +664,114 @@ class TerminalService(object):
                 proxy_host=proxy_host_obj.external_ip if proxy_host_obj else "",
                 status=SSHStatus.ONLINE,
                 ssh_command="",
+                record_file=record_file,
             )
-            # 新起一个线程，避免堵塞
-            _thread = threading.Thread(target=asyncio.run, args=(self._channel_to_socket(),), daemon=True)
-            _thread.start()
+            await ModelVersion.bump(SSHAuditRecord)
+            # 通道数据由事件循环监听转发，避免堵塞
+            self._start_channel_pump()
         else:
             raise SSHOperatorException("SSH连接发生异常，websocket不接受连接")
 
+    @classmethod
+    def get_session(cls, token: str, username: str) -> "TerminalService | None":
+        """
+        根据恢复令牌获取会话，只能恢复自己的会话
+        :param token: 恢复令牌
+        :param username: 当前用户名
+        :return:
+        """
+        session = cls.sessions.get(token)
+        if session and session.username == username and session._close_task is None:
+            return session
+        return None
+
+    async def attach(self, websocket: WebSocket, offset: int | None, binary: bool) -> None:
+        """
+        重新连接到已有会话，补发断开期间的输出后继续转发
+        :param websocket: 新的websocket对象
+        :param offset: 前端已收到的输出的绝对偏移量，为空时从服务端记录的已发送位置补发
+        :param binary: 终端输出是否以二进制帧发送
+        :return:
+        """
+        if self._close_handle:
+            self._close_handle.cancel()
+            self._close_handle = None
+        old_websocket = self.websocket
+        await websocket.accept()
+        async with self._send_lock:
+            # 持有发送锁时切换连接并补发，补发的输出与之后的实时输出不会乱序
+            self.websocket = websocket
+            self.binary = binary
+            if old_websocket and old_websocket.client_state == WebSocketState.CONNECTED:
+                # 同一会话只保留最新的连接
+                await old_websocket.close()
+            start = max(self.sent_offset if offset is None else offset, self.scrollback.start)
+            await self._send_json(
+                {"token": self.token, "watch_token": self.watch_token, "offset": start}, message_type="session"
+            )
+            missed = self.scrollback.read_from(start)
+            if missed:
+                decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+                await self._write_output(websocket, binary, missed, decoder.decode(missed, final=True))
+            self.sent_offset = self.scrollback.end
+
+    def detach(self, websocket: WebSocket) -> None:
+        """
+        websocket断开时保留SSH会话，保留期内没有重新连接则关闭会话
+        :param websocket: 断开的websocket对象
+        :return:
+        """
+        if self.websocket is not websocket:
+            # 已被新的连接替换
+            return
+        self.websocket = None
+        if self._download_task:
+            self._download_task.cancel()
+        if self._pump_task is None or self._pump_task.done():
+            # SSH会话已结束或未建立
+            self._start_close()
+            return
+        self._close_handle = asyncio.get_running_loop().call_later(
+            settings.TERMINAL_DETACH_GRACE, self._start_close
+        )
+
+    def _start_close(self) -> None:
+        self._close_handle = None
+        if self._close_task is None:
+            self._close_task = asyncio.create_task(self.disconnect())
+
     async def disconnect(self) -> None:
-        self.handle_cmd()
+        self.sessions.pop(self.token, None)
+        for watcher in list(self.watchers):
+            self.remove_watcher(watcher.websocket)
+        if self.hub:
+            await self.hub.remove_member(self)
+        if self._close_handle:
+            self._close_handle.cancel()
+            self._close_handle = None
+        await self._stop_channel_pump()
+        if self._download_task:
+            self._download_task.cancel()
+        try:
+            await self._close_upload()
+        except Exception as e:
+            Log.exception(e)
+        if self.recorder:
+            try:
+                await self.recorder.close()
+            except Exception as e:
+                Log.exception(e)
+            self.recorder = None
         if self.ssh_audit_record_obj:
             self.ssh_audit_record_obj.ssh_command = ",".join(self.cmd)
             self.ssh_audit_record_obj.status = SSHStatus.OFFLINE
             await self.ssh_audit_record_obj.save()
-        self.ssh_client.close()  # type: ignore
+            await ModelVersion.bump(SSHAuditRecord)
+        self._close_ssh_client()
+
+    def _record(self, event_type: str, data: str) -> None:
+        if self.recorder:
+            self.recorder.record(event_type, data)
 
     async def receive(self, text_data: str, bytes_data: bytes) -> None:
         try:
@@ -219,38 +783,42 @@ class TerminalService(object):
                     if content_type == "resize":
                         if self.channel:
                             self.channel.resize_pty(width=data.get("cols"), height=data.get("rows"))  # type: ignore
+                        self._record("r", f"{data.get('cols')}x{data.get('rows')}")
                     elif content_type == "content":
-                        self.gen_cmd(data)
+                        if command := self.gen_cmd(data):
+                            await self._emit_command(command)
                         self.channel.send(data)  # type: ignore
+                        self._record("i", data)
                     elif content_type == "heartbeat":
                         await self._send_message("pong", message_type="heartbeat")
                     elif content_type == "download":
-                        await self._download_file(data)
+                        await self._start_download(data)
                     elif content_type == "upload":
-                        self.upload_file_name = data
+                        await self._start_upload(data)
                 else:
                     self.channel.send(text_data)  # type: ignore
+                    self._record("i", text_data)
             if bytes_data:
-                remote_path = f"{settings.SFTP_UPLOAD_DIR}/{self.upload_file_name}"
-                await self._upload_file(remote_path, bytes_data)
+                await self._upload_chunk(bytes_data)
         except SSHException as e:
             Log.exception(e)
         except JSONDecodeError:
             self.channel.send(text_data)  # type: ignore
+            self._record("i", text_data)
         except Exception as e:
             Log.exception(e)
 
-    def gen_cmd(self, text_data: str) -> None:
+    def gen_cmd(self, text_data: str) -> str | None:
         """
         获取命令脚本源自：https://github.com/pythonzm/Ops
         :param text_data:
-        :return:
+        :return: 按下回车时返回输入完成的命令
         """
         if text_data == "\r":
             self.index = 0
             if self.cmd_tmp.strip() != "":
-                self.cmd.append(self.cmd_tmp)
-                self.cmd_tmp = ""
+                command, self.cmd_tmp = self.cmd_tmp, ""
+                return command
         elif text_data.encode() == b"\x07":
             pass
         elif text_data.encode() in (b"\x03", b"\x01"):  # ctrl+c 和 ctrl+a
@@ -280,21 +848,154 @@ class TerminalService(object):
                 else:
                     self.cmd_tmp = self.cmd_tmp[: self.index] + text_data + self.cmd_tmp[self.index :]
 
-    def handle_cmd(self) -> None:  # 将vim或vi编辑文档时的操作去掉
-        vi_index = None
-        fg_index = None  # 捕捉使用ctrl+z将vim放到后台的操作
-        q_index = None
-        q_keys = (":wq", ":q", ":q!")
-        for index, value in enumerate(self.cmd):
-            if "vi" in value:
-                vi_index = index
-            if any([key in value for key in q_keys]):
-                q_index = index
-            if "\x1a" in value:  # \x1a代表ctrl+z
-                self.cmd[index] = value.split("\x1a")[1]
-            if "fg" in value:
-                fg_index = index
-
-        first_index = fg_index if fg_index else vi_index
-        if vi_index:
-            self.cmd = self.cmd[: first_index + 1] + self.cmd[q_index + 1 :]  # type: ignore
+    def handle_cmd(self, command: str) -> Tuple[str, bool]:
+        """
+        标记vim或vi编辑文档时的输入，从进入编辑器到退出编辑器(或重新出现shell提示符)之间的输入为编辑器中的输入
+        :param command: 输入完成的命令
+        :return: 命令，是否为编辑器中的输入
+        """
+        if "\x1a" in command:  # \x1a代表ctrl+z，将vim放到后台
+            self._in_editor = False
+            shell_command = command.split("\x1a")[-1]
+            if shell_command.strip() == "":
+                return command, True
+            command = shell_command
+        if self._in_editor:
+            if any(key in command for key in (":wq", ":q", ":q!")):
+                self._in_editor = False
+            return command, True
+        if EDITOR_CMD_RE.match(command):  # 打开编辑器或使用fg将vim切回前台
+            self._in_editor = True
+        return command, False
+
+    def check_prompt(self, data: str) -> None:
+        """
+        输出的最后一行为shell提示符时已回到shell，结束编辑器状态
+        避免编辑器没有启动(如 vim --version、没有后台任务时的fg)或没有通过 :q 退出时，之后的命令都被标记为编辑器中的输入
+        :param data: 终端输出
+        :return:
+        """
+        if self._in_editor and SHELL_PROMPT_RE.search(ANSI_ESCAPE_RE.sub("", data).rsplit("\n", 1)[-1]):
+            self._in_editor = False
+
+    async def _emit_command(self, command: str) -> None:
+        """
+        命令输入完成后放入审计写入器，由后台任务批量写入SSH命令审计表
+        :param command: 输入完成的命令
+        :return:
+        """
+        command, in_editor = self.handle_cmd(command)
+        # 编辑器中的输入不计入命令摘要，但仍逐条记录，审计不遗漏
+        if not in_editor:
+            self.cmd.append(command)
+        if not self.ssh_audit_record_obj:
+            return
+        await audit_writer.put(
+            SSHCommandRecord(
+                ssh_audit_id=self.ssh_audit_record_obj.id,
+                username=self.ssh_audit_record_obj.username,
+                ssh_host=self.ssh_audit_record_obj.ssh_host,
+                ssh_user=self.ssh_audit_record_obj.ssh_user,
+                command=command[:500],
+                in_editor=in_editor,
+                create_time=datetime.now(),
+            )
+        )
+
+
+class BroadcastService(object):
+    """
+    广播终端：一个websocket的输入同时发送到多台主机的SSH通道，各主机的输出标记主机后合并返回
+    """
+
+    # 广播模式下不支持的消息类型
+    ignore_types: Tuple[str, ...] = ("download", "upload")
+
+    def __init__(self, websocket: WebSocket, username: str, binary: bool = False) -> None:
+        self.websocket: WebSocket = websocket
+        self.username: str = username
+        self.binary: bool = binary
+        self.members: Dict[int, TerminalService] = {}
+        self._send_lock: asyncio.Lock = asyncio.Lock()
+
+    async def _send_message(self, message: Any, *, message_type: str, host_id: int | None = None) -> None:
+        async with self._send_lock:
+            if self.websocket.client_state == WebSocketState.CONNECTED:
+                await self.websocket.send_json({"type": message_type, "host_id": host_id, "data": message})
+
+    async def _connect_member(self, host_id: int) -> None:
+        member = TerminalService(None, self.username, binary=self.binary)  # type: ignore
+        member.hub = self
+        try:
+            await member.connect(host_id)
+            self.members[host_id] = member
+        except Exception as e:
+            Log.exception(e)
+            await self._send_message(f"连接主机失败，{str(e)}", message_type="error", host_id=host_id)
+
+    async def connect(self, host_ids: List[int]) -> None:
+        """
+        并发连接所有主机，部分主机连接失败不影响其他主机
+        :param host_ids: 主机ID列表
+        :return:
+        """
+        await self.websocket.accept()
+        await asyncio.gather(*[self._connect_member(host_id) for host_id in dict.fromkeys(host_ids)])
+        hosts = [{"host_id": host_id, "host": member.host} for host_id, member in self.members.items()]
+        await self._send_message({"hosts": hosts}, message_type="broadcast")
+
+    async def forward_output(self, member: TerminalService, recv: bytes, data: str) -> None:
+        """
+        转发成员主机的输出，标记来源主机
+        二进制模式下先发送 output 消息(主机ID)，紧接着发送该主机输出的二进制帧
+        :param member: 成员会话
+        :param recv: 通道输出
+        :param data: 解码后的文本
+        :return:
+        """
+        async with self._send_lock:
+            if self.websocket.client_state != WebSocketState.CONNECTED:
+                return
+            try:
+                if self.binary:
+                    await self.websocket.send_json({"type": "output", "host_id": member.host_id, "data": member.host})
+                    await self.websocket.send_bytes(recv)
+                elif data:
+                    await self.websocket.send_json(
+                        {"type": "content", "host_id": member.host_id, "host": member.host, "data": data}
+                    )
+            except Exception as e:
+                Log.warning(f"send broadcast output error: {e}")
+
+    async def remove_member(self, member: TerminalService) -> None:
+        if self.members.pop(member.host_id, None) is not None:  # type: ignore
+            await self._send_message("会话已结束", message_type="closed", host_id=member.host_id)
+
+    async def receive(self, text_data: str, bytes_data: bytes) -> None:
+        """
+        输入发送到所有成员主机，消息中带 host_ids 时只发送到指定主机
+        :param text_data: 文本消息
+        :param bytes_data: 二进制消息，广播模式下忽略
+        :return:
+        """
+        if not text_data:
+            return
+        host_ids = None
+        try:
+            result = orjson.loads(text_data)
+            content_type = result.get("type") if isinstance(result, dict) else None
+            if content_type == "heartbeat":
+                await self._send_message("pong", message_type="heartbeat")
+                return
+            if content_type in self.ignore_types:
+                return
+            if isinstance(result, dict):
+                host_ids = result.get("host_ids")
+        except JSONDecodeError:
+            pass
+        members = [member for host_id, member in self.members.items() if host_ids is None or host_id in host_ids]
+        for member in members:
+            await member.receive(text_data, b"")
+
+    async def disconnect(self) -> None:
+        await asyncio.gather(*[member.disconnect() for member in list(self.members.values())])
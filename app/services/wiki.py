@@ -1,64 +1,153 @@
-from typing import List, Type
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Tuple
 
 import aiofiles  # type: ignore
 from anyio import Path
-from app.models.wiki import WikiCategory
-from app.schemas.model_creator import WikiCategoryModel
-from app.schemas.wiki import WikiCategoryPageQuerySchema
+from app.models.wiki import WikiCategory, WikiPage
+from app.schemas.model_creator import WikiCategoryModel, WikiPageModel
+from app.schemas.wiki import WikiCategoryNodeQuerySchema, WikiCategoryPageQuerySchema
 from app.services.children import ChildService
+from common.cache import LRUCache, TreeCache
+from config.setting import settings
 from fastapi import UploadFile
 from tortoise import Model
-from tortoise.contrib.pydantic import PydanticModel
 from utils.crypt import md5_encode_with_salt
 
 
 class WikiCategoryService(object):
+    @staticmethod
+    def _page_data(page: Dict, lazy: bool) -> Dict:
+        """
+        页面在树中的节点数据
+        :param page: 页面数据
+        :param lazy: 懒加载模式只返回元数据
+        :return:
+        """
+        data = {
+            "key": f"page-{page['id']}",
+            "id": f"page-{page['id']}",
+            # Ant-Design-Vue3 Tree组件会校验KEY，KEY如果重复会导致展示异常，故key加前缀来避免
+            "title": page["name"],
+            "name": page["name"],
+            "is_page": True,
+            "page_id": page["id"],
+            "remark": page["remark"],
+            "parent_id": page["wiki_category_id"],
+        }
+        if not lazy:
+            data["content"] = page["content"]
+            data["secret"] = page["secret"]
+        return data
+
+    @classmethod
+    async def _get_pages_map(cls, category_ids: List[int], lazy: bool) -> Dict[int, List[Dict]]:
+        """
+        一次查询出所有目录下的页面
+        :param category_ids: 目录id
+        :param lazy: 懒加载模式不查询页面内容
+        :return:
+        """
+        page_fields = ["id", "name", "remark", "wiki_category_id"]
+        if not lazy:
+            page_fields.extend(["content", "secret"])
+        pages_map: Dict[int, List[Dict]] = defaultdict(list)
+        for page in await WikiPage.filter(wiki_category_id__in=category_ids).values(*page_fields):
+            pages_map[page["wiki_category_id"]].append(cls._page_data(page, lazy))
+        return pages_map
+
     @staticmethod
     async def get_children_data_with_page(param: WikiCategoryPageQuerySchema) -> List:
-        async def _get_children_data(obj: Model, model_pydantic: Type[PydanticModel]) -> dict:
-            childrens = await obj.children.filter(zone_id=param.zone_id)  # type: ignore
-            ret = await model_pydantic.from_tortoise_orm(obj)
-            result = ret.dict()
-            children_list = []
-            for children in childrens:
-                ret = await _get_children_data(children, model_pydantic)
-                children_list.append(ret)
-            wiki_page_obj_qs = await obj.pages.all()  # type: ignore
-            pages_data = []
-            for page_obj in wiki_page_obj_qs:
-                item = {
-                    "key": f"page-{page_obj.id}",
-                    "id": f"page-{page_obj.id}",
-                    # Ant-Design-Vue3 Tree组件会校验KEY，KEY如果重复会导致展示异常，故key加前缀来避免
-                    "title": page_obj.name,
-                    "name": page_obj.name,
-                    "is_page": True,
-                    "page_id": page_obj.id,
-                    "remark": page_obj.remark,
-                    "content": page_obj.content,
-                    "secret": page_obj.secret,
-                    "parent_id": page_obj.wiki_category_id,
-                }
-                pages_data.append(item)
-            if pages_data:
-                if children_list:
-                    for i in pages_data:
-                        children_list.append(i)
-                else:
-                    children_list = pages_data
-            result["children"] = children_list
-            return result
+        return await wiki_category_page_tree_cache.get(zone_id=str(param.zone_id), lazy=param.lazy)
 
+    @classmethod
+    async def build_children_data_with_page(cls, zone_id: str, lazy: bool) -> List:
         root_obj = await WikiCategory.get_or_create(name="根")
-        wiki_category_obj_qs = await WikiCategory.filter(zone_id=param.zone_id)
-        wiki_category_obj_qs.append(root_obj[0])
+        wiki_category_obj_qs = await WikiCategory.filter(zone_id=zone_id)
+        if root_obj[0].id not in [obj.id for obj in wiki_category_obj_qs]:
+            wiki_category_obj_qs.append(root_obj[0])
+
+        pages_map = await cls._get_pages_map([obj.id for obj in wiki_category_obj_qs], lazy)
+
+        async def _handle_pages(obj: Model, result: Dict) -> None:
+            # 页面排在子目录之后
+            result["children"].extend(pages_map.get(obj.id, []))  # type: ignore
+
         data = await ChildService.get_children_data(
-            wiki_category_obj_qs, WikiCategoryModel, children_handler=_get_children_data
+            wiki_category_obj_qs, WikiCategoryModel, children_handler=_handle_pages
+        )
+        return data
+
+    @staticmethod
+    async def get_node_children(param: WikiCategoryNodeQuerySchema) -> List:
+        parent_id = str(param.parent_id) if param.parent_id is not None else None
+        return await wiki_category_node_cache.get(zone_id=str(param.zone_id), parent_id=parent_id)
+
+    @classmethod
+    async def build_node_children(cls, zone_id: str, parent_id: str | None) -> List:
+        """
+        获取单个目录下一层的子目录和页面元数据，用于目录树逐级展开
+        :param zone_id: 空间id
+        :param parent_id: 父目录id，为空时获取顶层目录
+        :return:
+        """
+        if parent_id is None:
+            root_obj = await WikiCategory.get_or_create(name="根")
+            category_obj_qs = await WikiCategory.filter(zone_id=zone_id, parent_id=None)
+            if root_obj[0].id not in [obj.id for obj in category_obj_qs]:
+                category_obj_qs.append(root_obj[0])
+        else:
+            category_obj_qs = await WikiCategory.filter(zone_id=zone_id, parent_id=parent_id)
+
+        category_ids = [obj.id for obj in category_obj_qs]
+        # 没有子目录和页面的目录为叶子节点，前端不展示展开按钮
+        non_leaf_ids = set(
+            await WikiCategory.filter(parent_id__in=category_ids).distinct().values_list("parent_id", flat=True)
         )
+        non_leaf_ids.update(
+            await WikiPage.filter(wiki_category_id__in=category_ids)
+            .distinct()
+            .values_list("wiki_category_id", flat=True)
+        )
+        data = []
+        for obj in category_obj_qs:
+            result = ChildService._serialize(obj, WikiCategoryModel)
+            result["is_leaf"] = obj.id not in non_leaf_ids
+            data.append(result)
+        if parent_id is not None:
+            pages_map = await cls._get_pages_map([int(parent_id)], lazy=True)
+            data.extend(pages_map.get(int(parent_id), []))
         return data
 
 
+wiki_category_page_tree_cache = TreeCache(
+    "wiki_category_page", WikiCategoryService.build_children_data_with_page, [WikiCategory, WikiPage]
+)
+wiki_category_node_cache = TreeCache(
+    "wiki_category_node", WikiCategoryService.build_node_children, [WikiCategory, WikiPage]
+)
+
+# 页面内容缓存，键为(页面id, 更新时间)，页面修改后旧内容不会再被命中，由LRU淘汰
+page_content_cache: LRUCache[Tuple[int, datetime], str] = LRUCache(settings.WIKI_PAGE_CONTENT_CACHE_SIZE)
+
+
 class WikiPageService(object):
+    @staticmethod
+    async def get_page_detail(item_id: str) -> Dict:
+        """
+        获取页面详情，页面内容按(页面id, 更新时间)缓存，未修改的页面不需要再读取内容
+        :param item_id: 页面id
+        :return:
+        """
+        meta_fields = [field for field in WikiPageModel.__fields__ if field != "content"]
+        data = await WikiPage.get(id=item_id).values(*meta_fields)
+        key = (data["id"], data["update_time"])
+        if (content := page_content_cache.get(key)) is None:
+            content = await WikiPage.filter(id=item_id).first().values_list("content", flat=True)
+            page_content_cache.set(key, content)
+        data["content"] = content
+        return data
+
     @staticmethod
     async def upload_file(file: UploadFile) -> str:
         base_dir = Path(__file__).parent.parent.parent
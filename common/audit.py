@@ -0,0 +1,170 @@
+import asyncio
+from collections import defaultdict
+from typing import Dict, List, Tuple, Type
+
+from app.models.enums import AuditDropPolicy
+from common.cache import ModelVersion
+from common.log import Log
+from config.setting import settings
+from tortoise.models import Model
+
+
+class AuditWriter(object):
+    """
+    审计记录异步批量写入器
+    请求只负责把记录放入有界队列，由后台任务按批次大小或时间间隔使用bulk_create批量写库
+    """
+
+    def __init__(
+        self,
+        *,
+        max_size: int,
+        batch_size: int,
+        flush_interval: float,
+        drop_policy: str,
+        block_timeout: float,
+    ) -> None:
+        self._max_size = max_size
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._drop_policy = AuditDropPolicy(drop_policy)
+        self._block_timeout = block_timeout
+        self._queue: asyncio.Queue[Model | None] | None = None
+        self._task: asyncio.Task | None = None
+        self._closing: bool = False
+        # 统计计数
+        self.queued: int = 0
+        self.flushed: int = 0
+        self.dropped: int = 0
+
+    def start(self) -> None:
+        """
+        启动后台刷盘任务，需要在事件循环中调用
+        :return:
+        """
+        if self._task is None:
+            self._closing = False
+            self._queue = asyncio.Queue(maxsize=self._max_size)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        停止后台刷盘任务，停止前会将队列中剩余的记录全部写库
+        :return:
+        """
+        if self._task is None or self._queue is None:
+            return
+        self._closing = True
+        # 放入哨兵，后台任务消费到哨兵时刷完当前批次后退出
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def put(self, record: Model) -> None:
+        """
+        审计记录入队，队列已满时按配置的策略处理
+        :param record: 未保存的审计记录对象
+        :return:
+        """
+        if self._task is None or self._queue is None or self._closing:
+            # 写入器未启动或正在关闭时直接写库，避免记录丢失
+            await record.save()
+            try:
+                await ModelVersion.bump(type(record))
+            except Exception as e:
+                Log.warning(f"bump {type(record).__name__} version error: {e}")
+            return
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            match self._drop_policy:
+                case AuditDropPolicy.BLOCK:
+                    try:
+                        await asyncio.wait_for(self._queue.put(record), timeout=self._block_timeout)
+                    except asyncio.TimeoutError:
+                        self.dropped += 1
+                        return
+                case AuditDropPolicy.DROP_OLDEST:
+                    self._queue.get_nowait()
+                    self._queue.put_nowait(record)
+                    self.dropped += 1
+                case _:
+                    self.dropped += 1
+                    return
+        self.queued += 1
+
+    def stats(self) -> Dict[str, int]:
+        """
+        获取写入器统计信息
+        :return:
+        """
+        return {
+            "queued": self.queued,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "pending": self._queue.qsize() if self._queue else 0,
+        }
+
+    async def _run(self) -> None:
+        while True:
+            batch, stopped = await self._next_batch()
+            if batch:
+                await self._flush(batch)
+            if stopped:
+                break
+
+    async def _next_batch(self) -> Tuple[List[Model], bool]:
+        """
+        等待第一条记录到达后，在刷盘间隔内尽量凑满一个批次
+        :return: 批次记录，是否收到停止哨兵
+        """
+        queue: asyncio.Queue[Model | None] = self._queue  # type: ignore
+        loop = asyncio.get_running_loop()
+        batch: List[Model] = []
+        record = await queue.get()
+        deadline = loop.time() + self._flush_interval
+        while record is not None:
+            batch.append(record)
+            if len(batch) >= self._batch_size:
+                break
+            if not queue.empty():
+                record = queue.get_nowait()
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                record = await asyncio.wait_for(queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                break
+        return batch, record is None
+
+    async def _flush(self, batch: List[Model]) -> None:
+        groups: Dict[Type[Model], List[Model]] = defaultdict(list)
+        for record in batch:
+            groups[type(record)].append(record)
+        for model, records in groups.items():
+            try:
+                await model.bulk_create(records)
+            except Exception as e:
+                self.dropped += len(records)
+                Log.exception(f"flush {len(records)} {model.__name__} records error: {e}")
+                continue
+            self.flushed += len(records)
+            try:
+                # 审计列表接口有响应缓存，写入后需要更新数据版本号
+                await ModelVersion.bump(model)
+            except Exception as e:
+                Log.warning(f"bump {model.__name__} version error: {e}")
+
+
+# 创建审计写入器对象
+audit_writer = AuditWriter(
+    max_size=settings.AUDIT_QUEUE_MAX_SIZE,
+    batch_size=settings.AUDIT_BATCH_SIZE,
+    flush_interval=settings.AUDIT_FLUSH_INTERVAL,
+    drop_policy=settings.AUDIT_DROP_POLICY,
+    block_timeout=settings.AUDIT_BLOCK_TIMEOUT,
+)
+
+__all__ = ["audit_writer"]
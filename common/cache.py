@@ -0,0 +1,343 @@
+import asyncio
+import hashlib
+import inspect
+from collections import OrderedDict
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict, Generic, List, Tuple, Type, TypeVar
+from uuid import uuid4
+
+import orjson
+from common.log import Log
+from common.redis import redis_client
+from config.setting import settings
+from fastapi import Request, Response, status
+from tortoise.models import Model
+from tortoise.signals import post_delete, post_save
+
+KT = TypeVar("KT")
+VT = TypeVar("VT")
+
+# 当前请求是否返回了旧版本的缓存数据(如后台重建期间的树结构)，为True时响应不能按新版本号缓存
+stale_response: ContextVar[bool] = ContextVar("stale_response", default=False)
+
+
+class ModelVersion(object):
+    """
+    模型数据版本号，存放在redis中，模型数据有写操作时版本号加一
+    缓存键中带上版本号，写操作后旧版本的缓存自然失效，不需要逐个删除
+    """
+
+    key_prefix: str = "model_version"
+
+    @classmethod
+    def _get_key(cls, model: Type[Model]) -> str:
+        return f"{cls.key_prefix}:{model._meta.db_table}"
+
+    @classmethod
+    async def get(cls, model: Type[Model]) -> int:
+        """
+        获取模型当前数据版本号
+        :param model: 模型类
+        :return:
+        """
+        version = await redis_client.get(cls._get_key(model))
+        return int(version) if version else 0
+
+    @classmethod
+    async def get_many(cls, models: List[Type[Model]]) -> List[int]:
+        """
+        一次获取多个模型的数据版本号
+        :param models: 模型类列表
+        :return:
+        """
+        versions = await redis_client.mget([cls._get_key(model) for model in models])
+        return [int(version) if version else 0 for version in versions]
+
+    @classmethod
+    async def bump(cls, model: Type[Model]) -> int:
+        """
+        模型数据版本号加一
+        :param model: 模型类
+        :return: 新的版本号
+        """
+        version = await redis_client.incr(cls._get_key(model))
+        await TreeCache.invalidate(model)
+        return version
+
+    @staticmethod
+    def related_models(model: Type[Model]) -> List[Type[Model]]:
+        """
+        获取模型及其关联模型，序列化结果中包含关联数据，关联模型变化时缓存也需要失效
+        :param model: 模型类
+        :return:
+        """
+        models = [model]
+        for field_name in model._meta.fetch_fields:
+            related_model = model._meta.fields_map[field_name].related_model  # type: ignore
+            if related_model not in models:
+                models.append(related_model)
+        return models
+
+
+class LRUCache(Generic[KT, VT]):
+    """
+    进程内LRU缓存，超出最大条数时淘汰最久未使用的数据
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self._max_size = max_size
+        self._data: OrderedDict[KT, VT] = OrderedDict()
+
+    def get(self, key: KT) -> VT | None:
+        if key not in self._data:
+            return None
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def set(self, key: KT, value: VT) -> None:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self._max_size:
+            self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# 响应报文缓存，键为ETag
+response_cache: LRUCache[str, bytes] = LRUCache(settings.RESPONSE_CACHE_MAX_SIZE)
+
+
+def _match_etag(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in tags or "*" in tags
+
+
+def cache_response(*models: Type[Model]) -> Callable:
+    """
+    GET接口响应缓存装饰器，以请求路径、查询参数和依赖模型的数据版本号生成强ETag
+    请求头 If-None-Match 与ETag一致时直接返回304，否则优先返回进程内缓存的响应报文，都不需要查询数据库
+    :param models: 接口数据依赖的模型，任意一个模型数据版本号变化时缓存失效
+    :return:
+    """
+
+    def decorator(func: Callable) -> Callable:
+        signature = inspect.signature(func)
+        parameters = list(signature.parameters.values())
+        has_request = "request" in signature.parameters
+        if not has_request:
+            parameters.append(inspect.Parameter("request", inspect.Parameter.KEYWORD_ONLY, annotation=Request))
+
+        @wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Response:
+            request: Request = kwargs["request"] if has_request else kwargs.pop("request")
+            try:
+                versions = await ModelVersion.get_many(list(models))
+            except Exception as e:
+                Log.warning(f"get model version error, skip response cache: {e}")
+                return await func(*args, **kwargs)
+
+            query = sorted(request.query_params.multi_items())
+            cache_key = f"{request.url.path}?{query}|{versions}"
+            etag = f'"{hashlib.sha1(cache_key.encode()).hexdigest()}"'
+            # 浏览器每次都需要携带ETag重新校验
+            headers = {"ETag": etag, "Cache-Control": "no-cache"}
+            if _match_etag(request.headers.get("if-none-match"), etag):
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+            if (body := response_cache.get(etag)) is not None:
+                return Response(content=body, media_type="application/json", headers=headers)
+
+            token = stale_response.set(False)
+            try:
+                response = await func(*args, **kwargs)
+                # 响应数据是旧版本时，不能以新版本号的ETag缓存，否则直到下次写操作前都会返回旧数据
+                is_stale = stale_response.get()
+            finally:
+                stale_response.reset(token)
+            if response.status_code == status.HTTP_200_OK and not is_stale:
+                if len(response.body) <= settings.RESPONSE_CACHE_MAX_BODY_SIZE:
+                    response_cache.set(etag, response.body)
+                response.headers.update(headers)
+            return response
+
+        wrapper.__signature__ = signature.replace(parameters=parameters)  # type: ignore
+        return wrapper
+
+    return decorator
+
+
+class TreeCache(object):
+    """
+    进程内树结构缓存，按(模型, 范围参数, 版本号)缓存组装好的树
+    依赖的模型有写操作时本地版本号加一，并通过redis发布订阅通知其他worker，旧版本的树在后台重建期间继续返回
+    """
+
+    channel: str = "tree_cache_invalidate"
+    # 当前worker标识，忽略自己发布的失效消息
+    worker_id: str = uuid4().hex
+    caches: List["TreeCache"] = []
+    _signal_models: List[Type[Model]] = []
+    _listener: asyncio.Task | None = None
+
+    def __init__(
+        self,
+        name: str,
+        builder: Callable[..., Awaitable[List]],
+        models: List[Type[Model]],
+        warm_up: bool = False,
+    ) -> None:
+        """
+        :param name: 缓存名称
+        :param builder: 组装树结构的协程函数，参数为范围参数(如 zone_id)
+        :param models: 树数据依赖的模型
+        :param warm_up: 启动时是否预先组装不带范围参数的树
+        """
+        self.name = name
+        self._builder = builder
+        self._tables = {model._meta.db_table for model in models}
+        self._warm_up = warm_up
+        self._version: int = 0
+        # 范围参数 -> (组装时的版本号, 树数据)
+        self._data: LRUCache[Tuple, Tuple[int, List]] = LRUCache(settings.TREE_CACHE_MAX_SCOPES)
+        self._building: Dict[Tuple, asyncio.Task] = {}
+        # 直接调用 save/delete 的写操作通过信号失效，queryset 批量更新由 ModelVersion.bump 失效
+        for model in models:
+            if model not in self._signal_models:
+                post_save(model)(self._on_signal)
+                post_delete(model)(self._on_signal)
+                self._signal_models.append(model)
+        self.caches.append(self)
+
+    @classmethod
+    async def _on_signal(cls, sender: Type[Model], *args: Any) -> None:
+        # 直接调用 save/delete 的写操作(如 get_or_create)不会经过接口更新版本号，这里同时使响应缓存失效
+        try:
+            await ModelVersion.bump(sender)
+        except Exception as e:
+            Log.warning(f"bump {sender.__name__} version error: {e}")
+            await cls.invalidate(sender)
+
+    async def _build(self, scope: Tuple, version: int) -> List:
+        try:
+            data = await self._builder(**dict(scope))
+            self._data.set(scope, (version, data))
+            return data
+        finally:
+            self._building.pop(scope, None)
+
+    def _start_build(self, scope: Tuple) -> asyncio.Task:
+        """
+        同一范围同时只有一个组装任务
+        :param scope: 范围参数
+        :return:
+        """
+        if (task := self._building.get(scope)) is None:
+            task = asyncio.create_task(self._build(scope, self._version))
+            task.add_done_callback(self._log_build_error)
+            self._building[scope] = task
+        return task
+
+    def _log_build_error(self, task: asyncio.Task) -> None:
+        if not task.cancelled() and (e := task.exception()):
+            Log.warning(f"build tree cache {self.name} error: {e}")
+
+    async def get(self, **scope: Any) -> List:
+        """
+        获取树结构，缓存已过期时在后台重建并先返回旧数据，只有没有缓存时才等待组装完成
+        :param scope: 范围参数
+        :return:
+        """
+        key = tuple(sorted(scope.items()))
+        entry = self._data.get(key)
+        if entry is not None:
+            version, data = entry
+            if version != self._version:
+                self._start_build(key)
+                stale_response.set(True)
+            return data
+        # 请求被取消时不影响组装任务，组装结果供后续请求使用
+        return await asyncio.shield(self._start_build(key))
+
+    def _expire(self) -> None:
+        self._version += 1
+
+    @classmethod
+    def _expire_tables(cls, tables: List[str]) -> None:
+        for cache in cls.caches:
+            if cache._tables.intersection(tables):
+                cache._expire()
+
+    @classmethod
+    async def invalidate(cls, model: Type[Model]) -> None:
+        """
+        模型数据变化时使依赖该模型的树缓存失效，并通知其他worker
+        :param model: 模型类
+        :return:
+        """
+        table = model._meta.db_table
+        if not any(table in cache._tables for cache in cls.caches):
+            return
+        cls._expire_tables([table])
+        try:
+            await redis_client.publish(cls.channel, orjson.dumps({"worker_id": cls.worker_id, "tables": [table]}))
+        except Exception as e:
+            Log.warning(f"publish tree cache invalidate message error: {e}")
+
+    @classmethod
+    def warm_up(cls) -> None:
+        """
+        启动时在后台预先组装树结构，请求不需要等待冷启动
+        :return:
+        """
+        for cache in cls.caches:
+            if cache._warm_up:
+                cache._start_build(())
+
+    @classmethod
+    async def _listen(cls) -> None:
+        while True:
+            pubsub = redis_client.pubsub()
+            try:
+                await pubsub.subscribe(cls.channel)
+                # 订阅中断期间可能错过失效消息，重新订阅后全部失效
+                cls._expire_tables([table for cache in cls.caches for table in cache._tables])
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    payload = orjson.loads(message["data"])
+                    if payload["worker_id"] != cls.worker_id:
+                        cls._expire_tables(payload["tables"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                Log.warning(f"subscribe tree cache channel error: {e}")
+                await asyncio.sleep(5)
+            finally:
+                await pubsub.close()
+
+    @classmethod
+    def start(cls) -> None:
+        """
+        启动失效消息订阅任务，需要在redis连接初始化之后调用
+        :return:
+        """
+        if cls._listener is None:
+            cls._listener = asyncio.create_task(cls._listen())
+
+    @classmethod
+    async def stop(cls) -> None:
+        """
+        停止失效消息订阅任务
+        :return:
+        """
+        if cls._listener is None:
+            return
+        cls._listener.cancel()
+        try:
+            await cls._listener
+        except asyncio.CancelledError:
+            pass
+        cls._listener = None
@@ -16,6 +16,14 @@ class RedisException(APIException):
     status_code_enum = StatusCodeEnum.REDIS_OPERATE_ERROR
 
 
+class PaginationException(APIException):
+    status_code_enum = StatusCodeEnum.PARAMETER_VALIDATE_ERROR
+
+
+class BulkOperateException(APIException):
+    status_code_enum = StatusCodeEnum.PARAMETER_VALIDATE_ERROR
+
+
 class TokenTimeoutException(APIException):
     status_code_enum = StatusCodeEnum.TOKEN_TIMEOUT_ERROR
 
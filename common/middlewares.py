@@ -1,72 +1,130 @@
 import json
 import time
+from datetime import datetime
+from typing import List
 
+from app.models import consts
 from app.models.audit import OperatorAuditRecord
 from app.models.rbac import User
+from common.audit import audit_writer
+from config.setting import settings
 from core.security import get_current_username
-from fastapi import Request, FastAPI, Response
-from starlette.concurrency import iterate_in_threadpool
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
-from starlette.types import Message
+from fastapi import Request
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 
-class AuditMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app: FastAPI) -> None:
-        super().__init__(app)
+class BodyTee(object):
+    """
+    旁路截取报文，最多保留前 max_size 字节，报文本身不受影响
+    """
 
-    async def set_body(self, request: Request) -> None:
-        receive_ = await request._receive()
+    def __init__(self, max_size: int) -> None:
+        self._max_size = max_size
+        self._size = 0
+        self._chunks: List[bytes] = []
+        self.truncated: bool = False
 
-        async def receive() -> Message:
-            return receive_
+    def feed(self, chunk: bytes) -> None:
+        remain = self._max_size - self._size
+        if len(chunk) > remain:
+            self.truncated = True
+            chunk = chunk[:remain]
+        if chunk:
+            self._chunks.append(chunk)
+            self._size += len(chunk)
 
-        request._receive = receive
+    @property
+    def body(self) -> bytes:
+        return b"".join(self._chunks)
 
-    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint) -> Response:
+
+class AuditMiddleware(object):
+    """
+    纯ASGI实现的审计中间件
+    请求与响应报文按流原样透传，只截取前 AUDIT_BODY_MAX_SIZE 字节用于生成审计记录，大响应(导出、下载)不会被整体缓存
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self.max_body_size = settings.AUDIT_BODY_MAX_SIZE
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request = Request(scope)
+        request_method = request.method.upper()
+        request_url = request.url.path
         # GET请求直接放行，不记录GET请求日志
         # 如果是文件上传请求，则直接放行
-        if request.method.upper() == "GET" or request.url.path.startswith(("/api/v1/wiki/page/file", "/rearq")):
-            response = await call_next(request)
-            return response
+        if request_method == "GET" or request_url.startswith(("/api/v1/wiki/page/file", "/rearq")):
+            await self.app(scope, receive, send)
+            return
 
         # 获取响应前自定义操作
+        request_time = datetime.now()
         start_time = time.perf_counter()
-        await self.set_body(request)
-        body = await request.body()
-        request_method = request.method
+        is_login = request_url == "/api/v1/token" and request_method == "POST"
+        username = "" if is_login else await get_current_username(request)
 
-        try:
-            request_body = await request.json() if body else ""
-        except Exception:
-            request_body = ""
+        request_tee = BodyTee(self.max_body_size)
+        response_tee = BodyTee(self.max_body_size)
+        response_code = consts.RESPONSE_CODE
 
-        if request.url.path == "/api/v1/token" and request_method.upper() == "POST":
-            # 登录接口时，将请求报文中的密码加密，避免暴露
-            request_body["password"] = User.generate_hash(request_body.get("password"))
-            username = request_body.get("username")
-        else:
-            username = await get_current_username(request)
+        async def receive_wrapper() -> Message:
+            message = await receive()
+            if message["type"] == "http.request":
+                request_tee.feed(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal response_code
+            if message["type"] == "http.response.start":
+                response_code = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("X-Process-Time", str(round(time.perf_counter() - start_time, 5)))
+            elif message["type"] == "http.response.body":
+                response_tee.feed(message.get("body", b""))
+            await send(message)
 
         # 获取响应
-        response = await call_next(request)
+        await self.app(scope, receive_wrapper, send_wrapper)
 
         # 获取到响应后自定义操作
-        response_body = [chunk async for chunk in response.body_iterator]  # type: ignore
-        response.body_iterator = iterate_in_threadpool(iter(response_body))  # type: ignore
         process_time = time.perf_counter() - start_time
-        response.headers["X-Process-Time"] = str(round(process_time, 5))
 
         # 操作日志接口不记录日志
-        if not request.url.path.startswith(("/api/v1/audit/operator-history", "/api/v1/audit/ssh-history")):
-            # 记录操作日志
-            await OperatorAuditRecord.create(
-                username=username,
-                request_url=request.url.path,
-                request_method=request_method.upper(),
-                request_body=json.dumps(request_body),
-                response_code=response.status_code,
-                response_content=response_body[0].decode(),
-                process_time=float(round(process_time, 5)),
-            )
-
-        return response
+        if request_url.startswith(("/api/v1/audit/operator-history", "/api/v1/audit/ssh-history")):
+            return
+
+        body = request_tee.body
+        try:
+            request_body = json.loads(body) if body else ""
+        except Exception:
+            # 被截断的报文无法解析，保留截取到的原始内容
+            request_body = body.decode("utf-8", "ignore") if request_tee.truncated else ""
+
+        if is_login:
+            if isinstance(request_body, dict):
+                # 登录接口时，将请求报文中的密码加密，避免暴露
+                request_body["password"] = User.generate_hash(request_body.get("password"))
+                username = request_body.get("username")
+            else:
+                # 报文被截断或无法解析时无法单独处理密码，不记录请求报文
+                request_body = ""
+
+        # 记录操作日志，只入队不等待写库，由audit_writer批量刷盘
+        record = OperatorAuditRecord.build(
+            username=username,
+            request_url=request_url,
+            request_method=request_method,
+            request_body=json.dumps(request_body),
+            response_code=response_code,
+            response_content=response_tee.body.decode("utf-8", "ignore"),
+            truncated=request_tee.truncated or response_tee.truncated,
+            request_time=request_time,
+            process_time=float(round(process_time, 5)),
+        )
+        await audit_writer.put(record)
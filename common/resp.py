@@ -1,6 +1,10 @@
 import datetime
 from datetime import timedelta
+from decimal import Decimal
+from types import GeneratorType
+from typing import Any
 
+import orjson
 from app.schemas.resp import ResponseSchema, TypeEnum
 from common.code_msg import StatusCodeEnum
 from fastapi import status
@@ -10,6 +14,35 @@ from pydantic import BaseModel
 from tortoise.contrib.pydantic import PydanticModel
 
 
+def format_datetime(date_obj: datetime.datetime) -> str:
+    # 数据库中存储的是UTC时间，返回给前端时转换为东八区时间
+    return (date_obj + timedelta(hours=8)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _default(obj: Any) -> Any:
+    """
+    orjson不支持的类型按 jsonable_encoder 的规则转换，保证输出一致
+    :param obj:
+    :return:
+    """
+    if isinstance(obj, datetime.datetime):
+        return format_datetime(obj)
+    if isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, BaseModel):
+        return obj.dict(by_alias=True)
+    if isinstance(obj, Decimal):
+        # 与pydantic的decimal_encoder一致，没有小数位的Decimal输出为整数
+        return int(obj) if obj.as_tuple().exponent >= 0 else float(obj)  # type: ignore
+    if isinstance(obj, bytes):
+        return obj.decode()
+    if isinstance(obj, (set, frozenset, GeneratorType)):
+        return list(obj)
+    if isinstance(obj, timedelta):
+        return obj.total_seconds()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
 def ok(
     status_enum: StatusCodeEnum = StatusCodeEnum.OK,
     *,
@@ -21,20 +54,18 @@ def ok(
         _status = status_code
     else:
         _status = status_enum.status
-    return ORJSONResponse(
-        status_code=_status,
-        content=jsonable_encoder(
-            ResponseSchema(
-                code=status_enum.code,
-                message=status_enum.message,
-                result=data,
-                type=TypeEnum.SUCCESS,
-            ),
-            custom_encoder={
-                datetime.datetime: lambda date_obj: (date_obj + timedelta(hours=8)).strftime("%Y-%m-%d %H:%M:%S")
-            },
-        ),
+    # 直接使用orjson序列化，不再经过 ResponseSchema 校验和 jsonable_encoder 遍历，datetime交由_default统一格式化
+    content = orjson.dumps(
+        {
+            "code": status_enum.code,
+            "message": status_enum.message,
+            "result": data,
+            "type": TypeEnum.SUCCESS,
+        },
+        default=_default,
+        option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS,
     )
+    return Response(content=content, status_code=_status, media_type="application/json")
 
 
 def fail(*, status_enum: StatusCodeEnum, exception_detail: str) -> Response:
@@ -54,15 +54,103 @@ class Settings(BaseSettings):
 
     # SSH 连接超时
     SSH_CONNECT_TIMEOUT: int = 5
+    # SSH连接保活间隔(秒)
+    SSH_KEEPALIVE: int = 30
+    # 跳板机连接没有会话使用后保留的时间(秒)
+    SSH_JUMP_HOST_IDLE_TIMEOUT: int = 300
     # SSH是否统一走代理
     SSH_UNIT_PROXY: bool = False
     # SSH统一走代理时默认代理主机IP
     SSH_UNIT_PROXY_IP: str = ""
+    # web终端输出合并的时间窗口(秒)
+    TERMINAL_COALESCE_WINDOW: float = 0.01
+    # web终端输出合并的最大字节数
+    TERMINAL_COALESCE_SIZE: int = 64 * 1024
+    # web终端输出队列最大长度，队列满时暂停读取SSH通道
+    TERMINAL_OUTPUT_QUEUE_SIZE: int = 64
+    # web终端保留的最近输出字节数，重新连接时补发
+    TERMINAL_SCROLLBACK_SIZE: int = 256 * 1024
+    # web终端websocket断开后SSH会话保留的时间(秒)，期间可以重新连接
+    TERMINAL_DETACH_GRACE: int = 300
+    # web终端向只读观看者发送输出的超时时间(秒)，超时的观看者被移除
+    TERMINAL_WATCHER_SEND_TIMEOUT: float = 5.0
+    # web终端每个观看者的待发送输出队列长度，队列满的观看者被移除
+    TERMINAL_WATCHER_QUEUE_SIZE: int = 256
+    # 可以观看其他用户web终端的角色标识
+    TERMINAL_WATCH_ROLE: str = "admin"
+    # SSH审计记录中保留的最近命令条数，完整命令记录在SSH命令审计表中
+    SSH_COMMAND_SUMMARY_SIZE: int = 200
+    # 是否录制web终端会话
+    SSH_RECORD_ENABLED: bool = True
+    # 会话录像存储目录
+    SSH_RECORD_DIR: str = "/opt/ssh_record"
+    # 会话录像缓存的事件达到该字节数时写入文件
+    SSH_RECORD_BATCH_SIZE: int = 64 * 1024
+    # 会话录像最长写入间隔(秒)
+    SSH_RECORD_FLUSH_INTERVAL: float = 1.0
+    # 会话录像索引间隔(秒)，回放跳转时最多需要多解压该时长的数据
+    SSH_RECORD_INDEX_INTERVAL: float = 10.0
+    # 会话录像回放接口单次最多返回的事件数
+    SSH_RECORD_PLAYBACK_MAX_EVENTS: int = 5000
     # SFTP上传的目的目录
     SFTP_UPLOAD_DIR: str = "/tmp"
+    # SFTP下载每块读取的字节数
+    SFTP_CHUNK_SIZE: int = 256 * 1024
+    # SFTP传输进度消息最短发送间隔(秒)
+    SFTP_PROGRESS_INTERVAL: float = 0.5
+    # 流式执行的ansible作业在内存中保留的最近事件数
+    ANSIBLE_JOB_TAIL_SIZE: int = 1000
+    # 流式执行的ansible作业结束后保留的时间(秒)，期间可以查看事件
+    ANSIBLE_JOB_RETENTION: int = 600
+    # 每个作业事件订阅者的队列长度，订阅者消费过慢时从内存中的最近事件重新订阅
+    ANSIBLE_JOB_SUBSCRIBER_QUEUE_SIZE: int = 256
 
     # 代码克隆存储目录
     GIT_DEST_DIR: str = "/opt/git_file"
 
+    # 分页总数缓存时间(秒)
+    PAGINATION_COUNT_CACHE_TTL: int = 60
+    # 数据导出时每批读取的行数
+    EXPORT_CHUNK_SIZE: int = 1000
+    # 批量创建/更新/删除接口单次最多处理的数据条数
+    BULK_MAX_SIZE: int = 5000
+    # 进程内响应缓存最大条数
+    RESPONSE_CACHE_MAX_SIZE: int = 2000
+    # 超过该大小(字节)的响应报文不缓存
+    RESPONSE_CACHE_MAX_BODY_SIZE: int = 1024 * 1024
+    # 每个树结构缓存最多保存的范围(如不同的查询参数)数量
+    TREE_CACHE_MAX_SCOPES: int = 100
+    # wiki页面内容缓存最大条数
+    WIKI_PAGE_CONTENT_CACHE_SIZE: int = 500
+
+    # 审计记录缓冲队列最大长度
+    AUDIT_QUEUE_MAX_SIZE: int = 10000
+    # 审计记录每批次最多写入条数
+    AUDIT_BATCH_SIZE: int = 200
+    # 审计记录最长刷盘间隔(秒)
+    AUDIT_FLUSH_INTERVAL: float = 1.0
+    # 审计队列满时的处理策略，block：等待队列空闲，drop_new：丢弃新记录，drop_oldest：丢弃最旧的记录
+    AUDIT_DROP_POLICY: str = "block"
+    # block策略下最长等待时间(秒)，超时后丢弃该记录
+    AUDIT_BLOCK_TIMEOUT: float = 0.5
+    # 审计记录中请求/响应报文最多保留的字节数，超出部分截断
+    AUDIT_BODY_MAX_SIZE: int = 1024 * 16
+    # 审计记录报文是否压缩存储
+    AUDIT_BODY_COMPRESS: bool = True
+    # 审计记录报文压缩级别，1-9，越大压缩率越高、越耗CPU
+    AUDIT_BODY_COMPRESS_LEVEL: int = 6
+    # 请求与响应报文总长度小于该值时不压缩
+    AUDIT_BODY_COMPRESS_MIN_SIZE: int = 256
+    # 审计表是否按月分区(仅支持MySQL)，开启后由定时任务滚动创建分区并归档过期分区
+    AUDIT_PARTITION_ENABLED: bool = False
+    # 提前创建未来几个月的分区
+    AUDIT_PARTITION_PRECREATE_MONTHS: int = 3
+    # 审计数据在线保留月数，更早的分区导出归档后删除
+    AUDIT_PARTITION_RETAIN_MONTHS: int = 6
+    # 审计分区归档文件存储目录
+    AUDIT_ARCHIVE_DIR: str = "/opt/audit_archive"
+    # 归档导出时每批读取的行数
+    AUDIT_ARCHIVE_CHUNK_SIZE: int = 2000
+
 
 settings = Settings()
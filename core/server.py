@@ -4,7 +4,12 @@ from inspect import getmembers, isclass
 from pathlib import Path
 from typing import List
 
+from app.models.basis import HostGroup
 from app.models.cicd import CICDPlugin as CICDPluginModel
+from app.models.rbac import Department
+from app.services.audit import AuditPartitionService
+from common.audit import audit_writer
+from common.cache import TreeCache
 from common.error_handler import error_handlers
 from common.middlewares import AuditMiddleware
 from common.redis import redis_client
@@ -18,6 +23,7 @@ from starlette.staticfiles import StaticFiles
 from tasks import rearq_obj
 from tortoise import Tortoise, connections
 from utils.abstract import CICDPlugin
+from utils.ssh import jump_host_pool
 
 
 def create_app() -> FastAPI:
@@ -141,21 +147,38 @@ def register_event(app: FastAPI) -> None:
         await Tortoise.init(config=db.TORTOISE_ORM)
         # 挂载关系数据库连接对象到上下文
         app.state.db = connections.get("default")
+        # 闭包表为空时(首次上线)根据parent关系初始化
+        await HostGroup.rebuild_closure()
+        await Department.rebuild_closure()
+
+        # 启动审计记录批量写入任务
+        audit_writer.start()
 
         # 连接redis
         await redis_client.init_redis_connect()
 
+        # 订阅树结构缓存失效消息，并在后台预先组装树结构
+        TreeCache.start()
+        TreeCache.warm_up()
+
         # 初始化rearq
         await rearq_obj.init()
 
         # 初始化 apscheduler
         schedule.init_scheduler()
+        register_schedule_jobs()
 
         # 注册CICD插件
         await register_cicd_plugins(app)
 
     @app.on_event("shutdown")
     async def shutdown_connect() -> None:
+        # 审计记录刷盘，需要在关闭ORM连接之前
+        await audit_writer.stop()
+
+        # 停止树结构缓存失效消息订阅
+        await TreeCache.stop()
+
         # 关闭 ORM 连接
         await connections.close_all()
 
@@ -165,6 +188,25 @@ def register_event(app: FastAPI) -> None:
         # 关闭schedule
         schedule.shutdown()
 
+        # 关闭跳板机连接
+        jump_host_pool.close_all()
+
+
+def register_schedule_jobs() -> None:
+    """
+    注册系统定时任务
+    :return:
+    """
+    if settings.AUDIT_PARTITION_ENABLED:
+        # 每天凌晨滚动审计表分区
+        schedule.add_job(
+            AuditPartitionService.rollover,
+            "cron",
+            hour=2,
+            id="audit_partition_rollover",
+            replace_existing=True,
+        )
+
 
 def register_rearq(app: FastAPI) -> None:
     """
@@ -0,0 +1,27 @@
+import asyncio
+
+from app.models.basis import Environment
+from pydantic import BaseModel
+from tortoise import Tortoise
+
+
+class EnvironmentReq(BaseModel):
+    name: str
+
+
+async def _create_many_with_duplicate() -> None:
+    await Tortoise.init(db_url="sqlite://:memory:", modules={"models": ["app.models.basis", "app.models.rbac"]})
+    await Tortoise.generate_schemas()
+    try:
+        items = [EnvironmentReq(name="dev"), EnvironmentReq(name="test"), EnvironmentReq(name="dev")]
+        count, errors = await Environment.create_many(items, None)  # type: ignore
+        # 整个事务回滚，并返回出错数据的下标
+        assert count == 0
+        assert [error["index"] for error in errors] == [2]
+        assert await Environment.all().count() == 0
+    finally:
+        await Tortoise.close_connections()
+
+
+def test_create_many_reports_integrity_error_index() -> None:
+    asyncio.run(_create_many_with_duplicate())
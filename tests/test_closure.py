@@ -0,0 +1,34 @@
+import asyncio
+from typing import List, Tuple
+
+from app.models.basis import HostGroup, HostGroupClosure
+from tortoise import Tortoise
+
+
+async def _closure_rows() -> List[Tuple[int, int, int]]:
+    return sorted(await HostGroupClosure.all().values_list("ancestor_id", "descendant_id", "depth"))  # type: ignore
+
+
+async def _rebuild_with_soft_deleted_parent() -> None:
+    await Tortoise.init(db_url="sqlite://:memory:", modules={"models": ["app.models.basis", "app.models.rbac"]})
+    await Tortoise.generate_schemas()
+    try:
+        parent = await HostGroup.create(name="parent")
+        child = await HostGroup.create(name="child", parent_id=parent.id)
+        grandchild = await HostGroup.create(name="grandchild", parent_id=child.id)
+        await HostGroup.rebuild_closure(force=True)
+        # 逻辑删除父节点，增量维护的结果作为重建结果的参照
+        await HostGroup.delete_one(str(parent.id), None)  # type: ignore
+        incremental = await _closure_rows()
+
+        await HostGroup.rebuild_closure(force=True)
+        assert await _closure_rows() == incremental
+        # 父节点被删除后，子节点仍能查到自身及其后代
+        descendant_ids = await HostGroup.filter(id__in=HostGroup.descendants_of(child.id)).values_list("id", flat=True)
+        assert sorted(descendant_ids) == [child.id, grandchild.id]
+    finally:
+        await Tortoise.close_connections()
+
+
+def test_rebuild_closure_with_soft_deleted_parent() -> None:
+    asyncio.run(_rebuild_with_soft_deleted_parent())
@@ -0,0 +1,15 @@
+from decimal import Decimal
+
+import orjson
+from common.resp import _default
+from fastapi.encoders import jsonable_encoder
+
+
+def test_decimal_matches_jsonable_encoder() -> None:
+    for value in (Decimal("1"), Decimal("100"), Decimal("1.0"), Decimal("1.50"), Decimal("-3")):
+        assert orjson.loads(orjson.dumps(value, default=_default)) == jsonable_encoder(value)
+        assert type(_default(value)) is type(jsonable_encoder(value))
+
+
+def test_integral_decimal_is_int() -> None:
+    assert orjson.dumps({"count": Decimal("1")}, default=_default) == b'{"count":1}'
@@ -0,0 +1,52 @@
+from typing import List, Tuple
+
+from app.services.terminal import TerminalService
+
+PROMPT = "\x1b]0;root@web-01:~\x07[root@web-01 ~]# "
+
+
+def _run(session: TerminalService, steps: List[str]) -> List[Tuple[str, bool]]:
+    """
+    依次输入命令，以 > 开头的为终端输出
+    """
+    result = []
+    for step in steps:
+        if step.startswith(">"):
+            session.check_prompt(step[1:])
+            continue
+        for char in step:
+            session.gen_cmd(char)
+        command = session.gen_cmd("\r")
+        result.append(session.handle_cmd(command))  # type: ignore
+    return result
+
+
+def test_vim_edit_is_flagged() -> None:
+    result = _run(TerminalService(None, "u"), ["vim a.txt", "i", "hello", ":wq", "ls"])  # type: ignore
+    assert result == [("vim a.txt", False), ("i", True), ("hello", True), (":wq", True), ("ls", False)]
+
+
+def test_editor_not_started_is_reset_by_prompt() -> None:
+    for command in ("vim --version", "vim -c q a.txt", "fg"):
+        session = TerminalService(None, "u")  # type: ignore
+        result = _run(session, [command, f">output\r\n{PROMPT}", "rm -rf /tmp/a"])
+        assert result == [(command, False), ("rm -rf /tmp/a", False)]
+
+
+def test_prompt_inside_editor_output_needs_last_line() -> None:
+    session = TerminalService(None, "u")  # type: ignore
+    result = _run(session, ["vi a.txt", f">{PROMPT}\r\n~\r\n~", "dd"])
+    assert result == [("vi a.txt", False), ("dd", True)]
+
+
+def test_ctrl_z_leaves_editor() -> None:
+    session = TerminalService(None, "u")  # type: ignore
+    result = _run(session, ["vim a.txt", "x\x1a", "\x1acat a.txt", "fg", ":q!", "pwd"])
+    assert result == [
+        ("vim a.txt", False),
+        ("x\x1a", True),
+        ("cat a.txt", False),
+        ("fg", False),
+        (":q!", True),
+        ("pwd", False),
+    ]
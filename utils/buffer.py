@@ -0,0 +1,33 @@
+class RingBuffer(object):
+    """
+    固定容量的字节环形缓冲区，只保留最近写入的数据，按写入以来的绝对偏移量读取
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self._capacity = capacity
+        self._buffer = bytearray()
+        # 已写入的总字节数，即最后一个字节之后的绝对偏移量
+        self.end: int = 0
+
+    @property
+    def start(self) -> int:
+        """
+        缓冲区中最早一个字节的绝对偏移量
+        :return:
+        """
+        return self.end - len(self._buffer)
+
+    def write(self, data: bytes) -> None:
+        self._buffer.extend(data)
+        self.end += len(data)
+        if len(self._buffer) > self._capacity:
+            del self._buffer[: len(self._buffer) - self._capacity]
+
+    def read_from(self, offset: int) -> bytes:
+        """
+        读取从绝对偏移量开始到末尾的数据，早于缓冲区的部分已被丢弃，从缓冲区开头读取
+        :param offset: 绝对偏移量
+        :return:
+        """
+        offset = min(max(offset, self.start), self.end)
+        return bytes(self._buffer[offset - self.start :])
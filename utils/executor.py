@@ -1,3 +1,5 @@
+from typing import Any, Callable, Dict
+
 import ansible_runner
 from ansible_runner import Runner
 from ansible_runner.streaming import Transmitter, Worker, Processor
@@ -16,6 +18,21 @@ class AnsibleExecutor(RemoteExecutor):
 
         return r.stdout.read()
 
+    @classmethod
+    async def _run_stream(cls, event_handler: Callable[[Dict], bool], **kwargs: Any) -> Dict[str, Any]:
+        """
+        执行过程中每产生一个事件即调用 event_handler，event_handler 在执行线程中调用
+        :param event_handler: 事件回调
+        :param kwargs: ansible_runner.run 参数
+        :return: status: 执行状态，rc: 返回码，stats: 各主机执行结果统计
+        """
+
+        def run_for_status() -> Dict[str, Any]:
+            r = ansible_runner.run(event_handler=event_handler, **kwargs)
+            return {"status": r.status, "rc": r.rc, "stats": r.stats}
+
+        return await run_async(run_for_status)
+
     @classmethod
     async def exec_module(cls, **kwargs) -> str:  # type: ignore
         result = await cls._run(
@@ -41,3 +58,31 @@ class AnsibleExecutor(RemoteExecutor):
             quiet=True,
         )
         return result
+
+    @classmethod
+    async def stream_module(cls, event_handler: Callable[[Dict], bool], **kwargs) -> Dict[str, Any]:  # type: ignore
+        result = await cls._run_stream(
+            event_handler,
+            private_data_dir=kwargs.get("data_dir", "/tmp"),
+            inventory=kwargs.get("inventory", "/etc/ansible/hosts"),
+            host_pattern=kwargs.get("host_pattern", "*"),
+            module=kwargs.get("module", "shell"),
+            module_args=kwargs.get("module_args", ""),
+            extravars=kwargs.get("extra_vars", {}),
+            forks=kwargs.get("forks", 10),
+            quiet=True,
+        )
+        return result
+
+    @classmethod
+    async def stream_task(cls, event_handler: Callable[[Dict], bool], **kwargs) -> Dict[str, Any]:  # type: ignore
+        result = await cls._run_stream(
+            event_handler,
+            private_data_dir=kwargs.get("data_dir", "/tmp"),
+            inventory=kwargs.get("inventory", "/etc/ansible/hosts"),
+            playbook=kwargs.get("playbook", ""),
+            extravars=kwargs.get("extra_vars", {}),
+            forks=kwargs.get("forks", 10),
+            quiet=True,
+        )
+        return result
@@ -0,0 +1,189 @@
+import asyncio
+import gzip
+import time
+from bisect import bisect_right
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import orjson
+from common.log import Log
+from common.make import run_async
+
+
+class SessionRecorder(object):
+    """
+    终端会话录像，文件格式为 asciicast v2：第一行为头信息，之后每行一个事件 [相对秒数, 类型, 数据]
+    类型 o 为输出，i 为输入，r 为终端大小变化
+    事件先缓存在内存中，按批次大小或时间间隔在线程池中压缩为一个独立的gzip成员追加写入文件，
+    多个gzip成员拼接后仍是合法的gzip文件。索引文件记录gzip成员的起始时间与偏移量，回放时从最近的成员开始解压
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        *,
+        width: int,
+        height: int,
+        title: str,
+        batch_size: int,
+        flush_interval: float,
+        index_interval: float,
+    ) -> None:
+        self._path = Path(file_path)
+        self._index_path = self.index_path(file_path)
+        self._header = {
+            "version": 2,
+            "width": width,
+            "height": height,
+            "timestamp": int(time.time()),
+            "title": title,
+            "env": {"TERM": "xterm-256color"},
+        }
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._index_interval = index_interval
+        self._start = time.monotonic()
+        self._events: List[bytes] = []
+        self._events_size: int = 0
+        # 当前批次第一个事件的相对时间
+        self._batch_time: float = 0.0
+        self._offset: int = 0
+        self._last_index_time: float | None = None
+        self._wakeup: asyncio.Event = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._closing: bool = False
+        # 保证批次按顺序写入
+        self._write_lock: asyncio.Lock = asyncio.Lock()
+
+    @staticmethod
+    def index_path(file_path: str) -> Path:
+        return Path(f"{file_path}.idx")
+
+    def _write_member(self, data: bytes, batch_time: float) -> None:
+        """
+        压缩并追加写入一个gzip成员，达到索引间隔时记录该成员的起始时间与偏移量
+        :param data: 事件数据
+        :param batch_time: 批次第一个事件的相对时间
+        :return:
+        """
+        member = gzip.compress(data)
+        with open(self._path, "ab") as f:
+            f.write(member)
+        if self._last_index_time is None or batch_time - self._last_index_time >= self._index_interval:
+            with open(self._index_path, "ab") as f:
+                f.write(orjson.dumps([round(batch_time, 6), self._offset]) + b"\n")
+            self._last_index_time = batch_time
+        self._offset += len(member)
+
+    async def start(self) -> None:
+        """
+        写入头信息并启动后台刷盘任务
+        :return:
+        """
+        await run_async(self._path.parent.mkdir, parents=True, exist_ok=True)
+        async with self._write_lock:
+            await run_async(self._write_member, orjson.dumps(self._header) + b"\n", 0.0)
+        self._task = asyncio.create_task(self._run())
+
+    def record(self, event_type: str, data: str) -> None:
+        """
+        记录一个事件，只写入内存，不阻塞
+        :param event_type: 事件类型
+        :param data: 事件数据
+        :return:
+        """
+        if not data:
+            return
+        elapsed = round(time.monotonic() - self._start, 6)
+        if not self._events:
+            self._batch_time = elapsed
+        line = orjson.dumps([elapsed, event_type, data]) + b"\n"
+        self._events.append(line)
+        self._events_size += len(line)
+        if self._events_size >= self._batch_size:
+            self._wakeup.set()
+
+    async def flush(self) -> None:
+        if not self._events:
+            return
+        data, batch_time = b"".join(self._events), self._batch_time
+        self._events = []
+        self._events_size = 0
+        async with self._write_lock:
+            await run_async(self._write_member, data, batch_time)
+
+    async def _run(self) -> None:
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                Log.warning(f"write session record {self._path} error: {e}")
+
+    async def close(self) -> None:
+        """
+        停止后台刷盘任务，并写入剩余的事件
+        不能取消刷盘任务，取消后线程池中的写入仍在进行，与这里的写入同时修改偏移量会导致索引错误
+        :return:
+        """
+        self._closing = True
+        if self._task:
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    @classmethod
+    def _load_index(cls, file_path: str) -> Tuple[List[float], List[int]]:
+        times: List[float] = []
+        offsets: List[int] = []
+        index_path = cls.index_path(file_path)
+        if index_path.exists():
+            with open(index_path, "rb") as f:
+                for line in f:
+                    index_time, offset = orjson.loads(line)
+                    times.append(index_time)
+                    offsets.append(offset)
+        return times, offsets
+
+    @classmethod
+    def read_events(cls, file_path: str, start: float, end: float | None, limit: int) -> Dict[str, Any]:
+        """
+        读取时间范围内的事件，根据索引从不晚于开始时间的最近一个gzip成员开始解压
+        :param file_path: 录像文件路径
+        :param start: 开始时间(秒)
+        :param end: 结束时间(秒)，为空时读取到文件末尾
+        :param limit: 最多返回的事件数
+        :return: header: 头信息，events: 事件，next: 未读完时下一次读取的开始时间
+        """
+        times, offsets = cls._load_index(file_path)
+        offset = offsets[bisect_right(times, start) - 1] if times and times[0] <= start else 0
+        events: List[Any] = []
+        next_time = None
+        with open(file_path, "rb") as f:
+            # 头信息在第一个gzip成员中
+            with gzip.open(f, "rb") as reader:
+                header = orjson.loads(reader.readline())
+            f.seek(offset)
+            with gzip.open(f, "rb") as reader:
+                try:
+                    for line in reader:
+                        event = orjson.loads(line)
+                        if isinstance(event, dict):
+                            continue
+                        if event[0] < start:
+                            continue
+                        if end is not None and event[0] > end:
+                            break
+                        if len(events) >= limit:
+                            next_time = event[0]
+                            break
+                        events.append(event)
+                except (EOFError, orjson.JSONDecodeError):
+                    # 会话进行中回放时，最后一个gzip成员可能还没有写完整，返回已读取的事件
+                    pass
+        return {"header": header, "events": events, "next": next_time}
@@ -0,0 +1,138 @@
+import threading
+import time
+from typing import Dict, Tuple
+
+import paramiko  # type: ignore
+from common.log import Log
+from config.setting import settings
+from paramiko import SSHClient, Transport
+
+
+class _PooledTransport(object):
+    def __init__(self, client: SSHClient) -> None:
+        self.client = client
+        self.ref_count: int = 0
+        self.last_used: float = time.monotonic()
+        self.evict_timer: threading.Timer | None = None
+
+    @property
+    def transport(self) -> Transport:
+        return self.client.get_transport()
+
+    def is_healthy(self) -> bool:
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active() and transport.is_authenticated()
+
+
+class JumpHostPool(object):
+    """
+    跳板机SSH连接池，同一跳板机(主机、端口、用户)只建立一个已认证的Transport，多个目标主机会话通过 direct-tcpip 通道复用
+    按引用计数管理，没有会话使用且空闲超时后关闭连接；获取时检查连接是否可用，不可用则重新建立
+    paramiko为阻塞调用，在线程池中执行，使用线程锁保护
+    """
+
+    def __init__(self, *, idle_timeout: int, keepalive: int) -> None:
+        self._idle_timeout = idle_timeout
+        self._keepalive = keepalive
+        self._lock = threading.Lock()
+        # 每个跳板机单独的建连锁，不同跳板机之间建连互不阻塞
+        self._connect_locks: Dict[Tuple, threading.Lock] = {}
+        self._entries: Dict[Tuple, _PooledTransport] = {}
+
+    def _connect(self, hostname: str, port: int, username: str, password: str) -> _PooledTransport:
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(
+            hostname=hostname,
+            username=username,
+            port=port,
+            password=password,
+            timeout=settings.SSH_CONNECT_TIMEOUT,
+        )
+        client.get_transport().set_keepalive(self._keepalive)
+        return _PooledTransport(client=client)
+
+    def acquire(self, hostname: str, port: int, username: str, password: str) -> Transport:
+        """
+        获取跳板机连接，引用计数加一，使用完后需要调用 release
+        :param hostname: 跳板机地址
+        :param port: 跳板机端口
+        :param username: 登录用户
+        :param password: 登录密码
+        :return:
+        """
+        key = (hostname, port, username)
+        with self._lock:
+            connect_lock = self._connect_locks.setdefault(key, threading.Lock())
+        with connect_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry and entry.is_healthy():
+                    return self._use(entry)
+                if entry:
+                    # 连接已断开，正在使用的会话会自行失败，这里只替换为新连接
+                    self._entries.pop(key)
+                    self._close(entry)
+            new_entry = self._connect(hostname, port, username, password)
+            with self._lock:
+                self._entries[key] = new_entry
+                return self._use(new_entry)
+
+    def _use(self, entry: _PooledTransport) -> Transport:
+        entry.ref_count += 1
+        entry.last_used = time.monotonic()
+        if entry.evict_timer:
+            entry.evict_timer.cancel()
+            entry.evict_timer = None
+        return entry.transport
+
+    def release(self, transport: Transport) -> None:
+        """
+        会话结束时引用计数减一，没有会话使用时开始空闲计时
+        :param transport: acquire 获取的跳板机连接
+        :return:
+        """
+        with self._lock:
+            # 连接断开后已被新连接替换时，不影响新连接的引用计数
+            key, entry = next(
+                ((key, entry) for key, entry in self._entries.items() if entry.transport is transport), (None, None)
+            )
+            if entry is None:
+                return
+            entry.ref_count = max(entry.ref_count - 1, 0)
+            entry.last_used = time.monotonic()
+            if entry.ref_count == 0 and entry.evict_timer is None:
+                entry.evict_timer = threading.Timer(self._idle_timeout, self._evict, args=(key, entry))
+                entry.evict_timer.daemon = True
+                entry.evict_timer.start()
+
+    def _evict(self, key: Tuple[str, int, str], entry: _PooledTransport) -> None:
+        with self._lock:
+            if self._entries.get(key) is not entry or entry.ref_count > 0:
+                return
+            self._entries.pop(key)
+        self._close(entry)
+        Log.info(f"close idle jump host connection {key[2]}@{key[0]}:{key[1]}")
+
+    @staticmethod
+    def _close(entry: _PooledTransport) -> None:
+        if entry.evict_timer:
+            entry.evict_timer.cancel()
+        try:
+            entry.client.close()
+        except Exception as e:
+            Log.warning(f"close jump host connection error: {e}")
+
+    def close_all(self) -> None:
+        """
+        关闭所有跳板机连接
+        :return:
+        """
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            self._close(entry)
+
+
+jump_host_pool = JumpHostPool(idle_timeout=settings.SSH_JUMP_HOST_IDLE_TIMEOUT, keepalive=settings.SSH_KEEPALIVE)